@@ -0,0 +1,120 @@
+import importlib.util
+import pathlib
+import typing as t
+
+import pytest
+
+from mara_storage import storages
+from mara_storage.client import StorageClient
+
+from . import emulators
+
+
+BACKENDS = ['memory', 'local', 'gcs', 'azure', 'sftp']
+
+
+class Backend:
+    """A storage configuration plus a client connected to its local stand-in"""
+
+    def __init__(self, name: str, storage: storages.Storage, client: StorageClient,
+                 put: t.Callable[[str, bytes], None]):
+        self.name = name
+        self.storage = storage
+        self.client = client
+        self.put = put
+
+    def __repr__(self) -> str:
+        return f'<Backend: {self.name}>'
+
+
+def _memory_backend(tmp_path: pathlib.Path) -> t.Iterator[Backend]:
+    """The zero-I/O floor: the per-backend overhead is the difference to this one"""
+    from mara_storage import manage
+
+    storage = storages.MemoryStorage(name=f'benchmark-{tmp_path.name}')
+    manage.ensure_storage(storage)
+    client = StorageClient(storage)
+    try:
+        yield Backend('memory', storage, client, client.write_file)
+    finally:
+        manage.drop_storage(storage, force=True)
+
+
+def _local_backend(tmp_path: pathlib.Path) -> t.Iterator[Backend]:
+    storage = storages.LocalStorage(tmp_path / 'local-storage')
+    storage.base_path.mkdir()
+
+    def put(name: str, data: bytes):
+        path = storage.base_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    yield Backend('local', storage, StorageClient(storage), put)
+
+
+def _gcs_backend(tmp_path: pathlib.Path) -> t.Iterator[Backend]:
+    if not importlib.util.find_spec('google.cloud.storage'):
+        pytest.skip('module google.cloud.storage could not be found')
+    import google.auth.credentials
+    import google.cloud.storage
+    from mara_storage.google_cloud_storage import GoogleCloudStorageModuleClient
+
+    with emulators.FakeGcsServer() as server:
+        storage = storages.GoogleCloudStorage(bucket_name='mara-storage-benchmark')
+        client = GoogleCloudStorageModuleClient(storage)
+        client._GoogleCloudStorageModuleClient__client = google.cloud.storage.Client(
+            project='mara-storage-benchmark',
+            credentials=google.auth.credentials.AnonymousCredentials(),
+            client_options={'api_endpoint': server.url})
+
+        yield Backend('gcs', storage, client,
+                      lambda name, data: server.put(storage.bucket_name, name, data))
+
+
+def _azure_backend(tmp_path: pathlib.Path) -> t.Iterator[Backend]:
+    if not importlib.util.find_spec('azure.storage.blob'):
+        pytest.skip('module azure.storage.blob could not be found')
+    import azure.storage.blob
+
+    with emulators.FakeAzureBlobServer() as server:
+        storage = storages.AzureStorage(account_name=server.ACCOUNT_NAME,
+                                        account_key=server.ACCOUNT_KEY,
+                                        container_name='mara-storage-benchmark')
+        client = StorageClient(storage)
+        client._AzureStorageClient__blob_service_client = \
+            azure.storage.blob.BlobServiceClient.from_connection_string(server.connection_string)
+
+        yield Backend('azure', storage, client,
+                      lambda name, data: server.put(storage.container_name, name, data))
+
+
+def _sftp_backend(tmp_path: pathlib.Path) -> t.Iterator[Backend]:
+    if not importlib.util.find_spec('pysftp') or not emulators._LocalSftpServerInterface:
+        pytest.skip('modules pysftp and paramiko are required')
+
+    root = tmp_path / 'sftp-root'
+    root.mkdir()
+    with emulators.SftpServer(str(root)) as server:
+        storage = storages.SftpStorage(host='127.0.0.1', port=server.port, user='benchmark',
+                                       password='benchmark', insecure=True)
+        client = StorageClient(storage)
+
+        def put(name: str, data: bytes):
+            path = root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+
+        try:
+            yield Backend('sftp', storage, client, put)
+        finally:
+            client.close()
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path: pathlib.Path) -> t.Iterator[Backend]:
+    """A storage backend running against a local stand-in, parametrized over all backends"""
+    yield from {'memory': _memory_backend,
+                'local': _local_backend,
+                'gcs': _gcs_backend,
+                'azure': _azure_backend,
+                'sftp': _sftp_backend}[request.param](tmp_path)
@@ -0,0 +1,576 @@
+"""
+In-process stand-ins for the remote storages so that the benchmarks run offline
+
+- `FakeGcsServer`: the subset of the Google Cloud Storage JSON API used by `google-cloud-storage`
+- `FakeAzureBlobServer`: the subset of the Azure Blob REST API used by `azure-storage-blob`
+  (Azurite-style addressing, authentication is not checked)
+- `SftpServer`: a paramiko based SFTP server serving a local directory
+
+The servers keep their data in memory (resp. in a local directory for SFTP), add no
+artificial latency and only implement what the clients of this package call.
+"""
+
+import datetime
+import email.utils
+import hashlib
+import http.server
+import json
+import os
+import re
+import socket
+import threading
+import typing as t
+import urllib.parse
+import uuid
+
+
+class _Blob:
+    __slots__ = ('data', 'last_modified', 'etag', 'generation', 'component_count', 'blob_type', 'block_count')
+
+    def __init__(self, data: bytes, component_count: int = None, blob_type: str = 'BlockBlob', block_count: int = 0):
+        self.data = data
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc)
+        self.etag = hashlib.md5(data).hexdigest() + (f'-{block_count}' if block_count else '')
+        self.generation = int(self.last_modified.timestamp() * 1_000_000)
+        self.component_count = component_count  # GCS composite objects
+        self.blob_type = blob_type  # Azure
+        self.block_count = block_count  # Azure append blobs
+
+
+class _ThreadingHttpServer:
+    """Runs a `http.server` request handler in a background thread"""
+
+    def __init__(self, handler_class: t.Type[http.server.BaseHTTPRequestHandler]):
+        self.blobs: t.Dict[str, t.Dict[str, _Blob]] = {}  # container/bucket -> name -> blob
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(handler_class):
+            emulator = server
+
+        self._httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def put(self, container: str, name: str, data: bytes):
+        with self.lock:
+            self.blobs.setdefault(container, {})[name] = _Blob(data)
+
+    def list(self, container: str, prefix: str, delimiter: str = '') -> t.List[t.Tuple[str, t.Optional[_Blob]]]:
+        """
+        Lists the blobs starting with `prefix` in name order. With a delimiter, names continuing
+        after the next delimiter are rolled up into one prefix entry (with blob None).
+        """
+        with self.lock:
+            blobs = sorted((name, blob) for name, blob in self.blobs.get(container, {}).items()
+                           if name.startswith(prefix))
+        if not delimiter:
+            return blobs
+        entries = {}
+        for name, blob in blobs:
+            index = name.find(delimiter, len(prefix))
+            if index >= 0:
+                entries[name[:index + len(delimiter)]] = None
+            else:
+                entries[name] = blob
+        return sorted(entries.items())
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid waiting for delayed ACKs
+    disable_nagle_algorithm = True
+    emulator: _ThreadingHttpServer = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status: int, body: bytes = b'', headers: t.Dict[str, str] = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+# -----------------------------------------------------------------------------
+
+
+class _GcsHandler(_RequestHandler):
+    def _object_resource(self, bucket: str, name: str, blob: _Blob) -> dict:
+        return {'kind': 'storage#object',
+                'id': f'{bucket}/{name}/{blob.generation}',
+                'name': name,
+                'bucket': bucket,
+                'generation': str(blob.generation),
+                'size': str(len(blob.data)),
+                'etag': blob.etag,
+                'updated': blob.last_modified.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                'timeCreated': blob.last_modified.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                **({'componentCount': blob.component_count} if blob.component_count else {})}
+
+    def _precondition_failed(self, bucket: str, name: str, query: dict) -> bool:
+        """Sends an error and returns True when the `ifGenerationMatch` precondition of a request is not met"""
+        if 'ifGenerationMatch' not in query:
+            return False
+        blob = self.emulator.blobs.get(bucket, {}).get(name)
+        if int(query['ifGenerationMatch']) == (blob.generation if blob else 0):
+            return False
+        self._send_json(412, {'error': {'code': 412, 'message': 'At least one of the pre-conditions you specified did not hold.'}})
+        return True
+
+    def _send_json(self, status: int, resource: dict):
+        self._send(status, json.dumps(resource).encode(), {'Content-Type': 'application/json'})
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        match = re.fullmatch(r'/storage/v1/b/([^/]+)/o', url.path)
+        if match:
+            bucket = match.group(1)
+            blobs = self.emulator.list(bucket, query.get('prefix', ''), query.get('delimiter', ''))
+            page_size = int(query.get('maxResults', 1000))
+            start = int(query.get('pageToken', 0))
+            page = blobs[start:start + page_size]
+            resource = {'kind': 'storage#objects',
+                        'items': [self._object_resource(bucket, name, blob) for name, blob in page if blob],
+                        'prefixes': [name for name, blob in page if not blob]}
+            if start + page_size < len(blobs):
+                resource['nextPageToken'] = str(start + page_size)
+            return self._send_json(200, resource)
+
+        match = re.fullmatch(r'(/download)?/storage/v1/b/([^/]+)/o/(.+)', url.path)
+        if match:
+            bucket, name = match.group(2), urllib.parse.unquote(match.group(3))
+            blob = self.emulator.blobs.get(bucket, {}).get(name)
+            if not blob:
+                return self._send_json(404, {'error': {'code': 404, 'message': 'No such object'}})
+            if query.get('alt') == 'media':
+                headers = {'Content-Type': 'application/octet-stream', 'x-goog-generation': str(blob.generation)}
+                range_match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range') or '')
+                if range_match:
+                    start = int(range_match.group(1))
+                    end = min(int(range_match.group(2)) if range_match.group(2) else len(blob.data) - 1, len(blob.data) - 1)
+                    headers['Content-Range'] = f'bytes {start}-{end}/{len(blob.data)}'
+                    return self._send(206, blob.data[start:end + 1], headers)
+                return self._send(200, blob.data, headers)
+            return self._send_json(200, self._object_resource(bucket, name, blob))
+
+        self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        body = self._read_body()
+
+        match = re.fullmatch(r'/upload/storage/v1/b/([^/]+)/o', url.path)
+        if match and query.get('uploadType') == 'multipart':
+            bucket = match.group(1)
+            boundary = re.search(r'boundary="?([^";]+)"?', self.headers['Content-Type']).group(1).encode()
+            # parts: preamble, metadata part, media part, epilogue
+            parts = body.split(b'--' + boundary)
+            metadata = json.loads(parts[1].split(b'\r\n\r\n', 1)[1])
+            data = parts[2].split(b'\r\n\r\n', 1)[1][:-2]  # strip the trailing CRLF
+            if self._precondition_failed(bucket, metadata['name'], query):
+                return
+            self.emulator.put(bucket, metadata['name'], data)
+            return self._send_json(200, self._object_resource(bucket, metadata['name'], self.emulator.blobs[bucket][metadata['name']]))
+
+        match = re.fullmatch(r'/storage/v1/b/([^/]+)/o/(.+)/compose', url.path)
+        if match:
+            bucket, name = match.group(1), urllib.parse.unquote(match.group(2))
+            if self._precondition_failed(bucket, name, query):
+                return
+            with self.emulator.lock:
+                blobs = self.emulator.blobs.setdefault(bucket, {})
+                sources = [blobs.get(source['name']) for source in json.loads(body)['sourceObjects']]
+                if not all(sources):
+                    return self._send_json(404, {'error': {'code': 404, 'message': 'No such object'}})
+                blobs[name] = _Blob(b''.join(source.data for source in sources),
+                                    component_count=sum(source.component_count or 1 for source in sources))
+            return self._send_json(200, self._object_resource(bucket, name, blobs[name]))
+
+        self._send_json(404, {'error': {'code': 404, 'message': 'Not found'}})
+
+    def do_DELETE(self):
+        match = re.fullmatch(r'/storage/v1/b/([^/]+)/o/(.+)', urllib.parse.urlparse(self.path).path)
+        with self.emulator.lock:
+            blobs = self.emulator.blobs.get(match.group(1), {}) if match else {}
+            if not match or blobs.pop(urllib.parse.unquote(match.group(2)), None) is None:
+                return self._send_json(404, {'error': {'code': 404, 'message': 'No such object'}})
+        self._send(204)
+
+
+class FakeGcsServer(_ThreadingHttpServer):
+    """
+    An in-memory Google Cloud Storage JSON API
+
+    Example:
+        with FakeGcsServer() as server:
+            client = google.cloud.storage.Client(
+                project='test', credentials=google.auth.credentials.AnonymousCredentials(),
+                client_options={'api_endpoint': server.url})
+    """
+    def __init__(self):
+        super().__init__(_GcsHandler)
+
+
+# -----------------------------------------------------------------------------
+
+
+class _AzureBlobHandler(_RequestHandler):
+    def _split_path(self) -> t.Tuple[str, str, dict]:
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        # Azurite-style path: /<account>/<container>/<blob>
+        parts = urllib.parse.unquote(url.path).lstrip('/').split('/', 2)
+        container = parts[1] if len(parts) > 1 else ''
+        name = parts[2] if len(parts) > 2 else ''
+        return container, name, query
+
+    def _blob_headers(self, blob: _Blob) -> t.Dict[str, str]:
+        return {'ETag': f'"{blob.etag}"',
+                'Last-Modified': email.utils.format_datetime(blob.last_modified, usegmt=True),
+                'x-ms-creation-time': email.utils.format_datetime(blob.last_modified, usegmt=True),
+                'x-ms-blob-type': blob.blob_type,
+                'x-ms-version': '2021-08-06',
+                'Content-Type': 'application/octet-stream',
+                **({'x-ms-blob-committed-block-count': str(blob.block_count)} if blob.blob_type == 'AppendBlob' else {})}
+
+    def _not_found(self):
+        body = b'<?xml version="1.0" encoding="utf-8"?><Error><Code>BlobNotFound</Code><Message>The specified blob does not exist.</Message></Error>'
+        self._send(404, body, {'x-ms-error-code': 'BlobNotFound', 'Content-Type': 'application/xml'})
+
+    def do_GET(self):
+        container, name, query = self._split_path()
+
+        if query.get('comp') == 'list':
+            blobs = self.emulator.list(container, query.get('prefix', ''), query.get('delimiter', ''))
+            page_size = int(query.get('maxresults', 5000))
+            start = int(query.get('marker') or 0)
+            page = blobs[start:start + page_size]
+            next_marker = str(start + page_size) if start + page_size < len(blobs) else ''
+            body = ('<?xml version="1.0" encoding="utf-8"?>'
+                    + f'<EnumerationResults ContainerName="{container}"><Blobs>'
+                    + ''.join((f'<Blob><Name>{_xml_escape(blob_name)}</Name><Properties>'
+                               + f'<Creation-Time>{email.utils.format_datetime(blob.last_modified, usegmt=True)}</Creation-Time>'
+                               + f'<Last-Modified>{email.utils.format_datetime(blob.last_modified, usegmt=True)}</Last-Modified>'
+                               + f'<Etag>"{blob.etag}"</Etag><Content-Length>{len(blob.data)}</Content-Length>'
+                               + f'<Content-Type>application/octet-stream</Content-Type><BlobType>{blob.blob_type}</BlobType>'
+                               + '</Properties></Blob>') if blob else f'<BlobPrefix><Name>{_xml_escape(blob_name)}</Name></BlobPrefix>'
+                              for blob_name, blob in page)
+                    + f'</Blobs><NextMarker>{next_marker}</NextMarker></EnumerationResults>')
+            return self._send(200, body.encode(), {'Content-Type': 'application/xml', 'x-ms-version': '2021-08-06'})
+
+        blob = self.emulator.blobs.get(container, {}).get(name)
+        if not blob:
+            return self._not_found()
+
+        headers = self._blob_headers(blob)
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('x-ms-range') or self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(blob.data) - 1, len(blob.data) - 1)
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(blob.data)}'
+            return self._send(206, blob.data[start:end + 1], headers)
+        self._send(200, blob.data, headers)
+
+    def do_HEAD(self):
+        container, name, _ = self._split_path()
+        blob = self.emulator.blobs.get(container, {}).get(name)
+        if not blob:
+            return self._send(404, b'', {'x-ms-error-code': 'BlobNotFound'})
+        headers = self._blob_headers(blob)
+        self.send_response(200)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(blob.data)))
+        self.end_headers()
+
+    def do_PUT(self):
+        container, name, query = self._split_path()
+        body = self._read_body()
+
+        if query.get('restype') == 'container':
+            with self.emulator.lock:
+                self.emulator.blobs.setdefault(container, {})
+            return self._send(201, b'', {'x-ms-version': '2021-08-06'})
+
+        with self.emulator.lock:
+            blobs = self.emulator.blobs.setdefault(container, {})
+            existing = blobs.get(name)
+            if_match, if_none_match = self.headers.get('If-Match'), self.headers.get('If-None-Match')
+            if (if_none_match == '*' and existing) or (if_match and (not existing or if_match.strip('"') != existing.etag)):
+                error_code = 'BlobAlreadyExists' if if_none_match == '*' else 'ConditionNotMet'
+                return self._send(409 if if_none_match == '*' else 412, b'', {'x-ms-error-code': error_code})
+
+            headers = {}
+            if self.headers.get('x-ms-copy-source'):
+                # same-account copies complete synchronously
+                source_container, source_name = urllib.parse.unquote(
+                    urllib.parse.urlparse(self.headers['x-ms-copy-source']).path).lstrip('/').split('/', 2)[1:]
+                source = self.emulator.blobs.get(source_container, {}).get(source_name)
+                if not source:
+                    return self._send(404, b'', {'x-ms-error-code': 'CannotVerifyCopySource'})
+                blobs[name] = _Blob(source.data, blob_type=source.blob_type, block_count=source.block_count)
+                headers = {'x-ms-copy-id': uuid.uuid4().hex, 'x-ms-copy-status': 'success'}
+            elif query.get('comp') == 'appendblock':
+                if not existing or existing.blob_type != 'AppendBlob':
+                    return self._send(409, b'', {'x-ms-error-code': 'InvalidBlobType'})
+                headers = {'x-ms-blob-append-offset': str(len(existing.data)),
+                           'x-ms-blob-committed-block-count': str(existing.block_count + 1)}
+                blobs[name] = _Blob(existing.data + body, blob_type='AppendBlob', block_count=existing.block_count + 1)
+            elif self.headers.get('x-ms-blob-type') == 'AppendBlob':
+                blobs[name] = _Blob(b'', blob_type='AppendBlob')
+            else:
+                blobs[name] = _Blob(body)
+            blob = blobs[name]
+        self._send(202 if 'x-ms-copy-id' in headers else 201, b'',
+                   {'ETag': f'"{blob.etag}"',
+                    'Last-Modified': email.utils.format_datetime(blob.last_modified, usegmt=True),
+                    'x-ms-request-server-encrypted': 'false',
+                    'x-ms-version': '2021-08-06',
+                    **headers})
+
+    def do_DELETE(self):
+        container, name, _ = self._split_path()
+        with self.emulator.lock:
+            if not self.emulator.blobs.get(container, {}).pop(name, None):
+                return self._not_found()
+        self._send(202, b'', {'x-ms-version': '2021-08-06'})
+
+
+class FakeAzureBlobServer(_ThreadingHttpServer):
+    """
+    An in-memory Azure Blob Storage REST API with Azurite-style addressing
+
+    Example:
+        with FakeAzureBlobServer() as server:
+            client = azure.storage.blob.BlobServiceClient.from_connection_string(
+                server.connection_string)
+    """
+    ACCOUNT_NAME = 'devstoreaccount1'
+    # the well-known Azurite development key, the signature is not checked
+    ACCOUNT_KEY = 'Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=='
+
+    def __init__(self):
+        super().__init__(_AzureBlobHandler)
+
+    @property
+    def connection_string(self) -> str:
+        return ('DefaultEndpointsProtocol=http'
+                + f';AccountName={self.ACCOUNT_NAME}'
+                + f';AccountKey={self.ACCOUNT_KEY}'
+                + f';BlobEndpoint={self.url}/{self.ACCOUNT_NAME}')
+
+
+def _xml_escape(value: str) -> str:
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+# -----------------------------------------------------------------------------
+
+
+class SftpServer:
+    """
+    A SFTP server serving a local directory, accepting any user name and password
+
+    Example:
+        with SftpServer(root='/tmp/sftp-root') as server:
+            storage = SftpStorage(host='127.0.0.1', port=server.port, user='test',
+                                  password='test', insecure=True)
+    """
+
+    def __init__(self, root: str):
+        import paramiko
+
+        self.root = os.path.abspath(root)
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.listen(16)
+        self._transports = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _accept(self):
+        import paramiko
+
+        root = self.root
+
+        class Server(paramiko.ServerInterface):
+            def check_auth_password(self, username, password):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def check_auth_publickey(self, username, key):
+                return paramiko.AUTH_SUCCESSFUL
+
+            def get_allowed_auths(self, username):
+                return 'password,publickey'
+
+            def check_channel_request(self, kind, chanid):
+                return paramiko.OPEN_SUCCEEDED
+
+        class SftpHandler(_LocalSftpServerInterface):
+            ROOT = root
+
+        while not self._stopped.is_set():
+            try:
+                client_socket, _ = self._socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client_socket)
+            transport.add_server_key(self._host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, SftpHandler)
+            transport.start_server(server=Server())
+            self._transports.append(transport)
+
+
+def _local_sftp_server_interface():
+    import paramiko
+
+    class LocalSftpHandle(paramiko.SFTPHandle):
+        def stat(self):
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def chattr(self, attr):
+            return paramiko.SFTP_OK
+
+    class LocalSftpServerInterface(paramiko.SFTPServerInterface):
+        """Maps the SFTP operations to the local directory `ROOT`"""
+        ROOT = None
+
+        def _local_path(self, path: str) -> str:
+            return os.path.join(self.ROOT, self.canonicalize(path).lstrip('/'))
+
+        def canonicalize(self, path: str) -> str:
+            return os.path.normpath('/' + path)
+
+        def list_folder(self, path):
+            local_path = self._local_path(path)
+            try:
+                return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local_path, name)), name)
+                        for name in os.listdir(local_path)]
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        def stat(self, path):
+            try:
+                return paramiko.SFTPAttributes.from_stat(os.stat(self._local_path(path)))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            local_path = self._local_path(path)
+            try:
+                fd = os.open(local_path, flags, 0o666)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            if flags & os.O_WRONLY:
+                mode = 'ab' if flags & os.O_APPEND else 'wb'
+            elif flags & os.O_RDWR:
+                mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+            else:
+                mode = 'rb'
+            handle = LocalSftpHandle(flags)
+            handle.filename = local_path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+
+        def remove(self, path):
+            try:
+                os.remove(self._local_path(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def rename(self, oldpath, newpath):
+            try:
+                os.rename(self._local_path(oldpath), self._local_path(newpath))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def posix_rename(self, oldpath, newpath):
+            return self.rename(oldpath, newpath)
+
+        def mkdir(self, path, attr):
+            try:
+                os.mkdir(self._local_path(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def rmdir(self, path):
+            try:
+                os.rmdir(self._local_path(path))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            return paramiko.SFTP_OK
+
+        def chattr(self, path, attr):
+            return paramiko.SFTP_OK
+
+    return LocalSftpServerInterface
+
+
+try:
+    _LocalSftpServerInterface = _local_sftp_server_interface()
+except ImportError:  # paramiko is not installed
+    _LocalSftpServerInterface = None
@@ -0,0 +1,98 @@
+"""
+Benchmarks of the `StorageClient` operations for every backend
+
+Run with:
+    pytest benchmarks/test_client.py --benchmark-group-by=func
+"""
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from .conftest import Backend
+
+
+NUMBER_OF_FILES = 1000
+SMALL_FILE = b'{"id": 1, "name": "small json document"}\n' * 10
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+
+
+@pytest.fixture
+def listing_backend(backend: Backend) -> Backend:
+    for i in range(NUMBER_OF_FILES):
+        backend.put(f'listing/part-{i:05d}.json', SMALL_FILE)
+    return backend
+
+
+def test_iterate_files(benchmark, listing_backend: Backend):
+    files = benchmark(lambda: list(listing_backend.client.iterate_files('listing/part-')
+                                   if listing_backend.name in ('gcs', 'azure')
+                                   else listing_backend.client.iterate_files('listing/part-*.json')))
+    assert len(files) == NUMBER_OF_FILES
+
+
+def test_iterate_file_infos(benchmark, listing_backend: Backend):
+    file_infos = benchmark(lambda: list(listing_backend.client.iterate_file_infos('listing/part-')
+                                        if listing_backend.name in ('gcs', 'azure')
+                                        else listing_backend.client.iterate_file_infos('listing/part-*.json')))
+    assert len(file_infos) == NUMBER_OF_FILES
+    assert all(file_info.size == len(SMALL_FILE) for file_info in file_infos)
+
+
+@pytest.mark.parametrize('shard_by', ['name', 'directory'])
+def test_iterate_files_sharded(benchmark, backend: Backend, shard_by: str):
+    for i in range(NUMBER_OF_FILES):
+        backend.put(f'sharded/{i % 20:02d}/part-{i:05d}.json', SMALL_FILE)
+    file_pattern = 'sharded/' if backend.name in ('gcs', 'azure') else 'sharded/*/part-*.json'
+
+    def list_shard(shard_index: int) -> list:
+        return list(backend.client.iterate_files(file_pattern, shard_index=shard_index, shard_count=8, shard_by=shard_by))
+
+    files = benchmark(list_shard, 0)
+    assert 0 < len(files) < NUMBER_OF_FILES
+    assert sum(len(list_shard(shard_index)) for shard_index in range(8)) == NUMBER_OF_FILES
+
+
+def test_last_modification_timestamp(benchmark, backend: Backend):
+    backend.put('metadata.json', SMALL_FILE)
+
+    assert benchmark(backend.client.last_modification_timestamp, 'metadata.json')
+
+
+def test_read_small_file(benchmark, backend: Backend):
+    backend.put('small.json', SMALL_FILE)
+
+    assert benchmark(backend.client.read_file, 'small.json') == SMALL_FILE
+
+
+def test_read_large_file(benchmark, backend: Backend):
+    data = bytes(range(256)) * (LARGE_FILE_SIZE // 256)
+    backend.put('large.bin', data)
+    benchmark.extra_info['bytes'] = len(data)
+
+    assert len(benchmark(backend.client.read_file, 'large.bin')) == len(data)
+
+
+def test_read_range(benchmark, backend: Backend):
+    data = bytes(range(256)) * (LARGE_FILE_SIZE // 256)
+    backend.put('large.bin', data)
+
+    assert benchmark(backend.client.read_range, 'large.bin', 1000, len(SMALL_FILE)) == data[1000:1000 + len(SMALL_FILE)]
+
+
+@pytest.mark.parametrize('prefetch', [1, 8])
+def test_iterate_contents(benchmark, listing_backend: Backend, prefetch: int):
+    pattern = 'listing/part-0' if listing_backend.name in ('gcs', 'azure') else 'listing/part-0*.json'
+    contents = benchmark(lambda: list(listing_backend.client.iterate_contents(pattern, prefetch=prefetch)))
+    assert len(contents) == NUMBER_OF_FILES
+
+
+def test_append(benchmark, backend: Backend):
+    # appending to a large file only transfers the appended data
+    data = bytes(range(256)) * (1024 * 1024 // 256)
+    backend.put('events.log', data)
+    benchmark.extra_info['file_size'] = len(data)
+
+    size = benchmark(backend.client.append, 'events.log', SMALL_FILE)
+    assert size > len(data)
+    assert backend.client.read_range('events.log', size - len(SMALL_FILE), len(SMALL_FILE)) == SMALL_FILE
@@ -0,0 +1,75 @@
+"""
+Benchmarks of the compression codecs, in-process and via the shell tools
+
+Run with:
+    pytest benchmarks/test_compression.py --benchmark-group-by=func
+"""
+
+import gzip
+import io
+import subprocess
+import tarfile
+import zipfile
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from mara_storage.compression import Compression, compressor, decompress, uncompressor
+
+
+# CSV-like content, compressing about as well as real data
+DATA = b''.join(f'{i},2023-01-{i % 28 + 1:02d},customer_{i % 997},{i * 7 % 10000 / 100:.2f}\n'.encode()
+                for i in range(200_000))
+
+COMPRESSIONS = [Compression.GZIP, Compression.ZIP, Compression.TAR_GZIP]
+
+
+def _compress(compression: Compression, data: bytes) -> bytes:
+    if compression == Compression.GZIP:
+        return gzip.compress(data)
+    buffer = io.BytesIO()
+    if compression == Compression.ZIP:
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('data.csv', data)
+    else:
+        with tarfile.open(fileobj=buffer, mode='w:gz') as tar_file:
+            tar_info = tarfile.TarInfo('data.csv')
+            tar_info.size = len(data)
+            tar_file.addfile(tar_info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS, ids=lambda compression: compression.value)
+def test_decompress(benchmark, compression: Compression):
+    compressed = _compress(compression, DATA)
+    benchmark.extra_info['bytes'] = len(DATA)
+    benchmark.extra_info['compressed_bytes'] = len(compressed)
+
+    assert benchmark(decompress, compression, compressed) == DATA
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS, ids=lambda compression: compression.value)
+def test_uncompressor_command(benchmark, tmp_path, compression: Compression):
+    file_path = tmp_path / 'data'
+    file_path.write_bytes(_compress(compression, DATA))
+    benchmark.extra_info['bytes'] = len(DATA)
+
+    def run():
+        return subprocess.run(f'{uncompressor(compression)} {file_path}', shell=True, check=True,
+                              stdout=subprocess.PIPE).stdout
+
+    assert benchmark(run) == DATA
+
+
+@pytest.mark.parametrize('compression', [Compression.GZIP, Compression.TAR_GZIP], ids=lambda compression: compression.value)
+def test_compressor_command(benchmark, tmp_path, compression: Compression):
+    file_path = tmp_path / 'data.csv'
+    file_path.write_bytes(DATA)
+    benchmark.extra_info['bytes'] = len(DATA)
+
+    def run():
+        return subprocess.run(f'{compressor(compression)} {file_path}', shell=True, check=True,
+                              stdout=subprocess.PIPE).stdout
+
+    assert benchmark(run)
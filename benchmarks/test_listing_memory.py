@@ -0,0 +1,49 @@
+"""
+Memory use of a large listing kept as a list of `FileInfo` tuples vs. a `FileListing`
+
+Run with:
+    pytest -s benchmarks/test_listing_memory.py
+"""
+
+import datetime
+import gc
+import tracemalloc
+
+from mara_storage.client import FileInfo
+from mara_storage.listing import FileListing
+
+
+NUMBER_OF_FILES = 100_000
+
+
+def _file_infos():
+    last_modified = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(NUMBER_OF_FILES):
+        yield FileInfo(name=f'my_domain.com/logs/2023/{i % 12 + 1:02d}/{i % 28 + 1:02d}/nginx.{i:08d}.log.gz',
+                       size=i * 17,
+                       last_modified=last_modified + datetime.timedelta(seconds=i),
+                       etag=f'CL{i:016x}')
+
+
+def _allocated_bytes(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return allocated
+
+
+def test_listing_memory():
+    list_bytes = _allocated_bytes(lambda: list(_file_infos()))
+    listing_bytes = _allocated_bytes(lambda: FileListing(_file_infos()))
+
+    print(f'\n{NUMBER_OF_FILES} files:'
+          f'\n  list of FileInfo: {list_bytes / 1024 / 1024:8.1f} MiB ({list_bytes / NUMBER_OF_FILES:.0f} bytes per file)'
+          f'\n  FileListing:      {listing_bytes / 1024 / 1024:8.1f} MiB ({listing_bytes / NUMBER_OF_FILES:.0f} bytes per file)')
+
+    assert listing_bytes * 3 < list_bytes
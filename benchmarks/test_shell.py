@@ -0,0 +1,70 @@
+"""
+Benchmarks of the shell command pipelines created by `mara_storage.shell`
+
+Only the backends whose command line tools can talk to a local stand-in are measured:
+the in-memory storage (via its helper process), the local storage and SFTP (via `curl`). `gsutil` and `azcopy` can not be pointed to
+the emulators.
+
+Run with:
+    pytest benchmarks/test_shell.py --benchmark-group-by=func
+"""
+
+import shutil
+import subprocess
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from mara_storage import shell
+from mara_storage.compression import Compression
+
+from .conftest import Backend
+
+
+DATA = b'0123456789abcdef' * (4 * 1024 * 1024 // 16)
+
+
+@pytest.fixture
+def shell_backend(backend: Backend) -> Backend:
+    if backend.name not in ('memory', 'local', 'sftp'):
+        pytest.skip(f'the command line tool of backend {backend.name} can not use a local stand-in')
+    if backend.name == 'sftp' and not shutil.which('curl'):
+        pytest.skip('curl is not installed')
+    return backend
+
+
+def test_read_file_command(benchmark, shell_backend: Backend):
+    shell_backend.put('read.bin', DATA)
+    command = shell.read_file_command(shell_backend.storage, file_name='read.bin')
+    benchmark.extra_info['bytes'] = len(DATA)
+
+    def run():
+        return subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE).stdout
+
+    assert benchmark(run) == DATA
+
+
+def test_write_file_command(benchmark, shell_backend: Backend):
+    command = shell.write_file_command(shell_backend.storage, file_name='write.bin')
+    benchmark.extra_info['bytes'] = len(DATA)
+
+    def run():
+        subprocess.run(command, shell=True, check=True, input=DATA)
+
+    benchmark(run)
+    assert shell_backend.client.read_file('write.bin') == DATA
+
+
+def test_read_file_command_gzip(benchmark, tmp_path, shell_backend: Backend):
+    if shell_backend.name not in ('memory', 'local'):
+        pytest.skip(f'compression is not supported for backend {shell_backend.name}')
+    import gzip
+    shell_backend.put('read.bin.gz', gzip.compress(DATA))
+    command = shell.read_file_command(shell_backend.storage, file_name='read.bin.gz', compression=Compression.GZIP)
+    benchmark.extra_info['bytes'] = len(DATA)
+
+    def run():
+        return subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE).stdout
+
+    assert benchmark(run) == DATA
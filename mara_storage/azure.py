@@ -1,9 +1,22 @@
 import datetime
+import itertools
+import time
+import typing as t
+import uuid
 
-from mara_storage.client import StorageClient
-from . import storages
+from mara_storage.client import StorageClient, FileInfo, _iterate_chunks
+from . import hedging, storages
 
-from azure.storage.blob import BlobClient, BlobServiceClient
+from azure.storage.blob import BlobClient, BlobPrefix, BlobServiceClient, BlobType
+
+# the maximum size of a block appended with `append_block` in all service versions
+APPEND_BLOCK_SIZE = 4 * 1024 * 1024
+
+# the maximum number of blocks of an append blob
+MAX_APPEND_BLOCKS = 50000
+
+# the prefix of the temporary append blobs written when a blob is rewritten by `append`
+APPEND_TEMPORARY_PREFIX = '.mara-storage-append/'
 
 
 def init_client(storage: storages.AzureStorage, path: str = None) -> BlobClient:
@@ -36,21 +49,141 @@ class AzureStorageClient(StorageClient):
 
         return self.__container_client
 
+    @hedging.hedged
     def creation_timestamp(self, path: str) -> datetime.datetime:
         blob_client = self._container_client.get_blob_client(path)
         properties = blob_client.get_blob_properties()
 
         return properties.creation_time
 
+    @hedging.hedged
     def last_modification_timestamp(self, path: str) -> datetime.datetime:
         blob_client = self._container_client.get_blob_client(path)
         properties = blob_client.get_blob_properties()
 
         return properties.last_modified
 
-    def iterate_files(self, file_pattern: str):
+    @hedging.hedged
+    def read_file(self, path: str) -> bytes:
+        blob_client = self._container_client.get_blob_client(path)
+        return blob_client.download_blob().readall()
+
+    @hedging.hedged
+    def file_size(self, path: str) -> int:
+        blob_client = self._container_client.get_blob_client(path)
+        return blob_client.get_blob_properties().size
+
+    @hedging.hedged
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b''
+        blob_client = self._container_client.get_blob_client(path)
+        return blob_client.download_blob(offset=start, length=length).readall()
+
+    def upload_file(self, local_path: str, path: str):
+        with open(local_path, 'rb') as f:
+            self._container_client.upload_blob(path, f, overwrite=True)
+
+    def append(self, path: str, stream: t.Union[bytes, t.BinaryIO]) -> int:
+        """
+        Appends data to a blob with `append_block`, only the new data is transferred
+
+        A block blob (e.g. written by `upload_file`) is rewritten as an append blob once. An
+        append blob which reaches the maximum number of blocks is compacted, i.e. rewritten
+        with blocks of the maximum size. Rewrites go to a temporary append blob which is then
+        copied over the blob, so that the blob is never truncated.
+        """
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+        blob_client = self._container_client.get_blob_client(path)
+        try:
+            properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            properties = None
+
+        chunks = _iterate_chunks(stream, APPEND_BLOCK_SIZE)
+        if properties is None:
+            try:
+                blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+            except ResourceExistsError:
+                pass  # created concurrently
+            size, block_count = 0, 0
+        elif properties.blob_type != BlobType.APPENDBLOB:
+            return self._rewrite_as_append_blob(blob_client, properties.etag, chunks)
+        else:
+            size, block_count = properties.size, properties.append_blob_committed_block_count or 0
+
+        for chunk in chunks:
+            if block_count >= MAX_APPEND_BLOCKS:
+                # compact, the data appended so far is part of the blob
+                return self._rewrite_as_append_blob(blob_client, blob_client.get_blob_properties().etag,
+                                                    itertools.chain([chunk], chunks))
+            result = blob_client.append_block(chunk)
+            size = int(result['blob_append_offset']) + len(chunk)
+            block_count = int(result['blob_committed_block_count'])
+        return size
+
+    def _rewrite_as_append_blob(self, blob_client: BlobClient, etag: str, chunks: t.Iterator[bytes]) -> int:
+        """
+        Rewrites a blob followed by `chunks` as append blob with blocks of the maximum size
+
+        The blob is replaced with a server side copy of a temporary append blob, and only
+        when it was not modified in the meantime.
+
+        Returns:
+            The size of the rewritten blob
+        """
+        from azure.core import MatchConditions
+
+        temporary_blob_client = self._container_client.get_blob_client(APPEND_TEMPORARY_PREFIX + uuid.uuid4().hex)
+        temporary_blob_client.create_append_blob()
+        try:
+            downloader = blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfNotModified)
+            size = 0
+            for block in _blocks(itertools.chain(downloader.chunks(), chunks), APPEND_BLOCK_SIZE):
+                temporary_blob_client.append_block(block)
+                size += len(block)
+
+            status = blob_client.start_copy_from_url(temporary_blob_client.url, etag=etag,
+                                                     match_condition=MatchConditions.IfNotModified)['copy_status']
+            while status == 'pending':
+                time.sleep(0.1)
+                status = blob_client.get_blob_properties().copy.status
+            if status != 'success':
+                raise Exception(f'Could not replace blob "{blob_client.blob_name}" with the rewritten append blob: copy {status}')
+        finally:
+            temporary_blob_client.delete_blob()
+        return size
+
+    def iterate_files(self, file_pattern: str) -> t.Iterator[str]:
+        for file_info in self.iterate_file_infos(file_pattern):
+            yield file_info.name
+
+    def iterate_file_infos(self, file_pattern: str) -> t.Iterator[FileInfo]:
         blobs = self._container_client.list_blobs(name_starts_with=file_pattern)
 
         for blob in blobs:
             if blob:
-                yield blob.name
+                yield FileInfo(name=blob.name, size=blob.size, last_modified=blob.last_modified, etag=blob.etag)
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        prefix = path.strip('/') + '/' if path.strip('/') else None
+        # with a delimiter, the listing returns the blobs and the prefixes up to the next '/' in name order
+        for item in self._container_client.walk_blobs(name_starts_with=prefix, delimiter='/'):
+            if isinstance(item, BlobPrefix):
+                yield FileInfo(name=item.name)
+            else:
+                yield FileInfo(name=item.name, size=item.size, last_modified=item.last_modified, etag=item.etag)
+
+
+def _blocks(chunks: t.Iterable[bytes], block_size: int) -> t.Iterator[bytes]:
+    """Regroups chunks of any size into blocks of `block_size` bytes, only the last block is smaller"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= block_size:
+            yield bytes(buffer[:block_size])
+            del buffer[:block_size]
+    if buffer:
+        yield bytes(buffer)
@@ -1,12 +1,48 @@
 from functools import singledispatch
+import collections
+import concurrent.futures
 import datetime
+import subprocess
+import tempfile
 import typing as t
 
-from mara_storage import storages
+from mara_storage import events, execution, packing, sharding, storages
+from mara_storage.compression import Compression, decompress
+
+
+class FileInfo(t.NamedTuple):
+    """Information about a file on a storage as returned by a listing"""
+    name: str
+    size: t.Optional[int] = None
+    last_modified: t.Optional[datetime.datetime] = None
+    etag: t.Optional[str] = None
 
 
 class StorageClient():
     """A base class for a storage client"""
+
+    # the methods emitting events, see module `events`
+    _TRACKED_OPERATIONS = ['last_modification_timestamp', 'creation_timestamp', 'iterate_files',
+                           'iterate_file_infos', 'iterate_directory', 'read_file', 'read_range', 'read_buffer', 'open_mmap', 'upload_file', 'append', 'file_size']
+
+    # the methods which are retried and limited when the storage throttles, see module `execution`.
+    # `append` is only limited, as a repeated append could write the data twice.
+    _EXECUTED_OPERATIONS = ['last_modification_timestamp', 'creation_timestamp', 'iterate_files',
+                            'iterate_file_infos', 'iterate_directory', 'read_file', 'read_range', 'upload_file', 'append', 'file_size']
+
+    # the methods which resolve paths in packed namespaces, see module `packing`
+    _PACKED_OPERATIONS = ['iterate_files', 'iterate_file_infos', 'read_file', 'read_range', 'file_size']
+
+    # the methods which take `shard_index` and `shard_count`, see module `sharding`
+    _SHARDED_OPERATIONS = ['iterate_files', 'iterate_file_infos']
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        packing.instrument(cls, cls._PACKED_OPERATIONS)
+        sharding.instrument(cls, cls._SHARDED_OPERATIONS)
+        execution.instrument(cls, cls._EXECUTED_OPERATIONS)
+        events.instrument(cls, cls._TRACKED_OPERATIONS)
+
     def __new__(cls, storage: t.Union[str, storages.Storage]):
         if storage is None:
             raise ValueError('Please provide the storage prameter')
@@ -36,6 +72,187 @@ class StorageClient():
         """
         raise NotImplementedError(f'Please implement iterate_files for type "{self._storage.__class__.__name__}"')
 
+    def iterate_file_infos(self, file_pattern: str) -> t.Iterator[FileInfo]:
+        """
+        Iterates over files on a storage together with the metadata the listing provides
+
+        Storages which return size or modification time in their listing should override
+        this method so that no additional request per file is necessary.
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`
+        """
+        for file in self.iterate_files(file_pattern):
+            yield FileInfo(name=file)
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        """
+        Iterates over the files and subdirectories directly within a directory, in name order
+
+        Used to list only parts of a storage, see module `sharding`.
+
+        Args:
+            path: the directory, `''` for the root of the storage
+
+        Returns:
+            An iterator over the files and subdirectories. The names of subdirectories end with `/`.
+        """
+        raise NotImplementedError(f'Please implement iterate_directory for type "{self._storage.__class__.__name__}"')
+
+    def read_file(self, path: str) -> bytes:
+        """
+        Returns the content of a file on a storage
+
+        The default implementation runs the command of `shell.read_file_command`.
+        """
+        from . import shell
+        command = shell.read_file_command(self._storage, file_name=path)
+        process = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise execution.command_error(f'An error occured while reading file "{path}". Stderr:\n',
+                                          process.stderr.decode(errors="replace"))
+        return process.stdout
+
+    def file_size(self, path: str) -> int:
+        """
+        Returns the size of a file on a storage in bytes
+
+        The default implementation takes the size from `iterate_file_infos` and reads the
+        file when the listing provides no size.
+        """
+        for file_info in self.iterate_file_infos(path):
+            if file_info.name == path and file_info.size is not None:
+                return file_info.size
+        return len(self.read_file(path))
+
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        """
+        Returns `length` bytes of a file on a storage starting at byte `start`. Fewer bytes
+        are returned when the file ends before.
+
+        The default implementation reads the whole file.
+
+        Args:
+            path: the file path within the storage
+            start: the offset of the first byte
+            length: the number of bytes
+        """
+        return self.read_file(path)[start:start + length]
+
+    def upload_file(self, local_path: str, path: str):
+        """
+        Uploads a local file to a storage. An existing file is replaced.
+
+        The default implementation runs the command of `shell.write_file_command` with the
+        local file as stdin.
+
+        Args:
+            local_path: the local file
+            path: the file path within the storage
+        """
+        from . import shell
+        command = shell.write_file_command(self._storage, file_name=path)
+        with open(local_path, 'rb') as f:
+            process = subprocess.run(command, shell=True, stdin=f, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise execution.command_error(f'An error occured while uploading file "{path}". Stderr:\n',
+                                          process.stderr.decode(errors="replace"))
+
+    def append(self, path: str, stream: t.Union[bytes, t.BinaryIO]) -> int:
+        """
+        Appends data to a file on a storage. A file which does not exist is created.
+
+        The default implementation rewrites the file: the existing content is downloaded and
+        uploaded together with the new data via `upload_file`. The clients of storages which
+        can append (local, SFTP, Azure append blobs, Google Cloud Storage compose) only write
+        the new data.
+
+        Args:
+            path: the file path within the storage
+            stream: the data, bytes or a binary file object which is read to its end
+
+        Returns:
+            The size of the file after appending
+        """
+        from . import info
+        with tempfile.NamedTemporaryFile() as f:
+            if info.file_exists(self._storage, path):
+                f.write(self.read_file(path))
+            for chunk in _iterate_chunks(stream):
+                f.write(chunk)
+            f.flush()
+            self.upload_file(f.name, path)
+            return f.tell()
+
+    def iterate_contents(self, file_pattern: str, prefetch: int = 4, max_bytes: int = None,
+                         compression: Compression = Compression.NONE) -> t.Iterator[t.Tuple[str, bytes]]:
+        """
+        Iterates over the files on a storage together with their content
+
+        While the caller processes a file, the next files are downloaded (and uncompressed)
+        in background threads.
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.json'`
+            prefetch: the maximum number of files which are downloaded ahead
+            max_bytes: when set, no further downloads are started while the files downloaded
+                       ahead take more than this number of bytes. When the storage listing
+                       provides file sizes, these are taken into account before downloading.
+            compression: the compression used to uncompress the files in-process
+
+        Returns:
+            An iterator over tuples `(file_name, content)` in listing order
+        """
+        # the downloads run with the priority of the caller, within an executed operation as part of it
+        @execution.bind
+        def download(path: str) -> bytes:
+            return decompress(compression, self.read_file(path))
+
+        def buffered_bytes() -> int:
+            # size of the downloads ahead, using the size from the listing while a download is running
+            return sum(len(future.result()) if future.done() and not future.exception() else (size or 0)
+                       for _, size, future in queue)
+
+        file_infos = iter(self.iterate_file_infos(file_pattern))
+        queue = collections.deque()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(prefetch, 1)) as executor:
+            try:
+                while True:
+                    while len(queue) < max(prefetch, 1) and (not queue or not max_bytes or buffered_bytes() < max_bytes):
+                        file_info = next(file_infos, None)
+                        if file_info is None:
+                            break
+                        queue.append((file_info.name, file_info.size, executor.submit(download, file_info.name)))
+
+                    if not queue:
+                        return
+
+                    name, _, future = queue.popleft()
+                    yield name, future.result()
+            finally:
+                for _, _, future in queue:
+                    future.cancel()
+
+
+def _iterate_chunks(stream: t.Union[bytes, t.BinaryIO], chunk_size: int = 8 * 1024 * 1024) -> t.Iterator[bytes]:
+    """Yields bytes or the content of a binary file object in chunks of at most `chunk_size` bytes"""
+    if isinstance(stream, (bytes, bytearray)):
+        for start in range(0, len(stream), chunk_size):
+            yield bytes(stream[start:start + chunk_size])
+        return
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+packing.instrument(StorageClient, StorageClient._PACKED_OPERATIONS)
+sharding.instrument(StorageClient, StorageClient._SHARDED_OPERATIONS)
+execution.instrument(StorageClient, StorageClient._EXECUTED_OPERATIONS)
+events.instrument(StorageClient, StorageClient._TRACKED_OPERATIONS)
+
 
 @singledispatch
 def storage_client_type(storage: object):
@@ -60,3 +277,13 @@ def __(storage: storages.GoogleCloudStorage):
 def __(storage: storages.AzureStorage):
     from .azure import AzureStorageClient
     return AzureStorageClient
+
+@storage_client_type.register(storages.SftpStorage)
+def __(storage: storages.SftpStorage):
+    from .sftp import SftpStorageClient
+    return SftpStorageClient
+
+@storage_client_type.register(storages.MemoryStorage)
+def __(storage: storages.MemoryStorage):
+    from .memory_storage import MemoryStorageClient
+    return MemoryStorageClient
@@ -1,4 +1,5 @@
 import enum
+import io
 
 
 class Compression(enum.Enum):
@@ -49,3 +50,32 @@ def uncompressor(compression: Compression) -> str:
             Compression.ZIP: 'unzip -p',
             Compression.GZIP: 'gunzip -d -c',
             Compression.TAR_GZIP: 'tar -xOzf'}[compression]
+
+
+def decompress(compression: Compression, data: bytes) -> bytes:
+    """
+    Uncompresses file content in-process. Gives the same result as piping the file
+    through the `uncompressor` command.
+
+    Args:
+        compression: the compression of `data`
+        data: the compressed file content
+
+    Returns:
+        The uncompressed content
+    """
+    if compression == Compression.NONE:
+        return data
+    elif compression == Compression.GZIP:
+        import gzip
+        return gzip.decompress(data)
+    elif compression == Compression.ZIP:
+        import zipfile
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            return b''.join(zip_file.read(name) for name in zip_file.namelist())
+    elif compression == Compression.TAR_GZIP:
+        import tarfile
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar_file:
+            return b''.join(tar_file.extractfile(member).read()
+                            for member in tar_file.getmembers() if member.isfile())
+    raise ValueError(f'Unsupported compression {compression}')
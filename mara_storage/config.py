@@ -1,9 +1,127 @@
 """Configuration of storage connections"""
 
 import mara_storage.storages
-from typing import Dict
+from typing import Dict, List
 
 
 def storages() -> Dict[str, mara_storage.storages.Storage]:
     """The list of storage connections to use, by alias"""
     return {}
+
+
+def event_handlers() -> List['mara_storage.events.EventHandler']:
+    """
+    Handlers which are notified about storage operations, e.g. for monitoring
+
+    Example:
+        mara_storage.config.event_handlers = lambda: [mara_storage.events.LoggingEventHandler()]
+    """
+    return []
+
+
+def retry_policy() -> 'mara_storage.execution.RetryPolicy':
+    """How operations are retried when a storage throttles"""
+    import mara_storage.execution
+    return mara_storage.execution.RetryPolicy()
+
+
+def concurrency_limiter(alias: str) -> 'mara_storage.execution.AdaptiveLimiter':
+    """
+    Returns a new limiter for the number of concurrent operations on a storage. Called once per alias.
+
+    Example:
+        mara_storage.config.concurrency_limiter = lambda alias: mara_storage.execution.AdaptiveLimiter(
+            initial_limit=32, max_limit=256)
+
+    Args:
+        alias: the storage alias, None for storages not taken from the config by alias
+    """
+    import mara_storage.execution
+    return mara_storage.execution.AdaptiveLimiter()
+
+
+def io_budget(alias: str) -> 'mara_storage.scheduling.IoBudget':
+    """
+    Returns a new budget of concurrent operations and bandwidth for a storage, None for no budget. Called once per alias.
+
+    Example:
+        mara_storage.config.io_budget = lambda alias: mara_storage.scheduling.IoBudget(
+            max_concurrency=4, max_bytes_per_second=20 * 1024 ** 2, lock_directory='/tmp/mara-storage-io') \\
+            if alias == 'partner-sftp' else None
+
+    Args:
+        alias: the storage alias, None for storages not taken from the config by alias
+    """
+    return None
+
+
+def hedger(alias: str) -> 'mara_storage.hedging.Hedger':
+    """
+    Returns a new hedger for latency-sensitive reads on a storage, None to disable hedging. Called once per alias.
+
+    Hedging is supported by the Google Cloud Storage module client and the Azure client.
+
+    Example:
+        mara_storage.config.hedger = lambda alias: mara_storage.hedging.Hedger(percentile=95) \\
+            if alias == 'data' else None
+
+    Args:
+        alias: the storage alias, None for storages not taken from the config by alias
+    """
+    return None
+
+
+def token_cache_directory() -> str:
+    """
+    The directory in which access tokens are cached and shared between processes, None to disable the cache
+
+    Used for the service account credentials of the Google Cloud Storage module client and
+    for the service principal login of `azcopy`. The tokens are stored in files readable only
+    by the current user.
+
+    Example:
+        mara_storage.config.token_cache_directory = lambda: os.path.expanduser('~/.cache/mara-storage/tokens')
+    """
+    return None
+
+
+def packed_namespaces(alias: str) -> List[str]:
+    """
+    The directories of a storage holding packs of small files, see module `packing`
+
+    Within these directories, `StorageClient.iterate_files`, `StorageClient.read_file` and
+    `info.file_exists` work on the logical files in the packs.
+
+    Example:
+        mara_storage.config.packed_namespaces = lambda alias: ['events', 'api-responses'] if alias == 'data' else []
+
+    Args:
+        alias: the storage alias, None for storages not taken from the config by alias
+    """
+    return []
+
+
+def change_notifications(alias: str) -> 'queue.Queue':
+    """
+    Returns a queue of bucket notifications for `watching.watch`, None to find changes by
+    listing the files instead. Called once per watch.
+
+    The queue is filled by the consumer of the notifications, see `watching.NotificationSource`.
+
+    Example:
+        def change_notifications(alias):
+            if alias != 'data':
+                return None
+            notifications = queue.Queue()
+            def callback(message):
+                notifications.put(message)
+                message.ack()
+            pubsub_v1.SubscriberClient().subscribe('projects/my-project/subscriptions/data-changes', callback)
+            return notifications
+
+        mara_storage.config.change_notifications = change_notifications
+
+    Args:
+        alias: the storage alias, None for storages not taken from the config by alias
+    """
+    return None
@@ -0,0 +1,330 @@
+"""Events emitted by storage operations, e.g. for monitoring"""
+
+import contextlib
+import datetime
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import typing as t
+
+from mara_storage import storages
+
+
+class Event:
+    """Base class for events"""
+
+    def to_dict(self) -> dict:
+        return {'event': self.__class__.__name__,
+                **{key: (value.isoformat() if isinstance(value, datetime.datetime) else value)
+                   for key, value in vars(self).items()}}
+
+    def __repr__(self) -> str:
+        return (f'<{self.__class__.__name__}: '
+                + ', '.join(f'{key}={value!r}' for key, value in vars(self).items())
+                + '>')
+
+
+class OperationStarted(Event):
+    def __init__(self, alias: t.Optional[str], backend: str, operation: str, path: t.Optional[str],
+                 start_time: datetime.datetime):
+        """
+        A storage operation started
+
+        Args:
+            alias: the storage alias, None when the storage was not taken from the config by alias
+            backend: the storage type, e.g. `'GoogleCloudStorage'`
+            operation: the operation, e.g. `'iterate_files'`
+            path: the path or file pattern of the operation, if any
+            start_time: when the operation started
+        """
+        self.alias = alias
+        self.backend = backend
+        self.operation = operation
+        self.path = path
+        self.start_time = start_time
+
+
+class OperationFinished(Event):
+    def __init__(self, alias: t.Optional[str], backend: str, operation: str, path: t.Optional[str],
+                 start_time: datetime.datetime, duration: float, bytes: t.Optional[int], retries: int,
+                 succeeded: bool, error: t.Optional[str] = None):
+        """
+        A storage operation finished
+
+        Args:
+            alias: the storage alias, None when the storage was not taken from the config by alias
+            backend: the storage type, e.g. `'GoogleCloudStorage'`
+            operation: the operation, e.g. `'iterate_files'`
+            path: the path or file pattern of the operation, if any
+            start_time: when the operation started
+            duration: the duration of the operation in seconds
+            bytes: the number of bytes transferred, if known
+            retries: the number of retries of requests done during the operation
+            succeeded: False when the operation raised an exception
+            error: the exception message when the operation failed
+        """
+        self.alias = alias
+        self.backend = backend
+        self.operation = operation
+        self.path = path
+        self.start_time = start_time
+        self.duration = duration
+        self.bytes = bytes
+        self.retries = retries
+        self.succeeded = succeeded
+        self.error = error
+
+
+class EventHandler:
+    """Receives events, see `config.event_handlers`"""
+
+    def handle_event(self, event: Event):
+        raise NotImplementedError()
+
+
+def notify(event: Event, handlers: t.List[EventHandler] = None):
+    """Passes an event to the configured event handlers"""
+    from . import config
+
+    for handler in (config.event_handlers() if handlers is None else handlers):
+        try:
+            handler.handle_event(event)
+        except Exception:
+            # a failing monitoring sink must not break the storage operation
+            logging.getLogger(__name__).exception(f'Event handler {handler!r} failed')
+
+
+# -----------------------------------------------------------------------------
+
+
+class Operation:
+    """A running storage operation. Code doing the operation can add bytes and retries."""
+    __slots__ = ('storage', 'operation', 'path', 'bytes', 'retries')
+
+    def __init__(self, storage: storages.Storage, operation: str, path: str = None):
+        self.storage = storage
+        self.operation = operation
+        self.path = path
+        self.bytes = None
+        self.retries = 0
+
+    def add_bytes(self, bytes: int):
+        self.bytes = (self.bytes or 0) + bytes
+
+
+_state = threading.local()
+
+
+def current_operation() -> t.Optional[Operation]:
+    """Returns the operation tracked in the current thread, if any"""
+    return getattr(_state, 'operation', None)
+
+
+@contextlib.contextmanager
+def track(storage: storages.Storage, operation: str, path: str = None) -> t.Iterator[Operation]:
+    """
+    Tracks a storage operation and emits `OperationStarted` and `OperationFinished` events
+
+    Use it to monitor operations done outside of this package, e.g. when running a
+    command created by `shell.read_file_command`.
+
+    Example:
+        with events.track(storage, 'read_file_command', path=file_name) as operation:
+            output = subprocess.check_output(shell.read_file_command(storage, file_name))
+            operation.add_bytes(len(output))
+
+    Args:
+        storage: the storage configuration
+        operation: the name of the operation
+        path: the path or file pattern of the operation
+    """
+    from . import config
+
+    handlers = config.event_handlers()
+    tracked_operation = Operation(storage, operation, path)
+    if not handlers:
+        yield tracked_operation
+        return
+
+    alias, backend = storages.alias(storage), storage.__class__.__name__
+    start_time = datetime.datetime.now().astimezone()
+    start = time.monotonic()
+    notify(OperationStarted(alias, backend, operation, path, start_time), handlers)
+
+    error = None
+    try:
+        yield tracked_operation
+    except GeneratorExit:
+        # a tracked generator was closed by its consumer
+        raise
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        notify(OperationFinished(alias, backend, operation, path, start_time,
+                                 duration=time.monotonic() - start,
+                                 bytes=tracked_operation.bytes,
+                                 retries=tracked_operation.retries,
+                                 succeeded=error is None,
+                                 error=(str(error) or error.__class__.__name__) if error is not None else None),
+               handlers)
+
+
+@contextlib.contextmanager
+def _enter(operation: Operation):
+    """Marks `operation` as the current operation of the thread"""
+    outer_operation = current_operation()
+    _state.operation = operation
+    try:
+        yield
+    finally:
+        _state.operation = outer_operation
+
+
+def tracked(operation: str):
+    """
+    Decorator for functions and methods doing a storage operation
+
+    The first argument of the decorated function must be the storage configuration or a
+    `StorageClient`. The path is taken from the argument `path`, `file_name` or
+    `file_pattern`. When the function returns bytes or a memoryview, their size is
+    recorded. Calls of tracked functions within a tracked function, e.g. a client method
+    calling another client method, emit no events of their own.
+
+    Generator functions are tracked from the first to the last item.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+        path_argument = next((name for name in ['path', 'file_name', 'file_pattern'] if name in signature.parameters), None)
+
+        def start(args, kwargs) -> t.Optional[Operation]:
+            if current_operation():
+                return None  # nested call
+            target = args[0]
+            storage = getattr(target, '_storage', target)
+            if not isinstance(storage, storages.Storage):
+                return None  # e.g. called with an alias, the dispatched call is tracked
+            path = None
+            if path_argument:
+                bound_arguments = signature.bind_partial(*args, **kwargs).arguments
+                path = bound_arguments.get(path_argument)
+            return Operation(storage, operation, path)
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                tracked_operation = start(args, kwargs)
+                if not tracked_operation:
+                    yield from function(*args, **kwargs)
+                    return
+
+                with track(tracked_operation.storage, operation, tracked_operation.path) as tracked_operation:
+                    generator = function(*args, **kwargs)
+                    while True:
+                        # the operation is only current while the generator runs, not while the caller processes an item
+                        with _enter(tracked_operation):
+                            try:
+                                item = next(generator)
+                            except StopIteration:
+                                return
+                        yield item
+            generator_wrapper.__tracked__ = True
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracked_operation = start(args, kwargs)
+            if not tracked_operation:
+                return function(*args, **kwargs)
+
+            with track(tracked_operation.storage, operation, tracked_operation.path) as tracked_operation, \
+                    _enter(tracked_operation):
+                result = function(*args, **kwargs)
+                if isinstance(result, (bytes, bytearray)):
+                    tracked_operation.add_bytes(len(result))
+                elif isinstance(result, memoryview):
+                    tracked_operation.add_bytes(result.nbytes)
+                return result
+        wrapper.__tracked__ = True
+        return wrapper
+
+    return decorator
+
+
+def instrument(cls: type, operations: t.List[str]):
+    """Wraps the methods `operations` defined in class `cls` with `tracked`"""
+    for name in operations:
+        method = cls.__dict__.get(name)
+        if method and callable(method) and not getattr(method, '__tracked__', False):
+            setattr(cls, name, tracked(name)(method))
+
+
+# -----------------------------------------------------------------------------
+
+
+class LoggingEventHandler(EventHandler):
+    def __init__(self, logger: logging.Logger = None, level: int = logging.INFO, started: bool = False):
+        """
+        Logs finished operations as JSON
+
+        The event fields are also passed as `extra` to the log record, so that structured
+        log formatters can pick them up.
+
+        Args:
+            logger: the logger to use, by default logger `mara_storage.events`
+            level: the log level
+            started: if True, started operations are logged as well
+        """
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+        self.started = started
+
+    def handle_event(self, event: Event):
+        if isinstance(event, OperationFinished) or (self.started and isinstance(event, OperationStarted)):
+            fields = event.to_dict()
+            self.logger.log(self.level, json.dumps(fields), extra={'storage_' + key: value for key, value in fields.items()})
+
+
+class PrometheusEventHandler(EventHandler):
+    def __init__(self, registry=None, namespace: str = 'mara_storage'):
+        """
+        Collects Prometheus metrics about finished operations
+
+        Metrics (labelled by alias, backend and operation):
+            `<namespace>_operations_total` (plus label `status`)
+            `<namespace>_operation_duration_seconds`
+            `<namespace>_bytes_total`
+            `<namespace>_retries_total`
+
+        Requires the package `prometheus_client`.
+
+        Args:
+            registry: the `prometheus_client.CollectorRegistry` to register the metrics in,
+                      by default the global registry
+            namespace: the metric name prefix
+        """
+        import prometheus_client
+
+        kwargs = {'namespace': namespace}
+        if registry is not None:
+            kwargs['registry'] = registry
+
+        labels = ['alias', 'backend', 'operation']
+        self.operations = prometheus_client.Counter('operations', 'Storage operations', labels + ['status'], **kwargs)
+        self.duration = prometheus_client.Histogram('operation_duration_seconds', 'Duration of storage operations', labels, **kwargs)
+        self.bytes = prometheus_client.Counter('bytes', 'Bytes transferred by storage operations', labels, **kwargs)
+        self.retries = prometheus_client.Counter('retries', 'Retried requests of storage operations', labels, **kwargs)
+
+    def handle_event(self, event: Event):
+        if not isinstance(event, OperationFinished):
+            return
+        labels = [event.alias or '', event.backend, event.operation]
+        self.operations.labels(*labels, 'success' if event.succeeded else 'failure').inc()
+        self.duration.labels(*labels).observe(event.duration)
+        if event.bytes:
+            self.bytes.labels(*labels).inc(event.bytes)
+        if event.retries:
+            self.retries.labels(*labels).inc(event.retries)
@@ -0,0 +1,475 @@
+"""
+Execution of storage operations: retries with backoff and adaptive concurrency
+
+When many operations run against the same storage, cloud storages start to throttle
+(HTTP 429 / 503, Azure `ServerBusy`). Operations executed via this module are retried
+with jittered exponential backoff, honoring a `Retry-After` given by the storage, and
+the number of concurrent operations per storage is adapted AIMD-style: it grows by one
+per round of successful operations and is halved when the storage throttles. Operations
+also run within the I/O budget of their storage, see module `scheduling`.
+"""
+
+import collections
+import contextlib
+import concurrent.futures
+import datetime
+import email.utils
+import functools
+import inspect
+import os
+import random
+import re
+import threading
+import time
+import typing as t
+import weakref
+
+from mara_storage import events, scheduling, storages
+
+
+class ThrottledError(Exception):
+    def __init__(self, message: str, retry_after: float = None):
+        """
+        A storage rejected a request because of too many requests
+
+        Args:
+            message: the error message
+            retry_after: the number of seconds the storage asked to wait, if any
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# status codes and error codes with which storages signal that they are overloaded
+THROTTLING_STATUS_CODES = [429, 503]
+THROTTLING_ERROR_CODES = ['ServerBusy', 'TooManyRequests', 'SlowDown', 'rateLimitExceeded']
+
+_THROTTLING_OUTPUT_PATTERN = re.compile(
+    r'\b(?:429|503)\b|' + '|'.join(re.escape(code) for code in THROTTLING_ERROR_CODES))
+
+
+def is_throttled(exception: BaseException) -> bool:
+    """
+    Returns True when an exception signals that the storage is overloaded
+
+    Recognizes `ThrottledError` and the HTTP errors of `urllib`, `google-api-core` and
+    `azure-core` with status 429 or 503 resp. an Azure error code like `ServerBusy`.
+    """
+    if isinstance(exception, ThrottledError):
+        return True
+    for attribute in ['status_code', 'code', 'status']:
+        if getattr(exception, attribute, None) in THROTTLING_STATUS_CODES:
+            return True
+    return getattr(exception, 'error_code', None) in THROTTLING_ERROR_CODES
+
+
+def retry_after(exception: BaseException) -> t.Optional[float]:
+    """Returns the number of seconds a storage asked to wait in the `Retry-After` header of an error, if any"""
+    if isinstance(exception, ThrottledError):
+        return exception.retry_after
+
+    headers = getattr(exception, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(exception, 'response', None), 'headers', None)
+    value = headers.get('Retry-After') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+def command_error(message: str, output: str) -> Exception:
+    """
+    Returns the exception for a failed shell command, a `ThrottledError` when its output
+    shows that the storage throttled the command
+
+    Args:
+        message: the error message, followed by the output
+        output: the stdout or stderr of the command
+    """
+    if _THROTTLING_OUTPUT_PATTERN.search(output):
+        return ThrottledError(message + output)
+    return Exception(message + output)
+
+
+# -----------------------------------------------------------------------------
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 8, initial_delay: float = 0.1, max_delay: float = 30.0,
+                 multiplier: float = 2.0):
+        """
+        How throttled operations are retried, see `config.retry_policy`
+
+        The delay before retry n is drawn uniformly from `[0, min(max_delay, initial_delay * multiplier ** n)]`
+        ("full jitter"), so that concurrent clients do not retry in lockstep. When the storage
+        sent a `Retry-After`, at least that long is waited.
+
+        Args:
+            max_attempts: the maximum number of attempts, including the first one
+            initial_delay: the upper bound of the delay before the first retry in seconds
+            max_delay: the upper bound of all delays in seconds
+            multiplier: the factor by which the upper bound grows with each retry
+        """
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """
+        Returns the number of seconds to wait before the next attempt
+
+        Args:
+            attempt: the number of the failed attempt, starting with 0
+            retry_after: the delay requested by the storage, if any
+        """
+        delay = random.uniform(0, min(self.max_delay, self.initial_delay * self.multiplier ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial_limit: int = 8, min_limit: int = 1, max_limit: int = 64,
+                 backoff_factor: float = 0.5):
+        """
+        Limits the number of concurrent operations on a storage and adapts the limit to the
+        rate the storage allows (additive increase, multiplicative decrease)
+
+        Each successful operation increases the limit by `1 / limit`, i.e. by one per round
+        of `limit` operations. A throttled operation multiplies the limit by `backoff_factor`,
+        at most once per round: operations started before the last decrease do not
+        decrease it again.
+
+        Args:
+            initial_limit: the number of concurrent operations to start with
+            min_limit: the lower bound of the limit
+            max_limit: the upper bound of the limit
+            backoff_factor: the factor by which the limit is multiplied when the storage throttles
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_factor = backoff_factor
+
+        self._limit = float(max(min(initial_limit, max_limit), min_limit))
+        self._in_flight = 0
+        self._epoch = 0  # incremented on each decrease
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        """The current number of allowed concurrent operations"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """The current number of running operations"""
+        return self._in_flight
+
+    def acquire(self) -> int:
+        """Waits until another operation may start. Returns a token to pass to `release`."""
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+            return self._epoch
+
+    def release(self, token: int, throttled: t.Optional[bool]):
+        """
+        Marks an operation as finished
+
+        Args:
+            token: the token returned by `acquire`
+            throttled: True when the storage throttled the operation, False when it succeeded,
+                       None when the outcome says nothing about the load of the storage
+                       (e.g. a file was not found)
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                if token == self._epoch:
+                    self._limit = max(self._limit * self.backoff_factor, float(self.min_limit))
+                    self._epoch += 1
+            elif throttled is not None:
+                self._limit = min(self._limit + 1 / self._limit, float(self.max_limit))
+            self._condition.notify_all()
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__}: limit={self.limit}, in_flight={self.in_flight}>'
+
+
+_limiters: t.Dict[str, AdaptiveLimiter] = {}
+# limiters of storages not taken from the config by alias
+_storage_limiters = weakref.WeakKeyDictionary()
+_limiters_lock = threading.Lock()
+
+
+def limiter(storage: storages.Storage) -> AdaptiveLimiter:
+    """Returns the concurrency limiter of a storage. Storages taken from the config share one limiter per alias."""
+    from . import config
+
+    alias = storages.alias(storage)
+    with _limiters_lock:
+        limiters, key = (_limiters, alias) if alias else (_storage_limiters, storage)
+        if key not in limiters:
+            limiters[key] = config.concurrency_limiter(alias)
+        return limiters[key]
+
+
+# -----------------------------------------------------------------------------
+
+
+_state = threading.local()
+
+
+def _active() -> bool:
+    """Whether the current thread runs within an executed operation"""
+    return getattr(_state, 'depth', 0) > 0
+
+
+@contextlib.contextmanager
+def _activated():
+    """Marks the current thread as running within an executed operation, nested calls are counted"""
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def bind(function: t.Callable) -> t.Callable:
+    """
+    Returns a function calling `function` with the priority of the current thread, for running it in another thread
+
+    Within an executed operation, the function also runs as part of that operation: it takes
+    no slot of the concurrency limit or I/O budget, which could wait forever for the slot held
+    by the operation.
+    """
+    function = scheduling.bind(function)
+    if not _active():
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with _activated():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def execute(storage: storages.Storage, function: t.Callable, *args, **kwargs):
+    """
+    Calls `function(*args, **kwargs)` within the concurrency limit and I/O budget of a
+    storage and retries it while the storage throttles
+
+    Retries are counted in the current operation, see `events.current_operation`. Calls
+    within an executed function are not limited or retried separately. The bytes returned
+    by the function and the bytes passed to it are charged against the bandwidth of the
+    storage.
+
+    Args:
+        storage: the storage the function accesses
+        function: the function to call
+    """
+    return _execute(storage, function, args, kwargs)
+
+
+def _execute(storage: storages.Storage, function: t.Callable, args: tuple, kwargs: dict,
+             transfer_size: t.Callable[[tuple, dict, t.Any], int] = None, retried: bool = True):
+    if _active():
+        return function(*args, **kwargs)
+
+    from . import config
+    policy = config.retry_policy()
+    max_attempts = policy.max_attempts if retried else 1
+    storage_limiter = limiter(storage)
+    storage_budget = scheduling.budget(storage)
+
+    attempt = 0
+    while True:
+        slot = storage_budget.acquire() if storage_budget else None
+        token = storage_limiter.acquire()
+        throttled = None
+        try:
+            with _activated():
+                result = function(*args, **kwargs)
+            throttled = False
+            if storage_budget:
+                storage_budget.consume((transfer_size or _transfer_size)(args, kwargs, result))
+            return result
+        except Exception as e:
+            if not is_throttled(e):
+                raise
+            throttled = True
+            if attempt + 1 >= max_attempts:
+                raise
+            delay = policy.delay(attempt, retry_after(e))
+        finally:
+            storage_limiter.release(token, throttled)
+            if storage_budget:
+                storage_budget.release(slot)
+
+        _count_retry()
+        time.sleep(delay)
+        attempt += 1
+
+
+def _transfer_size(args: tuple, kwargs: dict, result: t.Any) -> int:
+    """The size of the bytes passed to and returned by a function"""
+    return sum(len(value) if isinstance(value, (bytes, bytearray)) else value.nbytes
+               for value in [result, *args, *kwargs.values()] if isinstance(value, (bytes, bytearray, memoryview)))
+
+
+def _local_file_size(args: tuple, kwargs: dict, result: t.Any) -> int:
+    """The size of the local file uploaded by `StorageClient.upload_file(local_path, path)`"""
+    local_path = kwargs['local_path'] if 'local_path' in kwargs else args[1]
+    return os.path.getsize(local_path)
+
+
+def _appended_size(args: tuple, kwargs: dict, result: t.Any) -> int:
+    """The size of the data appended by `StorageClient.append(path, stream)`, for a file object its position"""
+    stream = kwargs['stream'] if 'stream' in kwargs else args[2]
+    return len(stream) if isinstance(stream, (bytes, bytearray)) else stream.tell()
+
+
+# the bytes transferred by operations not passing or returning them
+_TRANSFER_SIZES = {'upload_file': _local_file_size, 'append': _appended_size}
+
+# the operations which are limited but not retried, as a repeated call could write the data twice
+_UNRETRIED_OPERATIONS = ['append']
+
+
+def _execute_generator(storage: storages.Storage, function: t.Callable, *args, **kwargs) -> t.Iterator:
+    """
+    Like `execute` for generator functions, e.g. a listing
+
+    A throttled generator is only retried when it did not yield an item yet. Listings are
+    not counted against the concurrency limit as they run for as long as the caller
+    iterates, and therefore also do not adapt it.
+    """
+    from . import config
+    policy = config.retry_policy()
+
+    attempt = 0
+    while True:
+        generator = function(*args, **kwargs)
+        try:
+            with _activated():
+                first_item = next(generator)
+            break
+        except StopIteration:
+            return
+        except Exception as e:
+            if not is_throttled(e) or attempt + 1 >= policy.max_attempts:
+                raise
+            delay = policy.delay(attempt, retry_after(e))
+
+        _count_retry()
+        time.sleep(delay)
+        attempt += 1
+
+    yield first_item
+    while True:
+        # calls within the generator are not executed separately, calls of the consumer are
+        try:
+            with _activated():
+                item = next(generator)
+        except StopIteration:
+            return
+        yield item
+
+
+def _count_retry():
+    operation = events.current_operation()
+    if operation:
+        operation.retries += 1
+
+
+def executed(function, transfer_size: t.Callable[[tuple, dict, t.Any], int] = None, retried: bool = True):
+    """
+    Decorator for functions and methods doing a storage operation, see `execute`
+
+    The first argument of the decorated function must be the storage configuration or a
+    `StorageClient`.
+
+    Args:
+        function: the decorated function
+        transfer_size: returns the bytes transferred from `(args, kwargs, result)` of a call,
+                       by default the size of bytes passed and returned
+        retried: whether the function is retried while the storage throttles. When False,
+                 it still runs within the concurrency limit and I/O budget.
+    """
+    def storage_of(args) -> t.Optional[storages.Storage]:
+        storage = getattr(args[0], '_storage', args[0])
+        return storage if isinstance(storage, storages.Storage) else None
+
+    if inspect.isgeneratorfunction(function):
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            storage = storage_of(args)
+            if not storage or _active():
+                yield from function(*args, **kwargs)
+            else:
+                yield from _execute_generator(storage, function, *args, **kwargs)
+        generator_wrapper.__executed__ = True
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        storage = storage_of(args)
+        if not storage:
+            return function(*args, **kwargs)
+        return _execute(storage, function, args, kwargs, transfer_size, retried)
+    wrapper.__executed__ = True
+    return wrapper
+
+
+def instrument(cls: type, operations: t.List[str]):
+    """Wraps the methods `operations` defined in class `cls` with `executed`"""
+    for name in operations:
+        method = cls.__dict__.get(name)
+        if method and callable(method) and not getattr(method, '__executed__', False):
+            setattr(cls, name, executed(method, _TRANSFER_SIZES.get(name), retried=name not in _UNRETRIED_OPERATIONS))
+
+
+_NO_ITEM = object()
+
+
+def map_concurrently(storage: storages.Storage, function: t.Callable, items: t.Iterable, max_workers: int = None) -> t.Iterator:
+    """
+    Calls `function(item)` for all items concurrently, as many at the same time as the
+    storage allows (see `AdaptiveLimiter`), and yields the results in the order of the items
+
+    Args:
+        storage: the storage the function accesses
+        function: the function to call for each item
+        items: the items
+        max_workers: the maximum number of threads, by default the maximum limit of the storage
+    """
+    max_workers = max_workers or limiter(storage).max_limit
+    # the workers run with the priority of the caller, within an executed operation as part of it
+    execute_item = bind(execute)
+    items = iter(items)
+    queue = collections.deque()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while True:
+                while len(queue) < max_workers:
+                    item = next(items, _NO_ITEM)
+                    if item is _NO_ITEM:
+                        break
+                    queue.append(executor.submit(execute_item, storage, function, item))
+                if not queue:
+                    return
+                yield queue.popleft().result()
+        finally:
+            for future in queue:
+                future.cancel()
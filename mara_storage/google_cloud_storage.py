@@ -2,10 +2,19 @@ import datetime
 import importlib.util
 import subprocess
 import shlex
+import shutil
+import tempfile
 import typing as t
+import uuid
 
-from mara_storage import storages
-from mara_storage.client import StorageClient
+from mara_storage import execution, hedging, storages, token_cache
+from mara_storage.client import StorageClient, FileInfo, _iterate_chunks
+
+# the maximum number of components of a composite object
+MAX_COMPONENT_COUNT = 1024
+
+# the prefix of the temporary objects holding the data appended by `GoogleCloudStorageModuleClient.append`
+APPEND_DELTA_PREFIX = '.mara-storage-append/'
 
 
 class GoogleCloudStorageClient(StorageClient):
@@ -46,22 +55,104 @@ class GoogleCloudStorageModuleClient(GoogleCloudStorageClient):
             else:
                 raise AttributeError('Either service_account_file or service_account_info needs to be set')
 
+            from . import config
+            if config.token_cache_directory():
+                credentials = token_cache.cache_google_credentials(
+                    credentials.with_scopes(google.cloud.storage.Client.SCOPE))
+
             self.__client = google.cloud.storage.Client(project=credentials.project_id,
                                                         credentials=credentials)
         return self.__client
 
+    @hedging.hedged
     def last_modification_timestamp(self, path: str) -> datetime.datetime:
         bucket = self._client.bucket(self._storage.bucket_name)
         blob = bucket.get_blob(path)
 
         return blob.updated
 
-    def iterate_files(self, file_pattern: str):
+    @hedging.hedged
+    def read_file(self, path: str) -> bytes:
+        bucket = self._client.bucket(self._storage.bucket_name)
+        return bucket.blob(path).download_as_bytes()
+
+    @hedging.hedged
+    def file_size(self, path: str) -> int:
+        bucket = self._client.bucket(self._storage.bucket_name)
+        blob = bucket.get_blob(path)
+        if blob is None:
+            raise FileNotFoundError(f'File "{path}" does not exist in bucket "{self._storage.bucket_name}"')
+        return blob.size
+
+    @hedging.hedged
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b''
+        bucket = self._client.bucket(self._storage.bucket_name)
+        # `end` is inclusive
+        return bucket.blob(path).download_as_bytes(start=start, end=start + length - 1)
+
+    def upload_file(self, local_path: str, path: str):
+        bucket = self._client.bucket(self._storage.bucket_name)
+        bucket.blob(path).upload_from_filename(local_path)
+
+    def append(self, path: str, stream: t.Union[bytes, t.BinaryIO]) -> int:
+        """
+        Appends data by uploading it as a temporary object and composing the existing object
+        with it, only the new data is transferred
+
+        A composite object consists of at most 1024 components. When an object reaches this
+        limit, it is compacted: downloaded and uploaded again together with the new data. All
+        writes are conditional on the generation of the object, so that a concurrent change
+        raises an error instead of being lost.
+        """
+        bucket = self._client.bucket(self._storage.bucket_name)
+        blob = bucket.get_blob(path)
+        with tempfile.TemporaryFile() as data:
+            for chunk in _iterate_chunks(stream):
+                data.write(chunk)
+            size = data.tell()
+            data.seek(0)
+
+            if blob is None:
+                bucket.blob(path).upload_from_file(data, size=size, if_generation_match=0)
+                return size
+
+            if (blob.component_count or 1) >= MAX_COMPONENT_COUNT:
+                with tempfile.TemporaryFile() as compacted:
+                    blob.download_to_file(compacted, if_generation_match=blob.generation)
+                    shutil.copyfileobj(data, compacted)
+                    size = compacted.tell()
+                    compacted.seek(0)
+                    bucket.blob(path).upload_from_file(compacted, size=size, if_generation_match=blob.generation)
+                return size
+
+            delta = bucket.blob(APPEND_DELTA_PREFIX + uuid.uuid4().hex)
+            delta.upload_from_file(data, size=size, if_generation_match=0)
+            try:
+                blob.compose([blob, delta], if_generation_match=blob.generation)
+            finally:
+                delta.delete()
+            return blob.size
+
+    def iterate_files(self, file_pattern: str) -> t.Iterator[str]:
+        for file_info in self.iterate_file_infos(file_pattern):
+            yield file_info.name
+
+    def iterate_file_infos(self, file_pattern: str) -> t.Iterator[FileInfo]:
         blobs = self._client.list_blobs(self._storage.bucket_name, prefix=file_pattern)
 
         for blob in blobs:
             if blob:
-                yield blob
+                yield FileInfo(name=blob.name, size=blob.size, last_modified=blob.updated, etag=blob.etag)
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        prefix = path.strip('/') + '/' if path.strip('/') else ''
+        blobs = self._client.list_blobs(self._storage.bucket_name, prefix=prefix, delimiter='/')
+        # the prefixes up to the next '/' are known after all pages were fetched
+        file_infos = [FileInfo(name=blob.name, size=blob.size, last_modified=blob.updated, etag=blob.etag)
+                      for blob in blobs]
+        yield from sorted(file_infos + [FileInfo(name=name) for name in blobs.prefixes], key=lambda file_info: file_info.name)
 
 
 class GoogleCloudStorageShellClient(GoogleCloudStorageClient):
@@ -75,24 +166,115 @@ class GoogleCloudStorageShellClient(GoogleCloudStorageClient):
         (exitcode, stdout) = subprocess.getstatusoutput(command)
 
         if exitcode != 0:
-            raise Exception('An error occured while getting the last modification time of a file' +
-                            f' in a GCS bucket. Stdout:\n{stdout}')
+            raise execution.command_error('An error occured while getting the last modification time of a file' +
+                                          ' in a GCS bucket. Stdout:\n', stdout)
 
         # NOTE: There is a known issue that python does not read the timezone when using
         #       datetime.strptime with parameter '%Z'. When the local timezone is different
         #       as the GCS timezone, you might run into issues with this.
         return datetime.datetime.strptime(stdout, '%a, %d %b %Y %H:%M:%S %Z').astimezone()
 
-    def iterate_files(self, file_pattern: str) -> t.Iterator[str]:
-        command = ('gsutil '
-                   + (f'-o Credentials:gs_service_key_file={shlex.quote(self._storage.service_account_file)} ' if self._storage.service_account_file else '')
+    def _gsutil_command(self, parallel: bool = False) -> str:
+        return ('gsutil '
+                + ('-m ' if parallel else '')
+                + (f'-o Credentials:gs_service_key_file={shlex.quote(self._storage.service_account_file)} ' if self._storage.service_account_file else ''))
+
+    def iterate_files(self, file_pattern: str, parallel: bool = False) -> t.Iterator[str]:
+        """
+        Iterates over files on on a storage
+
+        The file names are yielded while `gsutil ls` is still running.
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`
+            parallel: if True, `gsutil` is called with option `-m`
+        """
+        command = (self._gsutil_command(parallel=parallel)
                    + f"ls {shlex.quote(self._storage.build_uri(file_pattern))}")
-        (exitcode, stdout) = subprocess.getstatusoutput(command)
+
+        bucket_uri = self._storage.build_uri('')
+        for file in iterate_command_output(command, error_message='An error occured while iterating over files in a GCS bucket.'):
+            if file:
+                # `gsutil ls` prints URIs, the names are relative to the bucket
+                yield file[len(bucket_uri):] if file.startswith(bucket_uri) else file
+
+    def iterate_file_infos(self, file_pattern: str, parallel: bool = False) -> t.Iterator[FileInfo]:
+        """
+        Iterates over files on on a storage including their size and last modification timestamp
+
+        Uses `gsutil ls -l` so that no additional request per file is necessary.
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`
+            parallel: if True, `gsutil` is called with option `-m`
+        """
+        command = (self._gsutil_command(parallel=parallel)
+                   + f"ls -l {shlex.quote(self._storage.build_uri(file_pattern))}")
+
+        bucket_uri = self._storage.build_uri('')
+        for line in iterate_command_output(command, error_message='An error occured while iterating over files in a GCS bucket.'):
+            file_info = _parse_ls_long_line(line)
+            if file_info:
+                yield file_info._replace(name=file_info.name[len(bucket_uri):]) if file_info.name.startswith(bucket_uri) else file_info
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        prefix = path.strip('/') + '/' if path.strip('/') else ''
+        bucket_uri = self._storage.build_uri('')
+        command = self._gsutil_command() + f"ls -l {shlex.quote(self._storage.build_uri(prefix))}"
+        file_infos = []
+        for line in iterate_command_output(command, error_message='An error occured while iterating over files in a GCS bucket.'):
+            file_info = _parse_ls_long_line(line)
+            if file_info:
+                # `gsutil ls` prints URIs, the names are relative to the bucket
+                file_infos.append(file_info._replace(name=file_info.name[len(bucket_uri):]))
+        yield from sorted(file_infos, key=lambda file_info: file_info.name)
+
+
+def iterate_command_output(command: str, error_message: str) -> t.Iterator[str]:
+    """
+    Runs a shell command and yields its stdout line by line while the command is running
+
+    Args:
+        command: the shell command
+        error_message: the message of the exception raised when the command fails. A
+                       `execution.ThrottledError` is raised when the output shows that the
+                       storage throttled the command.
+
+    Returns:
+        An iterator over the stdout lines without line endings
+    """
+    # stderr goes to a temporary file so that a chatty stderr can never block the process
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=stderr,
+                                   universal_newlines=True)
+        try:
+            for line in process.stdout:
+                yield line.rstrip('\n')
+            exitcode = process.wait()
+        finally:
+            if process.poll() is None:
+                # the consumer stopped iterating before the command finished
+                process.kill()
+                process.wait()
+            process.stdout.close()
 
         if exitcode != 0:
-            raise Exception('An error occured while iterating over files in a GCS bucket.' +
-                            f' Stdout:\n{stdout}')
+            stderr.seek(0)
+            raise execution.command_error(error_message + ' Stderr:\n', stderr.read().decode(errors="replace"))
 
-        for file in stdout.split('\n'):
-            if file:
-                yield file
+
+def _parse_ls_long_line(line: str) -> t.Optional[FileInfo]:
+    """
+    Parses a line of the output of `gsutil ls -l`, e.g.
+
+        `'    2276224  2017-03-14T16:55:28Z  gs://my-bucket/my-file.csv'`
+    """
+    parts = line.split(maxsplit=2)
+    if not parts or parts[0] == 'TOTAL:':
+        return None
+    if len(parts) == 1:
+        # a 'directory' prefix, listed without size and timestamp
+        return FileInfo(name=parts[0])
+    return FileInfo(name=parts[2],
+                    size=int(parts[0]),
+                    last_modified=datetime.datetime.strptime(parts[1], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc))
@@ -0,0 +1,276 @@
+"""
+Hedged requests for latency-sensitive reads
+
+When a request did not answer within a high percentile of the latencies seen so far,
+a duplicate request is sent and the first answer is taken. As only the slowest few
+percent of the requests are duplicated, this cuts the tail latency at a small extra load.
+
+Hedging is opt-in per storage, see `config.hedger`.
+"""
+
+import bisect
+import concurrent.futures
+import functools
+import math
+import threading
+import time
+import typing as t
+import weakref
+
+from mara_storage import storages
+
+
+class LatencyHistogram:
+    def __init__(self, min_latency: float = 0.0005, max_latency: float = 120.0, growth_factor: float = 1.2,
+                 max_samples: int = 10000):
+        """
+        A histogram of request latencies with exponentially growing buckets
+
+        To follow changes of the latency, all counts are halved when `max_samples` samples
+        are collected, so that older samples weigh less.
+
+        Args:
+            min_latency: the upper bound of the first bucket in seconds
+            max_latency: latencies above are counted in the last bucket
+            growth_factor: the factor between the upper bounds of adjacent buckets
+            max_samples: the number of samples after which the counts are halved
+        """
+        self.max_samples = max_samples
+        self.upper_bounds = [min_latency * growth_factor ** i
+                             for i in range(math.ceil(math.log(max_latency / min_latency, growth_factor)) + 1)]
+        self._counts = [0] * (len(self.upper_bounds) + 1)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        """Adds a latency in seconds"""
+        index = bisect.bisect_left(self.upper_bounds, latency)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            if self._count >= self.max_samples:
+                self._counts = [count // 2 for count in self._counts]
+                self._count = sum(self._counts)
+
+    @property
+    def count(self) -> int:
+        """The (decayed) number of samples"""
+        return self._count
+
+    def percentile(self, percentile: float) -> t.Optional[float]:
+        """
+        Returns the upper bound of the bucket containing a percentile, None when there are no samples
+
+        Args:
+            percentile: the percentile, e.g. `95`
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            rank = self._count * percentile / 100
+            cumulative = 0
+            for index, count in enumerate(self._counts):
+                cumulative += count
+                if cumulative >= rank and count:
+                    return self.upper_bounds[min(index, len(self.upper_bounds) - 1)]
+            return self.upper_bounds[-1]
+
+    def buckets(self) -> t.List[t.Tuple[float, int]]:
+        """Returns tuples `(upper bound in seconds, count)`, the last bucket has upper bound `inf`"""
+        with self._lock:
+            return list(zip(self.upper_bounds + [math.inf], self._counts))
+
+    def __repr__(self) -> str:
+        return (f'<{self.__class__.__name__}: count={self.count}, '
+                + f'p50={self.percentile(50)}, p95={self.percentile(95)}, p99={self.percentile(99)}>')
+
+
+class Hedger:
+    def __init__(self, percentile: float = 95, min_delay: float = 0.005, max_extra_load: float = 0.05,
+                 min_samples: int = 50, max_workers: int = 32):
+        """
+        Sends a duplicate request when a request is slower than a percentile of the latencies
+        seen before and takes the first answer, see `config.hedger`
+
+        Latencies are recorded per operation, see `histograms`. The answering request of a
+        call is recorded: its latency is what the caller experienced.
+
+        Args:
+            percentile: requests slower than this percentile of the recorded latencies are hedged
+            min_delay: the minimum delay in seconds before a request is hedged
+            max_extra_load: the maximum ratio of hedged requests to calls, e.g. 0.05 for 5% extra requests
+            min_samples: the number of latencies to record for an operation before requests are hedged
+            max_workers: the maximum number of threads running requests
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_extra_load = max_extra_load
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+
+        self.calls = 0
+        self.hedged_calls = 0
+        self.hedge_wins = 0  # hedged calls in which the duplicate answered first
+
+        self._histograms: t.Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._running = 0  # the requests running in workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='mara-storage-hedging')
+
+    def histogram(self, operation: str) -> LatencyHistogram:
+        """Returns the latency histogram of an operation"""
+        with self._lock:
+            if operation not in self._histograms:
+                self._histograms[operation] = LatencyHistogram()
+            return self._histograms[operation]
+
+    def histograms(self) -> t.Dict[str, LatencyHistogram]:
+        """Returns the latency histograms by operation"""
+        with self._lock:
+            return dict(self._histograms)
+
+    def delay(self, operation: str) -> t.Optional[float]:
+        """Returns after how many seconds a request of an operation is hedged, None when it is not hedged"""
+        histogram = self.histogram(operation)
+        if histogram.count < self.min_samples:
+            return None
+        return max(histogram.percentile(self.percentile), self.min_delay)
+
+    def call(self, operation: str, function: t.Callable, *args, **kwargs):
+        """
+        Calls `function(*args, **kwargs)`, and a second time when the first call does not
+        return within the hedge delay of the operation. Returns the first result.
+
+        Requests never wait for a worker: when all workers are busy, the request runs in the
+        calling thread and is not hedged. Latencies are measured from the start of a request.
+
+        Args:
+            operation: the operation, e.g. `'read_file'`
+            function: the function doing the request. Must be safe to call twice.
+        """
+        histogram = self.histogram(operation)
+        delay = self.delay(operation)
+        with self._lock:
+            self.calls += 1
+
+        primary = self._submit(function, args, kwargs) if delay is not None else None
+        if not primary:
+            start = time.monotonic()
+            result = function(*args, **kwargs)
+            histogram.record(time.monotonic() - start)
+            return result
+
+        primary.started.wait()
+        try:
+            result = primary.future.result(timeout=max(primary.start + delay - time.monotonic(), 0))
+        except concurrent.futures.TimeoutError:
+            pass
+        else:
+            histogram.record(primary.latency())
+            return result
+
+        with self._lock:
+            hedge = self.hedged_calls < self.max_extra_load * self.calls
+            if hedge:
+                self.hedged_calls += 1
+        duplicate = self._submit(function, args, kwargs) if hedge else None
+        if not duplicate:
+            if hedge:
+                with self._lock:
+                    self.hedged_calls -= 1  # all workers are busy
+            result = primary.future.result()
+            histogram.record(primary.latency())
+            return result
+
+        requests = {primary.future: primary, duplicate.future: duplicate}
+        pending = set(requests)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if requests[future] is duplicate:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    histogram.record(requests[future].latency())
+                    return future.result()
+        # both requests failed
+        return primary.future.result()
+
+    def _submit(self, function: t.Callable, args: tuple, kwargs: dict) -> t.Optional['_Request']:
+        """
+        Runs a request in a worker with the execution state and priority of the calling thread,
+        None when all workers are busy
+        """
+        from . import execution
+
+        with self._lock:
+            if self._running >= self.max_workers:
+                return None
+            self._running += 1
+
+        request = _Request()
+
+        def run():
+            request.start = time.monotonic()
+            request.started.set()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                request.end = time.monotonic()
+                with self._lock:
+                    self._running -= 1
+
+        request.future = self._executor.submit(execution.bind(run))
+        return request
+
+    def __repr__(self) -> str:
+        return (f'<{self.__class__.__name__}: calls={self.calls}, hedged_calls={self.hedged_calls}, '
+                + f'hedge_wins={self.hedge_wins}>')
+
+
+class _Request:
+    """A request running in a worker of a `Hedger`"""
+    __slots__ = ('future', 'started', 'start', 'end')
+
+    def __init__(self):
+        self.future: concurrent.futures.Future = None
+        self.started = threading.Event()
+        self.start: float = None
+        self.end: float = None
+
+    def latency(self) -> float:
+        return self.end - self.start
+
+
+_hedgers: t.Dict[str, t.Optional[Hedger]] = {}
+# hedgers of storages not taken from the config by alias
+_storage_hedgers = weakref.WeakKeyDictionary()
+_hedgers_lock = threading.Lock()
+
+
+def hedger(storage: storages.Storage) -> t.Optional[Hedger]:
+    """Returns the hedger of a storage, None when hedging is not enabled. Storages taken from the config share one hedger per alias."""
+    from . import config
+
+    alias = storages.alias(storage)
+    with _hedgers_lock:
+        hedgers, key = (_hedgers, alias) if alias else (_storage_hedgers, storage)
+        if key not in hedgers:
+            hedgers[key] = config.hedger(alias)
+        return hedgers[key]
+
+
+def hedged(function):
+    """
+    Decorator for client methods doing a single idempotent request, e.g. reading a file
+
+    Without a hedger configured for the storage of the client, the method is called as is.
+    """
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        storage_hedger = hedger(self._storage)
+        if not storage_hedger:
+            return function(self, *args, **kwargs)
+        return storage_hedger.call(function.__name__, function, self, *args, **kwargs)
+    return wrapper
@@ -2,7 +2,7 @@
 
 from functools import singledispatch
 
-from mara_storage import storages
+from mara_storage import events, packing, storages
 
 
 @singledispatch
@@ -19,11 +19,26 @@ def __(alias: str, file_name: str):
 
 
 @file_exists.register(storages.LocalStorage)
+@events.tracked('file_exists')
+@packing.packed_file_exists
 def __(storage: storages.LocalStorage, file_name: str):
     return (storage.base_path.absolute() / file_name).is_file()
 
 
+@file_exists.register(storages.MemoryStorage)
+@events.tracked('file_exists')
+@packing.packed_file_exists
+def __(storage: storages.MemoryStorage, file_name: str):
+    from . import memory_storage
+    try:
+        return memory_storage.bucket(storage, create=False).exists(file_name)
+    except FileNotFoundError:
+        return False
+
+
 @file_exists.register(storages.SftpStorage)
+@events.tracked('file_exists')
+@packing.packed_file_exists
 def __(storage: storages.SftpStorage, file_name: str):
     from . import sftp
     with sftp.connection(storage) as sftp:
@@ -31,6 +46,8 @@ def __(storage: storages.SftpStorage, file_name: str):
 
 
 @file_exists.register(storages.GoogleCloudStorage)
+@events.tracked('file_exists')
+@packing.packed_file_exists
 def __(storage: storages.GoogleCloudStorage, file_name: str):
     import subprocess
     import shlex
@@ -46,6 +63,8 @@ def __(storage: storages.GoogleCloudStorage, file_name: str):
 
 
 @file_exists.register(storages.AzureStorage)
+@events.tracked('file_exists')
+@packing.packed_file_exists
 def __(storage: storages.AzureStorage, file_name: str):
     from . import azure
     client = azure.init_client(storage, path=file_name)
@@ -1,14 +1,23 @@
+import concurrent.futures
 import datetime
+import fnmatch
 import glob
+import mmap
 import os
-import pathlib
+import shlex
+import shutil
+import sys
 import typing as t
+import uuid
 
 from mara_storage import storages
-from mara_storage.client import StorageClient
+from mara_storage.client import StorageClient, FileInfo, _iterate_chunks
 
 
 class LocalStorageClient(StorageClient):
+    # a local storage never throttles
+    _EXECUTED_OPERATIONS = []
+
     def __init__(self, storage: storages.LocalStorage):
         super().__init__(storage)
 
@@ -16,6 +25,252 @@ class LocalStorageClient(StorageClient):
         return datetime.datetime.fromtimestamp(
             os.path.getmtime(self._storage.base_path.absolute() / path)).astimezone()
 
-    def iterate_files(self, file_pattern: str)-> t.Iterator[str]:
-        for file in glob.iglob(str(self._storage.base_path / file_pattern)):
-            yield str(pathlib.Path(file).relative_to(self._storage.base_path))
+    def read_file(self, path: str) -> bytes:
+        with open(self._storage.base_path.absolute() / path, 'rb') as f:
+            return f.read()
+
+    def file_size(self, path: str) -> int:
+        return os.path.getsize(self._storage.base_path.absolute() / path)
+
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        with open(self._storage.base_path.absolute() / path, 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def upload_file(self, local_path: str, path: str):
+        target = self._storage.base_path.absolute() / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # copy to a temporary file first, so that readers never see a partially written file
+        temporary_path = target.parent / f'.{target.name}.{uuid.uuid4().hex}'
+        try:
+            shutil.copyfile(local_path, temporary_path)
+            os.replace(temporary_path, target)
+        except BaseException:
+            if temporary_path.exists():
+                temporary_path.unlink()
+            raise
+
+    def append(self, path: str, stream: t.Union[bytes, t.BinaryIO]) -> int:
+        target = self._storage.base_path.absolute() / path
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # opened with O_APPEND: each write goes to the end of the file, also with concurrent writers
+        with open(target, 'ab') as f:
+            for chunk in _iterate_chunks(stream):
+                f.write(chunk)
+            return f.tell()
+
+    def open_mmap(self, path: str) -> mmap.mmap:
+        """
+        Maps a file read-only into memory
+
+        The returned `mmap.mmap` can be used as context manager. Empty files can not
+        be mapped, use `read_buffer` when the file might be empty.
+
+        Args:
+            path: the file path within the storage
+        """
+        with open(self._storage.base_path.absolute() / path, 'rb') as f:
+            # the mapping stays valid after the file is closed
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_buffer(self, path: str) -> memoryview:
+        """
+        Returns a read-only `memoryview` over a memory mapped file
+
+        The content is not copied: pages are read from disk when they are accessed, and
+        the view can be passed directly to parsers supporting the buffer protocol, e.g.
+        `numpy.frombuffer` or `pyarrow.py_buffer`. The file stays mapped until the view
+        (and all views derived from it) are released.
+
+        Args:
+            path: the file path within the storage
+        """
+        if os.path.getsize(self._storage.base_path.absolute() / path) == 0:
+            return memoryview(b'')
+        return memoryview(self.open_mmap(path))
+
+    def iterate_files(self, file_pattern: str, max_workers: int = None) -> t.Iterator[str]:
+        """
+        Iterates over files on on a storage
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`. Use `**` to match
+                          any number of subdirectories, e.g. `'logs/**/*.log'`
+            max_workers: if set, subdirectories are scanned in parallel by this number
+                         of threads. Useful on network file systems.
+        """
+        for entry in walk(str(self._storage.base_path), file_pattern, max_workers=max_workers):
+            yield entry.name
+
+    def iterate_file_infos(self, file_pattern: str, max_workers: int = None) -> t.Iterator[FileInfo]:
+        """
+        Iterates over files on on a storage including their size and last modification timestamp
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`. Use `**` to match
+                          any number of subdirectories, e.g. `'logs/**/*.log'`
+            max_workers: if set, subdirectories are scanned in parallel by this number
+                         of threads. Useful on network file systems.
+        """
+        for entry in walk(str(self._storage.base_path), file_pattern, max_workers=max_workers):
+            stat = entry.stat()
+            yield FileInfo(name=entry.name,
+                           size=stat.st_size,
+                           last_modified=datetime.datetime.fromtimestamp(stat.st_mtime).astimezone())
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        directory = path.strip('/')
+        for dir_entry in sorted(_scandir(str(self._storage.base_path.absolute() / directory)), key=lambda entry: entry.name):
+            name = f'{directory}/{dir_entry.name}' if directory else dir_entry.name
+            if dir_entry.is_dir():
+                yield FileInfo(name=name + '/')
+            else:
+                stat = dir_entry.stat()
+                yield FileInfo(name=name, size=stat.st_size,
+                               last_modified=datetime.datetime.fromtimestamp(stat.st_mtime).astimezone())
+
+
+class WalkEntry:
+    """A file or directory found by `walk`, caching the stat result of the underlying `os.DirEntry`"""
+    __slots__ = ('name', 'path', '_dir_entry', '_stat')
+
+    def __init__(self, name: str, path: str, dir_entry: os.DirEntry = None):
+        self.name = name  # path relative to the walked root, using '/' as separator
+        self.path = path  # full path
+        self._dir_entry = dir_entry
+        self._stat = None
+
+    def stat(self) -> os.stat_result:
+        if self._stat is None:
+            self._stat = self._dir_entry.stat() if self._dir_entry else os.stat(self.path)
+        return self._stat
+
+    def is_dir(self) -> bool:
+        return self._dir_entry.is_dir() if self._dir_entry else os.path.isdir(self.path)
+
+    def __repr__(self) -> str:
+        return f'<WalkEntry: {self.name}>'
+
+
+# A unit of work of the walker: scan the directory `path` (with name `name` relative to
+# the root) for the remaining pattern segments
+_WalkTask = t.Tuple[str, str, t.Tuple[str, ...]]
+
+
+def walk(root: str, file_pattern: str, max_workers: int = None) -> t.Iterator[WalkEntry]:
+    """
+    Iterates over the files and directories below `root` matching a glob pattern using `os.scandir`
+
+    Matches the behavior of `glob.iglob(..., recursive=True)`: `*` and `?` do not cross
+    directory boundaries, `**` matches any number of subdirectories and names starting
+    with a dot are only matched when the pattern segment starts with a dot. A trailing `**`
+    matches everything below the directory, but not the directory itself. Directories
+    are only scanned when they can contain matches, e.g. for `'2020/*/data.csv'` only
+    the subfolders of `2020` are scanned.
+
+    Args:
+        root: the directory in which the pattern is matched
+        file_pattern: the glob pattern relative to `root`
+        max_workers: if set, directories are scanned in parallel by this number of threads
+
+    Returns:
+        An iterator over the matching entries. The order is not defined.
+    """
+    segments = tuple(segment for segment in file_pattern.split('/') if segment)
+    if not segments:
+        return
+
+    initial_task = (root, '', segments)
+
+    if not max_workers or max_workers <= 1:
+        tasks = [initial_task]
+        while tasks:
+            entries, subtasks = _scan(*tasks.pop())
+            yield from entries
+            tasks.extend(reversed(subtasks))
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(_scan, *initial_task)}
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    entries, subtasks = future.result()
+                    pending.update(executor.submit(_scan, *task) for task in subtasks)
+                    yield from entries
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _scan(path: str, name: str, segments: t.Tuple[str, ...]) -> t.Tuple[t.List[WalkEntry], t.List[_WalkTask]]:
+    """Matches the first pattern segment against the directory `path`"""
+    entries = []
+    subtasks = []
+    segment, remaining = segments[0], segments[1:]
+
+    if not glob.has_magic(segment):
+        # literal segment: no need to scan the directory
+        entry_path = os.path.join(path, segment)
+        entry_name = f'{name}/{segment}' if name else segment
+        if remaining:
+            if os.path.isdir(entry_path):
+                subtasks.append((entry_path, entry_name, remaining))
+        elif os.path.lexists(entry_path):
+            entries.append(WalkEntry(entry_name, entry_path))
+        return entries, subtasks
+
+    if segment == '**':
+        if remaining:
+            # '**' matches zero directories
+            subtasks.append((path, name, remaining))
+
+    for dir_entry in _scandir(path):
+        if dir_entry.name.startswith('.') and not segment.startswith('.'):
+            continue
+
+        entry_name = f'{name}/{dir_entry.name}' if name else dir_entry.name
+        if segment == '**':
+            if not remaining:
+                entries.append(WalkEntry(entry_name, dir_entry.path, dir_entry))
+            if dir_entry.is_dir():
+                subtasks.append((dir_entry.path, entry_name, segments))
+        elif fnmatch.fnmatch(dir_entry.name, segment):
+            if not remaining:
+                entries.append(WalkEntry(entry_name, dir_entry.path, dir_entry))
+            elif dir_entry.is_dir():
+                subtasks.append((dir_entry.path, entry_name, remaining))
+
+    return entries, subtasks
+
+
+def _scandir(path: str) -> t.List[os.DirEntry]:
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError:
+        return []
+
+
+def list_files_command(storage: storages.LocalStorage, file_pattern: str) -> str:
+    """
+    Returns a shell command printing the full paths of the files matching `file_pattern`,
+    null-separated and sorted by name. The files are selected by `walk`, i.e. the same
+    files as by `LocalStorageClient.iterate_files`.
+    """
+    return (f'{shlex.quote(sys.executable)} -m mara_storage.local_storage '
+            + f'{shlex.quote(str(storage.base_path.absolute()))} {shlex.quote(file_pattern)}')
+
+
+def _print_files(root: str, file_pattern: str) -> int:
+    """Entry point of the helper process of `list_files_command`"""
+    entries = sorted((entry for entry in walk(root, file_pattern) if not entry.is_dir()), key=lambda entry: entry.name)
+    for entry in entries:
+        sys.stdout.buffer.write(os.fsencode(entry.path) + b'\0')
+    sys.stdout.buffer.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_print_files(*sys.argv[1:]))
@@ -1,6 +1,6 @@
 from functools import singledispatch
 
-from mara_storage import storages
+from mara_storage import events, storages
 
 
 @singledispatch
@@ -15,11 +15,20 @@ def __(alias: str):
 
 
 @ensure_storage.register(storages.LocalStorage)
+@events.tracked('ensure_storage')
 def __(storage: storages.LocalStorage):
     storage.base_path.mkdir(parents=True, exist_ok=True)
 
 
+@ensure_storage.register(storages.MemoryStorage)
+@events.tracked('ensure_storage')
+def __(storage: storages.MemoryStorage):
+    from . import memory_storage
+    memory_storage.bucket(storage, create=True)
+
+
 @ensure_storage.register(storages.GoogleCloudStorage)
+@events.tracked('ensure_storage')
 def __(storage: storages.GoogleCloudStorage):
     import shlex
     import subprocess
@@ -44,6 +53,7 @@ def __(storage: storages.GoogleCloudStorage):
 
 
 @ensure_storage.register(storages.AzureStorage)
+@events.tracked('ensure_storage')
 def __(storage: storages.AzureStorage):
     from . import azure
     client = azure.init_service_client(storage)
@@ -74,6 +84,7 @@ def __(alias: str, force: bool = False):
 
 
 @drop_storage.register(storages.LocalStorage)
+@events.tracked('drop_storage')
 def __(storage: storages.LocalStorage, force: bool = False):
     if force:
         import shutil
@@ -89,7 +100,15 @@ def __(storage: storages.LocalStorage, force: bool = False):
         storage.base_path.rmdir()
 
 
+@drop_storage.register(storages.MemoryStorage)
+@events.tracked('drop_storage')
+def __(storage: storages.MemoryStorage, force: bool = False):
+    from . import memory_storage
+    memory_storage.drop_bucket(storage, force=force)
+
+
 @drop_storage.register(storages.GoogleCloudStorage)
+@events.tracked('drop_storage')
 def __(storage: storages.GoogleCloudStorage, force: bool = False):
     import shlex
     import subprocess
@@ -106,6 +125,7 @@ def __(storage: storages.GoogleCloudStorage, force: bool = False):
 
 
 @drop_storage.register(storages.AzureStorage)
+@events.tracked('drop_storage')
 def __(storage: storages.AzureStorage, force: bool = False):
     from . import azure
     client = azure.init_service_client(storage)
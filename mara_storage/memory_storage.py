@@ -0,0 +1,321 @@
+"""
+A storage held in the memory of the current process
+
+Shell commands can not access the memory of the Python process directly. The commands
+created by `shell` for a `MemoryStorage` therefore call this module as helper process
+(`python -m mara_storage.memory_storage ...`), which streams the file content through a
+unix socket served by a background thread of the process holding the storage.
+"""
+
+import datetime
+import json
+import os
+import shlex
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+
+from mara_storage import storages
+from mara_storage.client import StorageClient, FileInfo, _iterate_chunks
+from mara_storage.listing import glob_regex, literal_prefix
+
+
+class Bucket:
+    """The content of an in-memory storage. All methods are thread-safe."""
+    __slots__ = ('_files', '_lock', '_generation')
+
+    def __init__(self):
+        # file name -> (content, modification timestamp, generation). Appended files hold a
+        # bytearray which is extended in place.
+        self._files: t.Dict[str, t.Tuple[t.Union[bytes, bytearray], float, int]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def write(self, path: str, data: bytes):
+        with self._lock:
+            self._generation += 1
+            self._files[path] = (bytes(data), time.time(), self._generation)
+
+    def append(self, path: str, data: bytes) -> int:
+        with self._lock:
+            existing = self._files.get(path)
+            content = existing[0] if existing and isinstance(existing[0], bytearray) \
+                else bytearray(existing[0] if existing else b'')
+            content += data
+            self._generation += 1
+            self._files[path] = (content, time.time(), self._generation)
+            return len(content)
+
+    def read(self, path: str) -> bytes:
+        return bytes(self._get(path)[0])
+
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        return bytes(self._get(path)[0][start:start + length])
+
+    def stat(self, path: str) -> FileInfo:
+        data, mtime, generation = self._get(path)
+        return FileInfo(name=path, size=len(data),
+                        last_modified=datetime.datetime.fromtimestamp(mtime).astimezone(),
+                        etag=str(generation))
+
+    def exists(self, path: str) -> bool:
+        return path in self._files
+
+    def delete(self, path: str, force: bool = True, recursive: bool = False):
+        with self._lock:
+            if recursive:
+                prefix = path.rstrip('/') + '/'
+                for name in [name for name in self._files if name.startswith(prefix)]:
+                    del self._files[name]
+            if path in self._files:
+                del self._files[path]
+            elif not force and not recursive:
+                raise FileNotFoundError(f'File "{path}" not found')
+
+    def names(self) -> t.List[str]:
+        with self._lock:
+            return list(self._files)
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _get(self, path: str) -> t.Tuple[t.Union[bytes, bytearray], float, int]:
+        try:
+            with self._lock:
+                return self._files[path]
+        except KeyError:
+            raise FileNotFoundError(f'File "{path}" not found') from None
+
+
+_buckets: t.Dict[str, Bucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket(storage: storages.MemoryStorage, create: bool = True) -> Bucket:
+    """Returns the content of an in-memory storage"""
+    with _buckets_lock:
+        if storage.name not in _buckets:
+            if not create:
+                raise FileNotFoundError(f'Memory storage "{storage.name}" does not exist')
+            _buckets[storage.name] = Bucket()
+        return _buckets[storage.name]
+
+
+def drop_bucket(storage: storages.MemoryStorage, force: bool = False):
+    """Removes an in-memory storage"""
+    with _buckets_lock:
+        if storage.name not in _buckets:
+            if force:
+                return
+            raise FileNotFoundError(f'Memory storage "{storage.name}" does not exist')
+        if len(_buckets[storage.name]) and not force:
+            raise OSError(f'Memory storage "{storage.name}" is not empty')
+        del _buckets[storage.name]
+
+
+class MemoryStorageClient(StorageClient):
+    # an in-memory storage never throttles
+    _EXECUTED_OPERATIONS = []
+
+    def __init__(self, storage: storages.MemoryStorage):
+        super().__init__(storage)
+
+    @property
+    def _bucket(self) -> Bucket:
+        return bucket(self._storage)
+
+    def last_modification_timestamp(self, path: str) -> datetime.datetime:
+        return self._bucket.stat(path).last_modified
+
+    def iterate_files(self, file_pattern: str) -> t.Iterator[str]:
+        for file_info in self.iterate_file_infos(file_pattern):
+            yield file_info.name
+
+    def iterate_file_infos(self, file_pattern: str) -> t.Iterator[FileInfo]:
+        """
+        Iterates over files on on a storage including their size and last modification timestamp
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`. `*` does not match
+                          `/`, `**` matches any number of subdirectories.
+        """
+        bucket = self._bucket
+        for name in _matching_names(bucket, file_pattern):
+            try:
+                yield bucket.stat(name)
+            except FileNotFoundError:
+                continue  # deleted in the meantime
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        bucket = self._bucket
+        prefix = path.strip('/') + '/' if path.strip('/') else ''
+        entries = set()
+        for name in bucket.names():
+            if name.startswith(prefix):
+                child, separator, _ = name[len(prefix):].partition('/')
+                entries.add((prefix + child + separator, not separator))
+        for name, is_file in sorted(entries):
+            if not is_file:
+                yield FileInfo(name=name)
+                continue
+            try:
+                yield bucket.stat(name)
+            except FileNotFoundError:
+                continue  # deleted in the meantime
+
+    def read_file(self, path: str) -> bytes:
+        return self._bucket.read(path)
+
+    def write_file(self, path: str, data: bytes):
+        """Writes a file to the in-memory storage"""
+        self._bucket.write(path, data)
+
+    def file_size(self, path: str) -> int:
+        return len(self._bucket.read(path))
+
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        return self._bucket.read_range(path, start, length)
+
+    def upload_file(self, local_path: str, path: str):
+        with open(local_path, 'rb') as f:
+            self._bucket.write(path, f.read())
+
+    def append(self, path: str, stream: t.Union[bytes, t.BinaryIO]) -> int:
+        return self._bucket.append(path, b''.join(_iterate_chunks(stream)))
+
+    def delete_file(self, path: str, force: bool = True, recursive: bool = False):
+        """Deletes a file from the in-memory storage"""
+        self._bucket.delete(path, force=force, recursive=recursive)
+
+
+def _matching_names(bucket: Bucket, file_pattern: str) -> t.List[str]:
+    """Returns the sorted names of the files of a bucket matching a glob pattern"""
+    regex = glob_regex(file_pattern)
+    prefix = literal_prefix(file_pattern)
+    return sorted(name for name in bucket.names() if name.startswith(prefix) and regex.fullmatch(name))
+
+
+# -----------------------------------------------------------------------------
+# helper process used by the shell commands
+
+
+_server: t.Optional[socketserver.ThreadingUnixStreamServer] = None
+_server_lock = threading.Lock()
+
+
+def _reset_server():
+    """A forked process serves its own copy of the storages, the server thread of the parent does not exist in it"""
+    global _server, _server_lock
+    _server = None
+    _server_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_server)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        storage = storages.MemoryStorage(name=request['storage'])
+        try:
+            if request['operation'] == 'read':
+                data = bucket(storage, create=False).read(request['path'])
+                self.wfile.write(b'OK\n')
+                self.wfile.write(data)
+            elif request['operation'] == 'read_files':
+                storage_bucket = bucket(storage, create=False)
+                names = _matching_names(storage_bucket, request['path'])
+                self.wfile.write(b'OK\n')
+                for name in names:
+                    try:
+                        self.wfile.write(storage_bucket.read(name))
+                    except FileNotFoundError:
+                        continue  # deleted in the meantime
+            elif request['operation'] == 'write':
+                data = self.rfile.read()
+                bucket(storage, create=False).write(request['path'], data)
+                self.wfile.write(b'OK\n')
+            elif request['operation'] == 'delete':
+                bucket(storage, create=False).delete(request['path'], force=request['force'],
+                                                     recursive=request['recursive'])
+                self.wfile.write(b'OK\n')
+            else:
+                raise ValueError(f'Unknown operation {request["operation"]}')
+        except Exception as e:
+            self.wfile.write(f'ERROR {e}\n'.encode())
+
+
+def server_address() -> str:
+    """Starts the helper server of this process if necessary and returns its socket path"""
+    global _server
+    with _server_lock:
+        if not _server:
+            socket_path = os.path.join(tempfile.mkdtemp(prefix='mara-memory-storage-'), 'socket')
+            _server = socketserver.ThreadingUnixStreamServer(socket_path, _RequestHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server.server_address
+
+
+def helper_command(storage: storages.MemoryStorage, operation: str, path: str,
+                   force: bool = True, recursive: bool = False) -> str:
+    """Returns the shell command calling the helper process"""
+    request = json.dumps({'storage': storage.name, 'operation': operation, 'path': path,
+                          'force': force, 'recursive': recursive})
+    return (f'{shlex.quote(sys.executable)} -m mara_storage.memory_storage '
+            + f'{shlex.quote(server_address())} {shlex.quote(request)}')
+
+
+def _run_helper(socket_path: str, request: str, *arguments: str) -> int:
+    request_data = json.loads(request)
+    if request_data['operation'] == 'upload':
+        # the helper sends the files of a local directory (argument 1) one by one
+        directory = arguments[0]
+        for root, _, file_names in sorted(os.walk(directory)):
+            for file_name in sorted(file_names):
+                local_path = os.path.join(root, file_name)
+                path = os.path.relpath(local_path, directory).replace(os.sep, '/')
+                if request_data['path']:
+                    path = request_data['path'].rstrip('/') + '/' + path
+                with open(local_path, 'rb') as f:
+                    exitcode = _send_request(socket_path, json.dumps({**request_data, 'operation': 'write', 'path': path}), f)
+                if exitcode:
+                    return exitcode
+        return 0
+    return _send_request(socket_path, request, sys.stdin.buffer)
+
+
+def _send_request(socket_path: str, request: str, input: t.BinaryIO) -> int:
+    operation = json.loads(request)['operation']
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall(request.encode() + b'\n')
+        if operation == 'write':
+            while True:
+                chunk = input.read1(1024 * 1024) if hasattr(input, 'read1') else input.read(1024 * 1024)
+                if not chunk:
+                    break
+                connection.sendall(chunk)
+        connection.shutdown(socket.SHUT_WR)
+
+        with connection.makefile('rb') as response:
+            status = response.readline()
+            if not status.startswith(b'OK'):
+                sys.stderr.write(status.decode().replace('ERROR ', '', 1))
+                return 1
+            while True:
+                chunk = response.read1(1024 * 1024)
+                if not chunk:
+                    break
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_run_helper(*sys.argv[1:]))
@@ -0,0 +1,450 @@
+"""
+Packing many small files into few large objects
+
+Each request to a cloud storage has a fixed cost, and a listing page holds only 1,000
+files. Millions of tiny files are therefore slow and expensive. A packed namespace is a
+directory holding packs, large objects with many logical files concatenated, each with a
+sidecar index listing the name, offset and length of the files in the pack:
+
+    events/pack-20261017T120000000000-3f2a9c1b.pack
+    events/pack-20261017T120000000000-3f2a9c1b.index
+
+Directories configured in `config.packed_namespaces` are transparent to the storage clients:
+`StorageClient.iterate_files` and `info.file_exists` look the logical files up in the
+indexes, and reading a logical file costs a single ranged read of its pack. When several
+packs contain a file, the most recent pack wins.
+
+Example:
+    with PackWriter('data', 'events') as writer:
+        for event in events:
+            writer.write_file(f'{event.day}/{event.id}.json', event.json)
+
+    StorageClient('data').read_file('events/2026-10-17/4711.json')
+"""
+
+import bisect
+import concurrent.futures
+import contextlib
+import datetime
+import functools
+import gzip
+import logging
+import os
+import tempfile
+import threading
+import time
+import typing as t
+import uuid
+import weakref
+
+from mara_storage import storages
+
+
+PACK_SUFFIX = '.pack'
+INDEX_SUFFIX = '.index'
+
+
+class PackWriter:
+    def __init__(self, storage: t.Union[str, storages.Storage], namespace: str,
+                 max_pack_bytes: int = 256 * 1024 ** 2, max_workers: int = 4, spool_directory: str = None):
+        """
+        Writes logical files into packs in a namespace
+
+        A pack is uploaded when it exceeds `max_pack_bytes` and when the writer is closed,
+        its index is uploaded afterwards. The files of a pack become visible when its index
+        is uploaded. Not thread-safe.
+
+        Args:
+            storage: the storage alias or configuration
+            namespace: the directory of the packs within the storage
+            max_pack_bytes: the size after which a pack is finished
+            max_workers: the number of packs uploaded at the same time
+            spool_directory: the local directory for packs, by default the temporary directory
+        """
+        from .client import StorageClient
+
+        self.storage = storages.storage(storage) if isinstance(storage, str) else storage
+        self.namespace = namespace.strip('/')
+        self.max_pack_bytes = max_pack_bytes
+        self.max_workers = max_workers
+        self.spool_directory = spool_directory
+
+        self._client = StorageClient(self.storage)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='pack-upload')
+        self._uploads: t.List[concurrent.futures.Future] = []
+        self._file = None
+        self._spool_path = None
+        # name -> (offset, length) of the files in the current pack
+        self._entries: t.Dict[str, t.Tuple[int, int]] = {}
+        self._closed = False
+
+    def write_file(self, name: str, data: bytes):
+        """
+        Adds a file to the current pack
+
+        Args:
+            name: the file name within the namespace, e.g. `'2026-10-17/4711.json'`
+            data: the file content
+        """
+        if self._closed:
+            raise ValueError('The writer is closed')
+        if not self._file:
+            file_descriptor, self._spool_path = tempfile.mkstemp(dir=self.spool_directory, suffix=PACK_SUFFIX)
+            self._file = os.fdopen(file_descriptor, 'wb')
+        offset = self._file.tell()
+        self._file.write(data)
+        self._entries[name.strip('/')] = (offset, len(data))
+        if self._file.tell() >= self.max_pack_bytes:
+            self._finish_pack()
+
+    def close(self):
+        """Uploads the current pack and waits until all packs are uploaded"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._file:
+                self._finish_pack()
+            for future in self._uploads:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> 'PackWriter':
+        return self
+
+    def discard(self):
+        """Discards the current pack and waits until the finished packs are uploaded"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._file:
+                self._file.close()
+                os.remove(self._spool_path)
+                self._file, self._spool_path, self._entries = None, None, {}
+            for future in self._uploads:
+                future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # the current pack is incomplete, the uploads must not hide the original exception
+            try:
+                self.discard()
+            except Exception:
+                logging.getLogger(__name__).exception('Upload failed')
+
+    def _finish_pack(self):
+        self._file.close()
+        index = encode_index(self._entries)
+        pack_path = f'{self.namespace}/{new_pack_name()}'
+        spool_path = self._spool_path
+        self._file, self._spool_path, self._entries = None, None, {}
+
+        for future in self._uploads:
+            if future.done():
+                future.result()  # raises a failed upload
+        # backpressure: at most two packs per worker wait for their upload
+        self._uploads = [future for future in self._uploads if not future.done()]
+        if len(self._uploads) >= 2 * self.max_workers:
+            concurrent.futures.wait(self._uploads, return_when=concurrent.futures.FIRST_COMPLETED)
+        self._uploads.append(self._executor.submit(self._upload, spool_path, pack_path, index))
+
+    def _upload(self, spool_path: str, pack_path: str, index: bytes):
+        try:
+            self._client.upload_file(spool_path, pack_path)
+        finally:
+            os.unlink(spool_path)
+        # the index is uploaded last, so that it never references a missing pack
+        file_descriptor, index_spool_path = tempfile.mkstemp(dir=self.spool_directory, suffix=INDEX_SUFFIX)
+        try:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                f.write(index)
+            self._client.upload_file(index_spool_path, pack_path[:-len(PACK_SUFFIX)] + INDEX_SUFFIX)
+        finally:
+            os.unlink(index_spool_path)
+        packed_namespace = namespace(self.storage, pack_path)
+        if packed_namespace:
+            packed_namespace.invalidate()
+
+
+def new_pack_name() -> str:
+    """Returns a unique pack file name. Pack names sort by creation time."""
+    return (f'pack-{datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")}-{uuid.uuid4().hex[:8]}'
+            + PACK_SUFFIX)
+
+
+def encode_index(entries: t.Dict[str, t.Tuple[int, int]]) -> bytes:
+    """Returns the index of a pack: gzip compressed lines `<offset>\\t<length>\\t<name>` sorted by name"""
+    return gzip.compress(''.join(f'{offset}\t{length}\t{name}\n'
+                                 for name, (offset, length) in sorted(entries.items())).encode(), compresslevel=6)
+
+
+def decode_index(index: bytes) -> t.Iterator[t.Tuple[str, int, int]]:
+    """Iterates over the `(name, offset, length)` entries of a pack index"""
+    for line in gzip.decompress(index).decode().split('\n')[:-1]:
+        offset, length, name = line.split('\t', 2)
+        yield name, int(offset), int(length)
+
+
+# -----------------------------------------------------------------------------
+
+
+class PackedNamespace:
+    def __init__(self, storage: storages.Storage, directory: str, refresh_interval: float = 10.0):
+        """
+        The logical files of the packs in a directory
+
+        The indexes are loaded on first use. When a file is not found, packs written since
+        are loaded, at most every `refresh_interval` seconds: a `PackWriter` of the same process
+        makes its packs visible right away, packs of other processes become visible with a delay.
+        Listings always load the packs written since.
+
+        Args:
+            storage: the storage configuration
+            directory: the directory of the packs within the storage
+            refresh_interval: the minimum number of seconds between two loads for missing files
+        """
+        self.storage = storage
+        self.directory = directory.strip('/')
+        self.refresh_interval = refresh_interval
+
+        # path -> (pack path, offset, length)
+        self._entries: t.Dict[str, t.Tuple[str, int, int]] = {}
+        self._sorted_paths: t.List[str] = []
+        self._loaded_packs: t.Set[str] = set()
+        self._lock = threading.Lock()
+        # the monotonic time of the last load, None when packs were written since
+        self._refreshed_at: t.Optional[float] = None
+
+    def refresh(self):
+        """Loads the indexes of packs not loaded yet"""
+        from .client import StorageClient
+
+        client = StorageClient(self.storage)
+        with self._lock, unpacked():
+            # before listing: a pack written during the listing invalidates this load
+            self._refreshed_at = time.monotonic()
+            prefix = self.directory + '/'
+            index_paths = sorted(path for path in client.iterate_files(_index_file_pattern(self.storage, self.directory))
+                                 if path.startswith(prefix) and path.endswith(INDEX_SUFFIX)
+                                 and '/' not in path[len(prefix):])
+            new_index_paths = [path for path in index_paths if path not in self._loaded_packs]
+            if not new_index_paths:
+                return
+
+            def read_index(index_path: str) -> bytes:
+                with unpacked():  # in another thread
+                    return client.read_file(index_path)
+
+            from . import execution
+            indexes = execution.map_concurrently(self.storage, read_index, new_index_paths)
+            for index_path, index in zip(new_index_paths, indexes):
+                pack_path = index_path[:-len(INDEX_SUFFIX)] + PACK_SUFFIX
+                for name, offset, length in decode_index(index):
+                    self._entries[f'{prefix}{name}'] = (pack_path, offset, length)
+                self._loaded_packs.add(index_path)
+            self._sorted_paths = sorted(self._entries)
+
+    def lookup(self, path: str) -> t.Optional[t.Tuple[str, int, int]]:
+        """
+        Returns the pack, offset and length of a logical file, None when it does not exist
+
+        Args:
+            path: the file path within the storage
+        """
+        entry = self._entries.get(path)
+        refreshed_at = self._refreshed_at
+        if entry is None and (refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_interval):
+            self.refresh()
+            entry = self._entries.get(path)
+        return entry
+
+    def invalidate(self):
+        """Makes the next lookup of a missing file load the packs written since"""
+        self._refreshed_at = None
+
+    def iterate(self, file_pattern: str) -> t.Iterator[t.Tuple[str, int]]:
+        """
+        Iterates over the `(path, size)` of the logical files matching a glob pattern, sorted by path
+
+        Args:
+            file_pattern: the file pattern within the storage, e.g. `'events/2026-10-*/*.json'`
+        """
+        from .listing import glob_regex, literal_prefix
+
+        self.refresh()
+        regex, prefix = glob_regex(file_pattern), literal_prefix(file_pattern)
+        sorted_paths, entries = self._sorted_paths, self._entries
+        for i in range(bisect.bisect_left(sorted_paths, prefix), len(sorted_paths)):
+            path = sorted_paths[i]
+            if not path.startswith(prefix):
+                break
+            if regex.fullmatch(path):
+                yield path, entries[path][2]
+
+    def read_range(self, path: str, start: int = 0, length: int = None) -> bytes:
+        """
+        Reads a logical file or a part of it with a single ranged read of its pack
+
+        Raises:
+            FileNotFoundError when the file does not exist
+        """
+        from .client import StorageClient
+
+        entry = self.lookup(path)
+        if entry is None:
+            raise FileNotFoundError(f'File "{path}" does not exist in packed namespace "{self.directory}"')
+        pack_path, offset, size = entry
+        start = min(start, size)
+        length = size - start if length is None else min(length, size - start)
+        if length <= 0:
+            return b''
+        with unpacked():
+            return StorageClient(self.storage).read_range(pack_path, offset + start, length)
+
+
+@functools.singledispatch
+def _index_file_pattern(storage: object, directory: str) -> str:
+    """Returns the pattern for listing the index files of a namespace"""
+    return f'{directory}/*{INDEX_SUFFIX}'
+
+
+@_index_file_pattern.register(storages.GoogleCloudStorage)
+@_index_file_pattern.register(storages.AzureStorage)
+def __(storage: storages.Storage, directory: str) -> str:
+    # listings of these clients take a prefix
+    return f'{directory}/'
+
+
+_namespaces: t.Dict[t.Tuple[str, str], PackedNamespace] = {}
+_storage_namespaces: 'weakref.WeakKeyDictionary[storages.Storage, t.Dict[str, PackedNamespace]]' = weakref.WeakKeyDictionary()
+_namespaces_lock = threading.Lock()
+
+_state = threading.local()
+
+
+def namespace(storage: storages.Storage, path: str) -> t.Optional[PackedNamespace]:
+    """
+    Returns the packed namespace containing a path or file pattern, None when the path is not packed
+
+    Args:
+        storage: the storage configuration
+        path: the path or file pattern within the storage
+    """
+    from . import config
+
+    if getattr(_state, 'unpacked', False) or not path:
+        return None
+    alias = storages.alias(storage)
+    directory = next((directory.strip('/') for directory in config.packed_namespaces(alias)
+                      if path.startswith(directory.strip('/') + '/')), None)
+    if directory is None:
+        return None
+    with _namespaces_lock:
+        if alias:
+            return _namespaces.setdefault((alias, directory), PackedNamespace(storage, directory))
+        return _storage_namespaces.setdefault(storage, {}).setdefault(directory, PackedNamespace(storage, directory))
+
+
+@contextlib.contextmanager
+def unpacked():
+    """Within the context, client operations of the current thread access the packs themselves"""
+    outer = getattr(_state, 'unpacked', False)
+    _state.unpacked = True
+    try:
+        yield
+    finally:
+        _state.unpacked = outer
+
+
+# -----------------------------------------------------------------------------
+
+
+def _iterate_files(method):
+    @functools.wraps(method)
+    def wrapper(self, file_pattern: str, *args, **kwargs):
+        packed_namespace = namespace(self._storage, file_pattern)
+        if not packed_namespace:
+            yield from method(self, file_pattern, *args, **kwargs)
+            return
+        for path, _ in packed_namespace.iterate(file_pattern):
+            yield path
+    return wrapper
+
+
+def _iterate_file_infos(method):
+    from .client import FileInfo
+
+    @functools.wraps(method)
+    def wrapper(self, file_pattern: str, *args, **kwargs):
+        packed_namespace = namespace(self._storage, file_pattern)
+        if not packed_namespace:
+            yield from method(self, file_pattern, *args, **kwargs)
+            return
+        for path, size in packed_namespace.iterate(file_pattern):
+            yield FileInfo(name=path, size=size)
+    return wrapper
+
+
+def _read_file(method):
+    @functools.wraps(method)
+    def wrapper(self, path: str, *args, **kwargs):
+        packed_namespace = namespace(self._storage, path)
+        if not packed_namespace:
+            return method(self, path, *args, **kwargs)
+        return packed_namespace.read_range(path)
+    return wrapper
+
+
+def _read_range(method):
+    @functools.wraps(method)
+    def wrapper(self, path: str, start: int, length: int, *args, **kwargs):
+        packed_namespace = namespace(self._storage, path)
+        if not packed_namespace:
+            return method(self, path, start, length, *args, **kwargs)
+        return packed_namespace.read_range(path, start, length)
+    return wrapper
+
+
+def _file_size(method):
+    @functools.wraps(method)
+    def wrapper(self, path: str, *args, **kwargs):
+        packed_namespace = namespace(self._storage, path)
+        if not packed_namespace:
+            return method(self, path, *args, **kwargs)
+        entry = packed_namespace.lookup(path)
+        if entry is None:
+            raise FileNotFoundError(f'File "{path}" does not exist in packed namespace "{packed_namespace.directory}"')
+        return entry[2]
+    return wrapper
+
+
+_WRAPPERS = {'iterate_files': _iterate_files, 'iterate_file_infos': _iterate_file_infos,
+             'read_file': _read_file, 'read_range': _read_range, 'file_size': _file_size}
+
+
+def instrument(cls: type, operations: t.List[str]):
+    """Makes the methods `operations` defined in class `cls` resolve paths in packed namespaces"""
+    for name in operations:
+        method = cls.__dict__.get(name)
+        if method and callable(method) and not getattr(method, '__packed__', False):
+            wrapper = _WRAPPERS[name](method)
+            wrapper.__packed__ = True
+            setattr(cls, name, wrapper)
+
+
+def packed_file_exists(function):
+    """Decorator for `file_exists` functions, looking up files in packed namespaces in the indexes"""
+    @functools.wraps(function)
+    def wrapper(storage: storages.Storage, file_name: str) -> bool:
+        packed_namespace = namespace(storage, file_name)
+        if not packed_namespace:
+            return function(storage, file_name)
+        return packed_namespace.lookup(file_name) is not None
+    return wrapper
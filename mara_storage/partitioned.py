@@ -0,0 +1,236 @@
+"""
+Writing Hive-style partitioned datasets
+
+Records are written to one file per partition, e.g.
+`events/dt=2026-10-17/part-0001-20261017T101500-1f0c9a3b.csv.gz`.
+Only a bounded number of partition files is open at the same time: when a record for
+another partition arrives, the least recently used file is closed and reopened later
+(a gzip file then gets another gzip member, which all gzip readers understand). Files
+are rolled at a size threshold and uploaded in background workers, see
+`write_behind.WriteBehindWriter`. The file names contain the id of the run, so that
+another run adds files to a partition instead of overwriting them.
+
+Example:
+    with PartitionedWriter('data', partition_key=lambda row: {'dt': row[0][:10]},
+                           directory='events', serialize=lambda row: (','.join(row) + '\\n').encode()) as writer:
+        writer.write_records(rows)
+"""
+
+import collections
+import datetime
+import gzip
+import logging
+import os
+import tempfile
+import typing as t
+import urllib.parse
+import uuid
+
+from mara_storage import storages
+from mara_storage.compression import Compression, file_extension
+from mara_storage.write_behind import WriteBehindWriter
+
+
+class _Part:
+    """The file of a partition currently written"""
+    __slots__ = ('partition', 'number', 'spool_path', 'file', 'stream', 'size')
+
+    def __init__(self, partition: str, number: int, spool_path: str):
+        self.partition = partition
+        self.number = number
+        self.spool_path = spool_path
+        self.file = None  # the spool file while open
+        self.stream = None  # the (compressing) stream writing to `file`
+        self.size = 0  # the size of the spool file
+
+
+class PartitionedWriter:
+    def __init__(self, storage: t.Union[str, storages.Storage],
+                 partition_key: t.Callable[[t.Any], t.Union[str, t.Dict[str, t.Any], t.Sequence[t.Tuple[str, t.Any]]]],
+                 directory: str = '', file_name_template: str = 'part-{part:04}-{run}.csv',
+                 run_id: str = None,
+                 compression: Compression = Compression.GZIP, compression_level: int = 6,
+                 serialize: t.Callable[[t.Any], bytes] = None, max_open_files: int = 100,
+                 max_file_bytes: int = 128 * 1024 ** 2, max_workers: int = 4, spool_directory: str = None,
+                 max_spool_bytes: int = 1024 ** 3):
+        """
+        Writes records to partitioned files on a storage
+
+        Not thread-safe: records must be written from one thread. When the `with` block raises
+        an exception, the unfinished parts are discarded.
+
+        Args:
+            storage: the storage alias or configuration
+            partition_key: returns the partition of a record, either as path (e.g. `'dt=2026-10-17'`)
+                           or as dict or sequence of `(name, value)` pairs, e.g. `{'dt': '2026-10-17'}`
+            directory: the directory of the dataset within the storage
+            file_name_template: the file name of the parts, `{part}` is replaced by the part number
+                                within the partition and `{run}` by `run_id`. The extension of the
+                                compression is appended. Without `{run}`, a later run overwrites
+                                the parts of an earlier one.
+            run_id: the id of the run in the file names, by default the start time and a random suffix
+            compression: NONE or GZIP
+            compression_level: the gzip compression level
+            serialize: converts a record to bytes, by default records must be bytes or str
+            max_open_files: the maximum number of partition files open at the same time
+            max_file_bytes: a part is finished and uploaded when its (compressed) size exceeds this size
+            max_workers: the number of parts uploaded at the same time
+            spool_directory: the local directory for parts, see `WriteBehindWriter`
+            max_spool_bytes: writing waits while finished parts of more bytes wait for upload
+        """
+        if compression not in [Compression.NONE, Compression.GZIP]:
+            raise ValueError('Only compression NONE and GZIP is supported for partitioned writing')
+
+        self.partition_key = partition_key
+        self.directory = directory.strip('/')
+        self.file_name_template = file_name_template
+        self.run_id = run_id or (datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S')
+                                 + '-' + uuid.uuid4().hex[:8])
+        self.compression = compression
+        self.compression_level = compression_level
+        self.serialize = serialize or _serialize
+        self.max_open_files = max_open_files
+        self.max_file_bytes = max_file_bytes
+
+        self._writer = WriteBehindWriter(storage, spool_directory=spool_directory, max_workers=max_workers,
+                                         max_spool_bytes=max_spool_bytes)
+        # partition -> the part currently written
+        self._parts: t.Dict[str, _Part] = {}
+        # the parts with an open file, least recently used first
+        self._open_parts: t.Dict[str, _Part] = collections.OrderedDict()
+        # partition -> the number of the last part
+        self._part_numbers: t.Dict[str, int] = {}
+        self._closed = False
+
+    @property
+    def storage(self) -> storages.Storage:
+        return self._writer.storage
+
+    def write(self, record: t.Any):
+        """Writes a record to its partition"""
+        self.write_chunk(self.partition_key(record), self.serialize(record))
+
+    def write_records(self, records: t.Iterable[t.Any]):
+        """Writes records to their partitions"""
+        for record in records:
+            self.write(record)
+
+    def write_chunk(self, partition: t.Union[str, t.Dict[str, t.Any], t.Sequence[t.Tuple[str, t.Any]]], data: bytes):
+        """
+        Writes bytes to a partition
+
+        Args:
+            partition: the partition, as returned by `partition_key`
+            data: the bytes, e.g. several serialized records
+        """
+        if self._closed:
+            raise ValueError('The writer is closed')
+        part = self._open(partition_path(partition))
+        part.stream.write(data)
+        part.size = part.file.tell()
+        if part.size >= self.max_file_bytes:
+            self._finish(part)
+
+    def close(self):
+        """Finishes all parts and waits until they are uploaded"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            for part in list(self._parts.values()):
+                self._finish(part)
+        finally:
+            self._writer.close()
+
+    def __enter__(self) -> 'PartitionedWriter':
+        return self
+
+    def discard(self):
+        """Discards the unfinished parts, finished parts are still uploaded"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            for part in list(self._parts.values()):
+                if part.file:
+                    self._close_file(part)
+                os.remove(part.spool_path)
+            self._parts.clear()
+            self._open_parts.clear()
+        finally:
+            self._writer.close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # the partitions are incomplete, the uploads must not hide the original exception
+            try:
+                self.discard()
+            except Exception:
+                logging.getLogger(__name__).exception('Upload failed')
+
+    def _open(self, partition: str) -> _Part:
+        part = self._parts.get(partition)
+        if part and part.file:
+            self._open_parts.move_to_end(partition)
+            return part
+
+        while len(self._open_parts) >= self.max_open_files:
+            _, least_recently_used = self._open_parts.popitem(last=False)
+            self._close_file(least_recently_used)
+
+        if not part:
+            number = self._part_numbers.get(partition, 0) + 1
+            self._part_numbers[partition] = number
+            file_descriptor, spool_path = tempfile.mkstemp(dir=self._writer.spool_directory, suffix='.part')
+            os.close(file_descriptor)
+            part = _Part(partition, number, spool_path)
+            self._parts[partition] = part
+
+        part.file = open(part.spool_path, 'ab')
+        part.stream = (gzip.GzipFile(fileobj=part.file, mode='wb', compresslevel=self.compression_level)
+                       if self.compression == Compression.GZIP else part.file)
+        self._open_parts[partition] = part
+        return part
+
+    def _close_file(self, part: _Part):
+        if part.stream is not part.file:
+            part.stream.close()
+        part.file.close()
+        part.file, part.stream = None, None
+        part.size = os.path.getsize(part.spool_path)
+
+    def _finish(self, part: _Part):
+        """Closes a part and queues it for upload"""
+        if part.file:
+            self._close_file(part)
+            del self._open_parts[part.partition]
+        del self._parts[part.partition]
+
+        extension = file_extension(self.compression)
+        file_name = (self.file_name_template.format(part=part.number, run=self.run_id)
+                     + (f'.{extension}' if extension else ''))
+        path = '/'.join(segment for segment in [self.directory, part.partition, file_name] if segment)
+        self._writer.add_file(part.spool_path, path)
+
+
+def partition_path(partition: t.Union[str, t.Dict[str, t.Any], t.Sequence[t.Tuple[str, t.Any]]]) -> str:
+    """
+    Returns the path of a partition, e.g. `'year=2026/month=10'` for `{'year': 2026, 'month': 10}`
+
+    Values are escaped, so that they contain no `/`.
+    """
+    if isinstance(partition, str):
+        return partition.strip('/')
+    if isinstance(partition, dict):
+        partition = partition.items()
+    return '/'.join(f'{name}={urllib.parse.quote(str(value), safe=" :")}' for name, value in partition)
+
+
+def _serialize(record: t.Union[bytes, str]) -> bytes:
+    if isinstance(record, bytes):
+        return record
+    if isinstance(record, str):
+        return record.encode()
+    raise TypeError(f'Please pass `serialize` to write records of type "{record.__class__.__name__}"')
@@ -0,0 +1,232 @@
+"""
+Reading records in parallel
+
+`read_records` reads many files: files are downloaded ahead by threads (see
+`StorageClient.iterate_contents`), uncompressed and parsed by a pool of processes, so
+that decompression and parsing use all cores. The records are yielded in batches of a
+fixed size, in the order of the listing.
+
+Example:
+    for batch in read_records('data', 'events/2026-10-*/*.jsonl.gz', Compression.GZIP, format='jsonl'):
+        load(batch)
+
+`plan_splits` cuts one large uncompressed file into byte ranges starting at line
+boundaries, which can be processed by several workers with `read_split`.
+
+Example:
+    splits = plan_splits('data', 'exports/huge.csv', target_size=256 * 1024 ** 2, skip_header=True)
+    # in each worker
+    for chunk in read_split('data', splits[i]):
+        ...
+"""
+
+import collections
+import concurrent.futures
+import csv
+import io
+import json
+import os
+import typing as t
+
+from mara_storage import storages
+from mara_storage.client import StorageClient
+from mara_storage.compression import Compression, decompress
+
+
+FORMATS = ['lines', 'csv', 'jsonl']
+BATCH_FORMATS = ['list', 'numpy', 'arrow']
+
+
+def read_records(storage: t.Union[str, storages.Storage], file_pattern: str,
+                 compression: Compression = Compression.NONE, format: str = 'lines', workers: int = None,
+                 batch_size: int = 10000, batch_format: str = 'list', skip_header: bool = False,
+                 csv_options: t.Dict[str, t.Any] = None, prefetch: int = None) -> t.Iterator[t.Any]:
+    """
+    Reads the records of all files matching a pattern
+
+    Args:
+        storage: the storage alias or configuration
+        file_pattern: the file pattern, e.g. `'events/*.csv.gz'`
+        compression: the compression of the files
+        format: how files are parsed into records:
+                `'lines'`: a str per line, without line break,
+                `'csv'`: a list of str per row,
+                `'jsonl'`: the parsed JSON of each non-empty line
+        workers: the number of parsing processes, by default the number of CPUs. With 0,
+                 files are parsed in the current process.
+        batch_size: the number of records per batch. The last batch can be smaller.
+        batch_format: `'list'` for a list of records, `'numpy'` for a NumPy array (requires
+                      `numpy`), `'arrow'` for a `pyarrow.Array`, or a `pyarrow.Table` for
+                      format `'jsonl'` (requires `pyarrow`)
+        skip_header: if True, the first line (resp. row) of each file is skipped
+        csv_options: keyword arguments for `csv.reader`, e.g. `{'delimiter': '\\t'}`
+        prefetch: the number of files downloaded and parsed ahead, by default twice the workers
+
+    Returns:
+        An iterator over batches of records
+    """
+    if format not in FORMATS:
+        raise ValueError(f'Unsupported format "{format}", please use one of {", ".join(FORMATS)}')
+    if batch_format not in BATCH_FORMATS:
+        raise ValueError(f'Unsupported batch format "{batch_format}", please use one of {", ".join(BATCH_FORMATS)}')
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    prefetch = prefetch or 2 * max(workers, 1)
+    parse_arguments = (compression, format, skip_header, csv_options or {})
+
+    contents = StorageClient(storage).iterate_contents(file_pattern, prefetch=prefetch)
+    if workers:
+        records = _parse_in_processes(contents, parse_arguments, workers, prefetch)
+    else:
+        records = (parse(content, *parse_arguments) for _, content in contents)
+
+    batch = []
+    for file_records in records:
+        start = 0
+        while start < len(file_records):
+            needed = batch_size - len(batch)
+            batch.extend(file_records[start:start + needed])
+            start += needed
+            if len(batch) == batch_size:
+                yield _convert(batch, format, batch_format)
+                batch = []
+    if batch:
+        yield _convert(batch, format, batch_format)
+
+
+def parse(content: bytes, compression: Compression, format: str, skip_header: bool = False,
+          csv_options: t.Dict[str, t.Any] = None) -> t.List[t.Any]:
+    """
+    Uncompresses and parses the content of a file into records, see `read_records`
+
+    Returns:
+        The records of the file
+    """
+    text = decompress(compression, content).decode()
+    if format == 'csv':
+        rows = list(csv.reader(io.StringIO(text, newline=''), **(csv_options or {})))
+        return rows[1:] if skip_header else rows
+
+    # unlike `str.splitlines`, only line feeds end a line
+    lines = text.replace('\r\n', '\n').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    if skip_header:
+        lines = lines[1:]
+    if format == 'jsonl':
+        return [json.loads(line) for line in lines if line.strip()]
+    return lines
+
+
+class Split(t.NamedTuple):
+    """A byte range of a file, starting at the beginning of a line"""
+    path: str
+    start: int
+    end: int  # exclusive
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+
+def plan_splits(storage: t.Union[str, storages.Storage], path: str, target_size: int = 128 * 1024 ** 2,
+                skip_header: bool = False, probe_size: int = 64 * 1024) -> t.List[Split]:
+    """
+    Divides an uncompressed file into byte ranges of about `target_size` bytes, each
+    starting at the beginning of a line
+
+    The line boundaries are found with small ranged reads around the nominal split
+    positions. Records containing line breaks, e.g. quoted fields in CSV files, can
+    not be split correctly.
+
+    Args:
+        storage: the storage alias or configuration
+        path: the file path within the storage
+        target_size: the nominal size of a split
+        skip_header: if True, the first line is not part of any split
+        probe_size: the number of bytes read per probe
+
+    Returns:
+        The splits, covering the file (after the header) without gaps
+    """
+    from . import execution
+
+    client = StorageClient(storage)
+    size = client.file_size(path)
+
+    def line_start(position: int) -> int:
+        """Returns the position of the first line starting at or after `position`"""
+        # a line starts at `position` when the byte before is a line feed
+        offset = position - 1
+        while offset < size:
+            probe = client.read_range(path, offset, probe_size)
+            index = probe.find(b'\n')
+            if index >= 0:
+                return offset + index + 1
+            if len(probe) < probe_size:
+                break
+            offset += len(probe)
+        return size
+
+    start = line_start(1) if skip_header else 0
+    positions = range(start + target_size, size, target_size)
+    boundaries = [start] + list(execution.map_concurrently(client._storage, line_start, positions)) + [size]
+
+    splits = []
+    for split_start, split_end in zip(boundaries, boundaries[1:]):
+        # a line longer than `target_size` spans several nominal positions
+        if split_end > split_start:
+            splits.append(Split(path, split_start, split_end))
+    return splits
+
+
+def read_split(storage: t.Union[str, storages.Storage], split: Split, chunk_size: int = 8 * 1024 ** 2) -> t.Iterator[bytes]:
+    """
+    Reads a split with ranged reads
+
+    Args:
+        storage: the storage alias or configuration
+        split: the split, see `plan_splits`
+        chunk_size: the number of bytes read per request
+
+    Returns:
+        An iterator over the chunks of the split, which do not end at line boundaries
+    """
+    client = StorageClient(storage)
+    for offset in range(split.start, split.end, chunk_size):
+        yield client.read_range(split.path, offset, min(chunk_size, split.end - offset))
+
+
+def _parse_in_processes(contents: t.Iterator[t.Tuple[str, bytes]], parse_arguments: tuple, workers: int,
+                        prefetch: int) -> t.Iterator[t.List[t.Any]]:
+    """Parses the contents in a process pool, yields the records of each file in order"""
+    queue = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for _, content in contents:
+                queue.append(executor.submit(parse, content, *parse_arguments))
+                if len(queue) >= prefetch:
+                    yield queue.popleft().result()
+            while queue:
+                yield queue.popleft().result()
+        finally:
+            for future in queue:
+                future.cancel()
+
+
+def _convert(batch: t.List[t.Any], format: str, batch_format: str) -> t.Any:
+    if batch_format == 'numpy':
+        import numpy
+        if format == 'csv':
+            # rows of the same length become a 2-dimensional array
+            return numpy.array(batch, dtype=object)
+        array = numpy.empty(len(batch), dtype=object)
+        array[:] = batch
+        return array
+    elif batch_format == 'arrow':
+        import pyarrow
+        if format == 'jsonl' and all(isinstance(record, dict) for record in batch):
+            return pyarrow.Table.from_pylist(batch)
+        return pyarrow.array(batch)
+    return batch
@@ -0,0 +1,289 @@
+"""
+Scheduling of storage operations within I/O budgets
+
+Storages of partners or shared cloud accounts allow only so many connections and so much
+bandwidth. An `IoBudget` caps the number of concurrent operations and the bytes per second
+on a storage alias, see `config.io_budget`. All operations executed via module `execution`
+(the `StorageClient` operations) run within the budget of their storage; other transfers,
+e.g. shell commands, can be scheduled with `scheduled`.
+
+With a `lock_directory`, the budget is shared by all processes using the same directory,
+e.g. the forked workers of a run: concurrency slots are lock files and the bandwidth is a
+token bucket in a locked file.
+
+Operations have a priority: while operations of a higher priority wait, operations of a
+lower priority are not started, and `LOW` priority operations use only a share of the
+budget.
+
+Example:
+    mara_storage.config.io_budget = lambda alias: scheduling.IoBudget(
+        max_concurrency=8, max_bytes_per_second=50 * 1024 ** 2, lock_directory='/tmp/mara-io') \\
+        if alias == 'partner-sftp' else None
+
+    with scheduling.priority(scheduling.LOW):
+        backfill()
+"""
+
+import contextlib
+import functools
+import os
+import struct
+import threading
+import time
+import typing as t
+import weakref
+
+from mara_storage import storages
+
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+_state = threading.local()
+
+
+def current_priority() -> int:
+    """Returns the priority of the operations of the current thread, `NORMAL` by default"""
+    return getattr(_state, 'priority', NORMAL)
+
+
+@contextlib.contextmanager
+def priority(priority: int):
+    """
+    Sets the priority of the operations of the current thread within the context
+
+    Args:
+        priority: `HIGH`, `NORMAL` or `LOW`
+    """
+    if priority not in (HIGH, NORMAL, LOW):
+        raise ValueError(f'Unsupported priority {priority}, please use HIGH, NORMAL or LOW')
+    outer_priority = current_priority()
+    _state.priority = priority
+    try:
+        yield
+    finally:
+        _state.priority = outer_priority
+
+
+def bind(function: t.Callable) -> t.Callable:
+    """Returns a function calling `function` with the priority of the current thread, for running it in another thread"""
+    bound_priority = current_priority()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with priority(bound_priority):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+_NO_SLOT = -1
+
+
+class IoBudget:
+    def __init__(self, max_concurrency: int = None, max_bytes_per_second: float = None, burst_bytes: int = None,
+                 low_priority_share: float = 0.5, lock_directory: str = None, name: str = None,
+                 poll_interval: float = 0.05):
+        """
+        The number of concurrent operations and bytes per second allowed on a storage
+
+        The bandwidth is a token bucket: transferred bytes are charged after each operation,
+        and operations only start while the bucket is not in debt. `LOW` priority operations
+        only start while the bucket is at least `1 - low_priority_share` full.
+
+        Args:
+            max_concurrency: the maximum number of concurrent operations, None for no limit
+            max_bytes_per_second: the maximum bandwidth, None for no limit
+            burst_bytes: the capacity of the token bucket, by default one second of bandwidth
+            low_priority_share: the share of the concurrency and bandwidth available to `LOW` priority operations
+            lock_directory: when set, the budget is shared with all processes using the same
+                            directory and name
+            name: the name of the lock files, by default the storage alias
+            poll_interval: the interval in seconds in which waiting operations check for slots
+                           released by other processes
+        """
+        self.max_concurrency = max_concurrency
+        self.max_bytes_per_second = max_bytes_per_second
+        self.burst_bytes = burst_bytes or max_bytes_per_second or 0
+        self.low_priority_share = low_priority_share
+        self.lock_directory = lock_directory
+        self.name = name
+        self.poll_interval = poll_interval
+
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = [0, 0, 0]  # per priority
+        self._bucket_lock = threading.Lock()
+        self._tokens = float(self.burst_bytes)
+        self._timestamp = time.time()
+
+    @property
+    def in_flight(self) -> int:
+        """The current number of running operations of this process"""
+        return self._in_flight
+
+    def acquire(self, priority: int = None) -> t.Optional[int]:
+        """
+        Waits until an operation may start. Returns a token to pass to `release`.
+
+        Args:
+            priority: the priority of the operation, by default the priority of the current thread
+        """
+        priority = current_priority() if priority is None else priority
+        self._wait_for_bandwidth(priority)
+        if not self.max_concurrency:
+            return None
+
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    if not any(self._waiting[:priority]) and self._in_flight < self._slots(priority):
+                        slot = self._lock_slot(priority) if self.lock_directory else _NO_SLOT
+                        if slot is not None:
+                            self._in_flight += 1
+                            return slot
+                        # all slots are held by other processes
+                        self._condition.wait(self.poll_interval)
+                    else:
+                        self._condition.wait(self.poll_interval if self.lock_directory else None)
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+    def release(self, token: t.Optional[int]):
+        """
+        Marks an operation as finished
+
+        Args:
+            token: the token returned by `acquire`
+        """
+        if token is None:
+            return
+        if token != _NO_SLOT:
+            os.close(token)  # releases the lock
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def consume(self, bytes: int):
+        """Charges transferred bytes against the bandwidth"""
+        if self.max_bytes_per_second and bytes:
+            self._update_bucket(bytes)
+
+    def _slots(self, priority: int) -> int:
+        if priority == LOW:
+            return max(int(self.max_concurrency * self.low_priority_share), 1)
+        return self.max_concurrency
+
+    def _lock_slot(self, priority: int) -> t.Optional[int]:
+        """Locks a free slot file, returns its file descriptor or None when all slots are held"""
+        import fcntl
+
+        slots = range(self._slots(priority))
+        # `LOW` priority uses the first slots, others prefer the last ones
+        for slot in (slots if priority == LOW else reversed(slots)):
+            file_descriptor = os.open(self._lock_file(f'slot-{slot}'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return file_descriptor
+            except BlockingIOError:
+                os.close(file_descriptor)
+        return None
+
+    def _wait_for_bandwidth(self, priority: int):
+        if not self.max_bytes_per_second:
+            return
+        reserve = self.burst_bytes * (1 - self.low_priority_share) if priority == LOW else 0
+        while True:
+            tokens = self._update_bucket(0)
+            if tokens >= reserve:
+                return
+            time.sleep(min((reserve - tokens) / self.max_bytes_per_second, 1.0) + 0.001)
+
+    def _update_bucket(self, consumed: int) -> float:
+        """Refills the token bucket, takes `consumed` tokens and returns the remaining tokens"""
+        with self._bucket_lock:
+            if not self.lock_directory:
+                self._tokens, self._timestamp = self._refill(self._tokens, self._timestamp, consumed)
+                return self._tokens
+
+            import fcntl
+            file_descriptor = os.open(self._lock_file('bucket'), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+                state = os.pread(file_descriptor, 16, 0)
+                tokens, timestamp = struct.unpack('<dd', state) if len(state) == 16 else (self.burst_bytes, time.time())
+                tokens, timestamp = self._refill(tokens, timestamp, consumed)
+                os.pwrite(file_descriptor, struct.pack('<dd', tokens, timestamp), 0)
+                return tokens
+            finally:
+                os.close(file_descriptor)
+
+    def _refill(self, tokens: float, timestamp: float, consumed: int) -> t.Tuple[float, float]:
+        now = time.time()
+        tokens = min(tokens + max(now - timestamp, 0) * self.max_bytes_per_second, float(self.burst_bytes))
+        return tokens - consumed, now
+
+    def _lock_file(self, suffix: str) -> str:
+        os.makedirs(self.lock_directory, exist_ok=True)
+        return os.path.join(self.lock_directory, f'{self.name or "default"}.{suffix}')
+
+    def __repr__(self) -> str:
+        return (f'<{self.__class__.__name__}: max_concurrency={self.max_concurrency}, '
+                f'max_bytes_per_second={self.max_bytes_per_second}, in_flight={self.in_flight}>')
+
+
+_budgets: t.Dict[str, t.Optional[IoBudget]] = {}
+# budgets of storages not taken from the config by alias
+_storage_budgets = weakref.WeakKeyDictionary()
+_budgets_lock = threading.Lock()
+
+
+def budget(storage: storages.Storage) -> t.Optional[IoBudget]:
+    """Returns the I/O budget of a storage, if any. Storages taken from the config share one budget per alias."""
+    from . import config
+
+    alias = storages.alias(storage)
+    with _budgets_lock:
+        budgets, key = (_budgets, alias) if alias else (_storage_budgets, storage)
+        if key not in budgets:
+            storage_budget = config.io_budget(alias)
+            if storage_budget and not storage_budget.name:
+                storage_budget.name = alias
+            budgets[key] = storage_budget
+        return budgets[key]
+
+
+class Transfer:
+    """A transfer running within the budget of a storage"""
+    def __init__(self, budget: t.Optional[IoBudget]):
+        self.budget = budget
+
+    def add_bytes(self, bytes: int):
+        """Charges transferred bytes against the bandwidth of the storage"""
+        if self.budget:
+            self.budget.consume(bytes)
+
+
+@contextlib.contextmanager
+def scheduled(storage: storages.Storage, priority: int = None) -> t.Iterator[Transfer]:
+    """
+    Runs a transfer done outside of this package within the budget of a storage
+
+    Example:
+        with scheduling.scheduled(storage) as transfer:
+            output = subprocess.check_output(shell.read_file_command(storage, file_name))
+            transfer.add_bytes(len(output))
+
+    Args:
+        storage: the storage configuration
+        priority: the priority of the transfer, by default the priority of the current thread
+    """
+    storage_budget = budget(storage)
+    token = storage_budget.acquire(priority) if storage_budget else None
+    try:
+        yield Transfer(storage_budget)
+    finally:
+        if storage_budget:
+            storage_budget.release(token)
@@ -0,0 +1,425 @@
+"""
+Seekable compressed files
+
+A gzip file written with `Compression.GZIP` can only be uncompressed from its start. The
+seekable formats consist of independently compressed blocks and an index of the block
+offsets, so that any range of the uncompressed content costs one ranged read, and a file
+can be divided between workers at block boundaries:
+
+- `'bgzf'`: blocked gzip as written by `bgzip`, a sequence of gzip members of at most
+  64 KB each. Readable by plain `gunzip` and `Compression.GZIP`. The index is written to a
+  sidecar file `<path>.gzi` in the format of `bgzip --index`.
+- `'zstd'`: the zstd seekable format, a sequence of zstd frames followed by a seek table
+  in a skippable frame. Readable by plain `zstd -d`. Requires the package `zstandard`.
+
+Example:
+    with open_writer('data', 'exports/huge.csv.gz') as f:
+        for rows in extract():
+            f.write(rows)
+
+    read_uncompressed('data', 'exports/huge.csv.gz', start=10 ** 9, length=1024 ** 2)
+
+    splits = plan_block_splits('data', 'exports/huge.csv.gz', target_size=256 * 1024 ** 2)
+    # in each worker
+    for chunk in read_block_split('data', splits[i]):
+        ...
+"""
+
+import bisect
+import contextlib
+import os
+import struct
+import tempfile
+import typing as t
+import zlib
+
+from mara_storage import storages
+
+
+BGZF = 'bgzf'
+ZSTD = 'zstd'
+FORMATS = [BGZF, ZSTD]
+
+BGZF_INDEX_SUFFIX = '.gzi'
+
+# the maximum uncompressed size of a BGZF block, so that the compressed block fits into 64 KB
+BGZF_MAX_BLOCK_SIZE = 0xff00
+# the empty block at the end of BGZF files
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+_BGZF_HEADER = struct.Struct('<4BI2BH2BHH')
+_ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+_ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+_ZSTD_FOOTER = struct.Struct('<IBI')
+
+
+class Block(t.NamedTuple):
+    """An independently compressed block of a seekable file"""
+    compressed_offset: int
+    compressed_size: int
+    uncompressed_offset: int
+    uncompressed_size: int
+
+
+class BlockSplit(t.NamedTuple):
+    """A range of consecutive blocks of a seekable file"""
+    path: str
+    format: str
+    compressed_start: int
+    compressed_end: int  # exclusive
+    uncompressed_start: int
+    uncompressed_end: int  # exclusive
+
+    @property
+    def size(self) -> int:
+        return self.compressed_end - self.compressed_start
+
+
+def format_of(path: str) -> str:
+    """Returns the seekable format of a file from its extension: `'zstd'` for `.zst`, `'bgzf'` otherwise"""
+    return ZSTD if path.endswith('.zst') else BGZF
+
+
+class _BlockWriter:
+    def __init__(self, fileobj: t.BinaryIO, block_size: int):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        self.blocks: t.List[Block] = []
+        self._buffer = bytearray()
+        self._compressed_offset = 0
+        self._uncompressed_offset = 0
+        self._closed = False
+
+    def write(self, data: bytes) -> int:
+        """Compresses data, a block is written whenever `block_size` bytes are buffered"""
+        if self._closed:
+            raise ValueError('The writer is closed')
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._write_block(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        """Writes the buffered data and the end of the file. Does not close `fileobj`."""
+        if self._closed:
+            return
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._write_end()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_block(self, data: bytes):
+        compressed = self._compress(data)
+        self.fileobj.write(compressed)
+        self.blocks.append(Block(self._compressed_offset, len(compressed), self._uncompressed_offset, len(data)))
+        self._compressed_offset += len(compressed)
+        self._uncompressed_offset += len(data)
+
+    def _compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def _write_end(self):
+        raise NotImplementedError
+
+
+class BgzfWriter(_BlockWriter):
+    def __init__(self, fileobj: t.BinaryIO, block_size: int = BGZF_MAX_BLOCK_SIZE, level: int = 6):
+        """
+        Writes blocked gzip (BGZF) to a binary file object
+
+        Args:
+            fileobj: the file object to write to
+            block_size: the uncompressed size of a block, at most `BGZF_MAX_BLOCK_SIZE`
+            level: the gzip compression level
+        """
+        if not 0 < block_size <= BGZF_MAX_BLOCK_SIZE:
+            raise ValueError(f'The block size of BGZF must be between 1 and {BGZF_MAX_BLOCK_SIZE}')
+        super().__init__(fileobj, block_size)
+        self.level = level
+
+    def index(self) -> bytes:
+        """Returns the block index in the format of `bgzip --index`, available after `close`"""
+        return encode_bgzf_index(self.blocks)
+
+    def _compress(self, data: bytes) -> bytes:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(data) + compressor.flush()
+        # header with the extra field `BC` holding the block size - 1, deflated data, CRC32 and size
+        return (_BGZF_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2,
+                                  _BGZF_HEADER.size + len(deflated) + 8 - 1)
+                + deflated + struct.pack('<II', zlib.crc32(data), len(data)))
+
+    def _write_end(self):
+        self.fileobj.write(BGZF_EOF)
+
+
+class ZstdWriter(_BlockWriter):
+    def __init__(self, fileobj: t.BinaryIO, block_size: int = 1024 ** 2, level: int = 3):
+        """
+        Writes the zstd seekable format to a binary file object. Requires `zstandard`.
+
+        Args:
+            fileobj: the file object to write to
+            block_size: the uncompressed size of a frame
+            level: the zstd compression level
+        """
+        import zstandard
+
+        super().__init__(fileobj, block_size)
+        self._compressor = zstandard.ZstdCompressor(level=level, write_content_size=True)
+
+    def _compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def _write_end(self):
+        # the seek table: one entry per frame, a footer and the skippable frame header around it
+        table = b''.join(struct.pack('<II', block.compressed_size, block.uncompressed_size) for block in self.blocks)
+        table += _ZSTD_FOOTER.pack(len(self.blocks), 0, _ZSTD_SEEKABLE_MAGIC)
+        self.fileobj.write(struct.pack('<II', _ZSTD_SKIPPABLE_MAGIC, len(table)) + table)
+
+
+def encode_bgzf_index(blocks: t.List[Block]) -> bytes:
+    """Encodes the offsets of the blocks after the first in the format of `bgzip --index`"""
+    return struct.pack('<Q', max(len(blocks) - 1, 0)) + b''.join(
+        struct.pack('<QQ', block.compressed_offset, block.uncompressed_offset) for block in blocks[1:])
+
+
+def decode_bgzf_index(index: bytes) -> t.List[t.Tuple[int, int]]:
+    """Returns the (compressed offset, uncompressed offset) of all blocks from a `.gzi` index"""
+    count, = struct.unpack_from('<Q', index)
+    return [(0, 0)] + [struct.unpack_from('<QQ', index, 8 + 16 * i) for i in range(count)]
+
+
+@contextlib.contextmanager
+def open_writer(storage: t.Union[str, storages.Storage], path: str, format: str = None, block_size: int = None,
+                level: int = None, spool_directory: str = None) -> t.Iterator[_BlockWriter]:
+    """
+    Writes a seekable file to a storage
+
+    The file is compressed into a local spool file and uploaded with
+    `StorageClient.upload_file` when the context exits without exception. For BGZF, the
+    index is uploaded afterwards to `<path>.gzi`.
+
+    Args:
+        storage: the storage alias or configuration
+        path: the file path within the storage
+        format: `'bgzf'` or `'zstd'`, by default derived from the extension of `path`
+        block_size: the uncompressed size of a block, by default the maximum of BGZF, resp. 1 MB
+        level: the compression level, by default 6 for BGZF, resp. 3 for zstd
+        spool_directory: the local directory for the spool file, by default the temporary directory
+
+    Returns:
+        A context manager yielding a writer with a `write(data: bytes)` method
+    """
+    from .client import StorageClient
+
+    format = format or format_of(path)
+    if format not in FORMATS:
+        raise ValueError(f'Unsupported format "{format}", please use one of {", ".join(FORMATS)}')
+    options = {key: value for key, value in [('block_size', block_size), ('level', level)] if value is not None}
+
+    client = StorageClient(storage)
+    file_descriptor, spool_path = tempfile.mkstemp(dir=spool_directory, suffix='-' + os.path.basename(path))
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            writer = BgzfWriter(f, **options) if format == BGZF else ZstdWriter(f, **options)
+            yield writer
+            writer.close()
+        client.upload_file(spool_path, path)
+        if format == BGZF:
+            client.write_file(path + BGZF_INDEX_SUFFIX, writer.index())
+    finally:
+        os.unlink(spool_path)
+
+
+def read_blocks(storage: t.Union[str, storages.Storage], path: str, format: str = None) -> t.List[Block]:
+    """
+    Reads the block index of a seekable file
+
+    For BGZF, the `.gzi` sidecar is used when it exists, otherwise the block headers of the
+    whole file are scanned. For zstd, the seek table at the end of the file is read.
+
+    Args:
+        storage: the storage alias or configuration
+        path: the file path within the storage
+        format: `'bgzf'` or `'zstd'`, by default derived from the extension of `path`
+
+    Returns:
+        The blocks of the file holding data, in file order
+    """
+    from . import info
+    from .client import StorageClient
+
+    client = StorageClient(storage)
+    format = format or format_of(path)
+    size = client.file_size(path)
+
+    if format == ZSTD:
+        footer = client.read_range(path, size - _ZSTD_FOOTER.size, _ZSTD_FOOTER.size)
+        count, descriptor, magic = _ZSTD_FOOTER.unpack(footer)
+        if magic != _ZSTD_SEEKABLE_MAGIC:
+            raise ValueError(f'"{path}" is not in the zstd seekable format')
+        entry_size = 12 if descriptor & 0x80 else 8  # with checksums
+        table = client.read_range(path, size - _ZSTD_FOOTER.size - count * entry_size, count * entry_size)
+        blocks, compressed_offset, uncompressed_offset = [], 0, 0
+        for i in range(count):
+            compressed_size, uncompressed_size = struct.unpack_from('<II', table, i * entry_size)
+            blocks.append(Block(compressed_offset, compressed_size, uncompressed_offset, uncompressed_size))
+            compressed_offset += compressed_size
+            uncompressed_offset += uncompressed_size
+        return blocks
+
+    if not info.file_exists(client._storage, path + BGZF_INDEX_SUFFIX):
+        return _scan_bgzf_blocks(client, path, size)
+
+    tail = client.read_range(path, max(size - len(BGZF_EOF) - 4, 0), len(BGZF_EOF) + 4)
+    end = size - len(BGZF_EOF) if tail.endswith(BGZF_EOF) else size
+    offsets = [offset for offset in decode_bgzf_index(client.read_file(path + BGZF_INDEX_SUFFIX)) if offset[0] < end]
+    if not offsets or end == 0:
+        return []
+    # the uncompressed size of the last block is the ISIZE field at its end
+    last_size, = struct.unpack('<I', tail[-len(BGZF_EOF) - 4:-len(BGZF_EOF)] if end < size else tail[-4:])
+    ends = offsets[1:] + [(end, offsets[-1][1] + last_size)]
+    return [Block(start[0], stop[0] - start[0], start[1], stop[1] - start[1])
+            for start, stop in zip(offsets, ends) if stop[1] > start[1]]
+
+
+def read_uncompressed(storage: t.Union[str, storages.Storage], path: str, start: int, length: int,
+                      format: str = None, blocks: t.List[Block] = None) -> bytes:
+    """
+    Reads a range of the uncompressed content of a seekable file with one ranged read
+
+    Args:
+        storage: the storage alias or configuration
+        path: the file path within the storage
+        start: the uncompressed offset of the first byte
+        length: the maximum number of bytes
+        format: `'bgzf'` or `'zstd'`, by default derived from the extension of `path`
+        blocks: the blocks of the file, see `read_blocks`. Read from the storage when not given.
+
+    Returns:
+        The uncompressed bytes, shorter than `length` at the end of the file
+    """
+    from .client import StorageClient
+
+    format = format or format_of(path)
+    if blocks is None:
+        blocks = read_blocks(storage, path, format)
+    end = start + length
+    first = max(bisect.bisect_right([block.uncompressed_offset for block in blocks], start) - 1, 0)
+    selected = [block for block in blocks[first:] if block.uncompressed_offset < end]
+    if not selected or length <= 0:
+        return b''
+
+    compressed_start = selected[0].compressed_offset
+    compressed = StorageClient(storage).read_range(
+        path, compressed_start, selected[-1].compressed_offset + selected[-1].compressed_size - compressed_start)
+    data = b''.join(_decompress_blocks([compressed], format))
+    offset = start - selected[0].uncompressed_offset
+    return data[offset:offset + length]
+
+
+def plan_block_splits(storage: t.Union[str, storages.Storage], path: str, target_size: int = 128 * 1024 ** 2,
+                      format: str = None) -> t.List[BlockSplit]:
+    """
+    Divides a seekable file into ranges of whole blocks of about `target_size` compressed bytes
+
+    Args:
+        storage: the storage alias or configuration
+        path: the file path within the storage
+        target_size: the nominal compressed size of a split
+        format: `'bgzf'` or `'zstd'`, by default derived from the extension of `path`
+
+    Returns:
+        The splits, covering all blocks of the file without gaps
+    """
+    format = format or format_of(path)
+    splits, first = [], None
+    for block in read_blocks(storage, path, format):
+        first = first or block
+        if block.compressed_offset + block.compressed_size - first.compressed_offset >= target_size:
+            splits.append(BlockSplit(path, format, first.compressed_offset, block.compressed_offset + block.compressed_size,
+                                     first.uncompressed_offset, block.uncompressed_offset + block.uncompressed_size))
+            first = None
+    if first:
+        splits.append(BlockSplit(path, format, first.compressed_offset, block.compressed_offset + block.compressed_size,
+                                 first.uncompressed_offset, block.uncompressed_offset + block.uncompressed_size))
+    return splits
+
+
+def read_block_split(storage: t.Union[str, storages.Storage], split: BlockSplit,
+                     chunk_size: int = 8 * 1024 ** 2) -> t.Iterator[bytes]:
+    """
+    Reads and uncompresses a split with ranged reads
+
+    Args:
+        storage: the storage alias or configuration
+        split: the split, see `plan_block_splits`
+        chunk_size: the number of compressed bytes read per request
+
+    Returns:
+        An iterator over the uncompressed chunks of the split, which do not end at line boundaries
+    """
+    from .client import StorageClient
+
+    client = StorageClient(storage)
+    chunks = (client.read_range(split.path, offset, min(chunk_size, split.compressed_end - offset))
+              for offset in range(split.compressed_start, split.compressed_end, chunk_size))
+    return _decompress_blocks(chunks, split.format)
+
+
+def _decompress_blocks(chunks: t.Iterable[bytes], format: str) -> t.Iterator[bytes]:
+    """Uncompresses a sequence of complete gzip members, resp. zstd frames, which may span chunks"""
+    if format == ZSTD:
+        import zstandard
+        new_decompressor = zstandard.ZstdDecompressor().decompressobj
+    else:
+        def new_decompressor():
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    decompressor = new_decompressor()
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+            chunk = b''
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = new_decompressor()
+
+
+def _scan_bgzf_blocks(client, path: str, size: int, chunk_size: int = 8 * 1024 ** 2) -> t.List[Block]:
+    """Finds the blocks of a BGZF file without index from the sizes in the block headers"""
+    blocks, uncompressed_offset = [], 0
+    # `buffer` holds the file from `buffer_offset`, the next block starts at `position` within it
+    buffer, buffer_offset, position = b'', 0, 0
+    while buffer_offset + position < size:
+        if len(buffer) - position < _BGZF_HEADER.size:
+            buffer, buffer_offset, position = buffer[position:], buffer_offset + position, 0
+            buffer += client.read_range(path, buffer_offset + len(buffer), chunk_size)
+            if len(buffer) < _BGZF_HEADER.size:
+                raise ValueError(f'"{path}" ends within a BGZF block')
+        header = _BGZF_HEADER.unpack_from(buffer, position)
+        if header[:4] != (0x1f, 0x8b, 8, 4) or header[8:10] != (ord('B'), ord('C')):
+            raise ValueError(f'"{path}" is not in the BGZF format (at offset {buffer_offset + position})')
+        block_size = header[-1] + 1
+        if len(buffer) - position < block_size:
+            buffer, buffer_offset, position = buffer[position:], buffer_offset + position, 0
+            buffer += client.read_range(path, buffer_offset + len(buffer), max(chunk_size, block_size))
+            if len(buffer) < block_size:
+                raise ValueError(f'"{path}" ends within a BGZF block')
+        uncompressed_size, = struct.unpack_from('<I', buffer, position + block_size - 4)
+        if uncompressed_size:
+            blocks.append(Block(buffer_offset + position, block_size, uncompressed_offset, uncompressed_size))
+            uncompressed_offset += uncompressed_size
+        position += block_size
+    return blocks
@@ -1,10 +1,160 @@
+import datetime
+import fnmatch
+import glob
+import posixpath
+import stat
+import threading
+import typing as t
+import warnings
+
 import pysftp
 
 from mara_storage import storages
+from mara_storage.client import StorageClient, FileInfo, _iterate_chunks
 
 
 def connection(storage: storages.SftpStorage):
+    if storage.insecure:
+        with warnings.catch_warnings():
+            # pysftp warns when there is no known_hosts file
+            warnings.simplefilter('ignore')
+            cnopts = pysftp.CnOpts()
+        cnopts.hostkeys = None
+    else:
+        cnopts = pysftp.CnOpts()
     return pysftp.Connection(host=storage.host,
                              port=storage.port if storage.port else 22,
                              username=storage.user,
-                             password=storage.password)
+                             password=storage.password,
+                             private_key=storage.identity_file,
+                             cnopts=cnopts)
+
+
+class SftpStorageClient(StorageClient):
+    def __init__(self, storage: storages.SftpStorage):
+        super().__init__(storage)
+
+        self.__connection = None
+        # a SFTP session can not handle requests from several threads at the same time
+        self._lock = threading.RLock()
+
+    @property
+    def _connection(self) -> pysftp.Connection:
+        with self._lock:
+            if not self.__connection:
+                self.__connection = connection(self._storage)
+            return self.__connection
+
+    def close(self):
+        """Closes the SFTP session"""
+        with self._lock:
+            if self.__connection:
+                self.__connection.close()
+                self.__connection = None
+
+    def last_modification_timestamp(self, path: str) -> datetime.datetime:
+        with self._lock:
+            return datetime.datetime.fromtimestamp(self._connection.stat(path).st_mtime).astimezone()
+
+    def iterate_files(self, file_pattern: str) -> t.Iterator[str]:
+        for file_info in self.iterate_file_infos(file_pattern):
+            yield file_info.name
+
+    def iterate_file_infos(self, file_pattern: str) -> t.Iterator[FileInfo]:
+        """
+        Iterates over files on on a storage including their size and last modification timestamp
+
+        The pattern is matched segment by segment like in `glob.glob`, directories are
+        only listed when they can contain matches.
+
+        Args:
+            file_pattern: the file pattern, e.g. `'subfolder/*.csv'`
+        """
+        segments = [segment for segment in file_pattern.split('/') if segment]
+        if not segments:
+            return
+        yield from self._iterate_file_infos('', segments)
+
+    def _iterate_file_infos(self, directory: str, segments: t.List[str]) -> t.Iterator[FileInfo]:
+        segment, remaining = segments[0], segments[1:]
+        if not glob.has_magic(segment):
+            path = posixpath.join(directory, segment)
+            if remaining:
+                yield from self._iterate_file_infos(path, remaining)
+            else:
+                try:
+                    with self._lock:
+                        attributes = self._connection.stat(path)
+                except FileNotFoundError:
+                    return
+                yield _file_info(path, attributes)
+            return
+
+        try:
+            with self._lock:
+                entries = self._connection.listdir_attr(directory or '.')
+        except FileNotFoundError:
+            return
+        for attributes in sorted(entries, key=lambda attributes: attributes.filename):
+            if attributes.filename.startswith('.') and not segment.startswith('.'):
+                continue
+            if not fnmatch.fnmatch(attributes.filename, segment):
+                continue
+            path = posixpath.join(directory, attributes.filename)
+            if not remaining:
+                yield _file_info(path, attributes)
+            elif stat.S_ISDIR(attributes.st_mode):
+                yield from self._iterate_file_infos(path, remaining)
+
+    def iterate_directory(self, path: str) -> t.Iterator[FileInfo]:
+        directory = path.strip('/')
+        try:
+            with self._lock:
+                entries = self._connection.listdir_attr(directory or '.')
+        except FileNotFoundError:
+            return
+        for attributes in sorted(entries, key=lambda attributes: attributes.filename):
+            name = posixpath.join(directory, attributes.filename)
+            if stat.S_ISDIR(attributes.st_mode):
+                yield FileInfo(name=name + '/')
+            else:
+                yield _file_info(name, attributes)
+
+    def read_file(self, path: str) -> bytes:
+        with self._lock, self._connection.open(path, 'rb') as f:
+            f.prefetch()
+            return f.read()
+
+    def file_size(self, path: str) -> int:
+        with self._lock:
+            return self._connection.stat(path).st_size
+
+    def read_range(self, path: str, start: int, length: int) -> bytes:
+        with self._lock, self._connection.open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def upload_file(self, local_path: str, path: str):
+        with self._lock:
+            directory = posixpath.dirname(path)
+            if directory:
+                self._connection.makedirs(directory)
+            self._connection.put(local_path, path, preserve_mtime=False)
+
+    def append(self, path: str, stream: t.Union[bytes, t.BinaryIO]) -> int:
+        with self._lock:
+            directory = posixpath.dirname(path)
+            if directory:
+                self._connection.makedirs(directory)
+            # append mode: the writes start at the end of the existing file
+            with self._connection.open(path, 'ab') as f:
+                f.set_pipelined(True)
+                for chunk in _iterate_chunks(stream):
+                    f.write(chunk)
+                return f.tell()
+
+
+def _file_info(path: str, attributes) -> FileInfo:
+    return FileInfo(name=path,
+                    size=attributes.st_size,
+                    last_modified=datetime.datetime.fromtimestamp(attributes.st_mtime).astimezone())
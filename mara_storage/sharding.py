@@ -0,0 +1,177 @@
+"""
+Deterministic sharding of file listings between parallel workers
+
+`StorageClient.iterate_files` and `StorageClient.iterate_file_infos` take the keyword
+arguments `shard_index` and `shard_count`. Each file is assigned to exactly one of
+`shard_count` shards, and only the files of shard `shard_index` are yielded. Workers using
+the same pattern, `shard_count` and `shard_by` therefore process disjoint sets of files
+which together cover the listing, without coordination:
+
+- `shard_by='name'`: by a stable hash of the file name. Every worker lists all files.
+- `shard_by='size'`: balances the total size of the shards, using the sizes from the
+  listing. Every worker lists all files, which must not change between the workers.
+- `shard_by='directory'`: by a stable hash of the directory below the literal part of the
+  pattern, e.g. of `events/2026-10-17` for `'events/*/*.csv'`. Each worker lists the
+  subdirectories (see `StorageClient.iterate_directory`) and then only its own
+  directories. Patterns without such a directory are sharded by name.
+
+Example:
+    for file_name in StorageClient('data').iterate_files('events/*/*.csv', shard_index=i, shard_count=8,
+                                                         shard_by='directory'):
+        ...
+"""
+
+import fnmatch
+import functools
+import hashlib
+import heapq
+import inspect
+import typing as t
+
+from mara_storage import storages
+
+if t.TYPE_CHECKING:
+    from mara_storage.client import FileInfo
+
+
+SHARD_BY = ['name', 'size', 'directory']
+
+
+def shard_of(key: str, shard_count: int) -> int:
+    """Returns the shard of a key, the same in all processes (unlike the randomized `hash`)"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big') % shard_count
+
+
+def balance_by_size(file_infos: t.Iterable['FileInfo'], shard_count: int) -> t.Dict[str, int]:
+    """
+    Assigns files to shards so that the shards have about the same total size
+
+    The largest files are assigned first, each to the shard with the smallest total so far
+    (ties by file name and shard index), so the result only depends on the listing.
+
+    Returns:
+        The shard of each file name
+    """
+    shards = [(0, shard_index) for shard_index in range(shard_count)]
+    assignment = {}
+    for file_info in sorted(file_infos, key=lambda file_info: (-(file_info.size or 0), file_info.name)):
+        total, shard_index = heapq.heappop(shards)
+        assignment[file_info.name] = shard_index
+        heapq.heappush(shards, (total + (file_info.size or 0), shard_index))
+    return assignment
+
+
+def _iterate_sharded(self, method: t.Callable, yields_names: bool, file_pattern: str, args: tuple, kwargs: dict,
+                     shard_index: int, shard_count: int, shard_by: str) -> t.Iterator:
+    """Yields the items of `method(self, file_pattern, *args, **kwargs)` belonging to a shard"""
+    from . import packing
+
+    if shard_by not in SHARD_BY:
+        raise ValueError(f'Unsupported shard_by "{shard_by}", please use one of {", ".join(SHARD_BY)}')
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f'shard_index must be between 0 and {shard_count - 1}')
+
+    if shard_by == 'size':
+        file_infos = list(self.iterate_file_infos(file_pattern, *args, **kwargs))
+        assignment = balance_by_size(file_infos, shard_count)
+        for file_info in file_infos:
+            if assignment[file_info.name] == shard_index:
+                yield file_info.name if yields_names else file_info
+        return
+
+    if shard_by == 'directory' and not packing.namespace(self._storage, file_pattern):
+        directories = _directory_shard(self, file_pattern, shard_index, shard_count)
+        if directories is not None:
+            for directory_pattern, file_info in directories:
+                if file_info:
+                    # a file within the listed directory of a prefix pattern
+                    yield file_info.name if yields_names else file_info
+                else:
+                    yield from method(self, directory_pattern, *args, **kwargs)
+            return
+
+    for item in method(self, file_pattern, *args, **kwargs):
+        if shard_of(item if yields_names else item.name, shard_count) == shard_index:
+            yield item
+
+
+def _directory_shard(self, file_pattern: str, shard_index: int,
+                     shard_count: int) -> t.Optional[t.Iterator[t.Tuple[str, t.Optional['FileInfo']]]]:
+    """
+    Returns the patterns of the directories of a shard (and files matching a prefix pattern
+    directly within the listed directory), None when the pattern can not be sharded by directory
+    """
+    from .listing import literal_prefix
+
+    prefix_patterns = _prefix_patterns(self._storage)
+    literal = file_pattern if prefix_patterns else literal_prefix(file_pattern)
+    base, separator, _ = literal.rpartition('/')
+    segment, separator, remainder = file_pattern[len(base + separator):].partition('/')
+    if not prefix_patterns and (not separator or segment == '**'):
+        # no directory to shard by, or files at any depth
+        return None
+    try:
+        entries = list(self.iterate_directory(base))
+    except NotImplementedError:
+        return None
+    # like the listings of these clients, `*` does not match hidden directories
+    hides_dot_files = isinstance(self._storage, (storages.LocalStorage, storages.SftpStorage))
+
+    def directories():
+        for entry in entries:
+            entry_name = entry.name[len(base + '/' if base else ''):]
+            if entry.name.endswith('/'):
+                directory = entry.name.rstrip('/')
+                entry_name = entry_name.rstrip('/')
+                if prefix_patterns:
+                    matches = entry_name.startswith(segment)
+                else:
+                    matches = (fnmatch.fnmatch(entry_name, segment)
+                               and not (hides_dot_files and entry_name.startswith('.') and not segment.startswith('.')))
+                if matches and shard_of(directory, shard_count) == shard_index:
+                    yield directory + '/' + ('' if prefix_patterns else remainder), None
+            elif prefix_patterns and entry_name.startswith(segment) and shard_of(entry.name, shard_count) == shard_index:
+                yield entry.name, entry
+    return directories()
+
+
+@functools.singledispatch
+def _prefix_patterns(storage: object) -> bool:
+    """Whether the listings of a storage take a prefix instead of a glob pattern"""
+    return False
+
+
+@_prefix_patterns.register(storages.GoogleCloudStorage)
+@_prefix_patterns.register(storages.AzureStorage)
+def __(storage: storages.Storage) -> bool:
+    return True
+
+
+def _sharded(method, yields_names: bool):
+    @functools.wraps(method)
+    def wrapper(self, file_pattern: str, *args, shard_index: int = None, shard_count: int = None,
+                shard_by: str = 'name', **kwargs):
+        if (shard_index is None) != (shard_count is None):
+            raise ValueError('shard_index and shard_count must be given together')
+        if shard_count is None:
+            yield from method(self, file_pattern, *args, **kwargs)
+        else:
+            yield from _iterate_sharded(self, method, yields_names, file_pattern, args, kwargs, shard_index, shard_count, shard_by)
+
+    # the signature of `method` with the sharding arguments, as used by `events.tracked`
+    signature = inspect.signature(method)
+    parameters = [parameter for parameter in signature.parameters.values() if parameter.kind != parameter.VAR_KEYWORD]
+    parameters += [inspect.Parameter(name, inspect.Parameter.KEYWORD_ONLY, default=default)
+                   for name, default in [('shard_index', None), ('shard_count', None), ('shard_by', 'name')]]
+    parameters += [parameter for parameter in signature.parameters.values() if parameter.kind == parameter.VAR_KEYWORD]
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+    wrapper.__sharded__ = True
+    return wrapper
+
+
+def instrument(cls: type, operations: t.List[str]):
+    """Adds the arguments `shard_index`, `shard_count` and `shard_by` to the methods `operations` defined in class `cls`"""
+    for name in operations:
+        method = cls.__dict__.get(name)
+        if method and callable(method) and not getattr(method, '__sharded__', False):
+            setattr(cls, name, _sharded(method, yields_names=name == 'iterate_files'))
@@ -1,10 +1,15 @@
 """
 Shell command generation for
 - reading/writing/deleting files in storages via their command line clients
+- reading all files matching a pattern in one pipeline
+- uploading many files in one invocation
 """
 
 from functools import singledispatch
+import pathlib
 import shlex
+import typing as t
+import urllib.parse
 
 from mara_storage.compression import Compression, uncompressor, file_extension
 from mara_storage import storages
@@ -36,16 +41,20 @@ def __(storage: storages.LocalStorage, file_name: str, compression: Compression
     return f'{uncompressor(compression)} '+shlex.quote(str( (storage.base_path / file_name).absolute() ))
 
 
+@read_file_command.register(storages.MemoryStorage)
+def __(storage: storages.MemoryStorage, file_name: str, compression: Compression = Compression.NONE) -> str:
+    if compression not in [Compression.NONE, Compression.GZIP]:
+        raise ValueError(f'Only compression NONE and GZIP is supported from storage type "{storage.__class__.__name__}"')
+    from . import memory_storage
+    return (memory_storage.helper_command(storage, 'read', file_name)
+            + (f'\\\n  | {uncompressor(compression)} - ' if compression != Compression.NONE else ''))
+
+
 @read_file_command.register(storages.SftpStorage)
 def __(storage: storages.SftpStorage, file_name: str, compression: Compression = Compression.NONE):
     if compression not in [Compression.NONE]:
         raise ValueError(f'Only compression NONE is supported from storage type "{storage.__class__.__name__}"')
-    return ('curl -s'
-            + (' -k' if storage.insecure else '')
-            + (f' -u {storage.user}:' if storage.user else '')
-            + (f'{storage.password}' if storage.user and storage.password else '')
-            + (f' --key {storage.identity_file}' if storage.identity_file else '')
-            + (f' --pubkey {storage.public_identity_file}' if storage.public_identity_file else '')
+    return (_curl_sftp(storage)
             + f' sftp://{storage.host}'
             + (f':{storage.port}' if storage.port else '')
             + f'/{shlex.quote(file_name)}'
@@ -67,11 +76,7 @@ def __(storage: storages.AzureStorage, file_name: str, compression: Compression
         return (f'curl -sf {shlex.quote(storage.build_uri(path=file_name))}'
                 + (f'\\\n  | {uncompressor(compression)} - ' if compression != Compression.NONE else ''))
 
-    azlogin_env = ('AZCOPY_AUTO_LOGIN_TYPE=SPN '
-                   + f'AZCOPY_TENANT_ID="{storage.spa_tenant}" '
-                   + f'AZCOPY_SPA_APPLICATION_ID="{storage.spa_application}" '
-                   + f'AZCOPY_SPA_CLIENT_SECRET="{storage.spa_client_secret}" '
-                   ) if not storage.sas else ''
+    azlogin_env = azcopy_login_env(storage)
 
     return (f'{azlogin_env}azcopy cp '
             + shlex.quote(storage.build_uri(file_name, storage_type='blob'))
@@ -82,6 +87,182 @@ def __(storage: storages.AzureStorage, file_name: str, compression: Compression
 # -----------------------------------------------------------------------------
 
 
+@singledispatch
+def read_files_command(storage: object, file_pattern: str, compression: Compression = Compression.NONE,
+                       parallelism: int = None) -> str:
+    """
+    Creates a shell command that reads all files matching a pattern and sends their content to stdout
+
+    The files are read in the (byte-wise) order of their names, so that the output is
+    deterministic. Each file is uncompressed on its own, e.g. the content of all zip files
+    is concatenated.
+
+    Args:
+        storage: The storage where the files are stored
+        file_pattern: The file pattern, e.g. `'2023/01/01/*.csv.gz'`
+        compression: The compression to be used to uncompress the files
+        parallelism: The number of files downloaded at the same time, None for the default of
+                     the command line tool. Only used by storages where this does not change
+                     the order of the output.
+
+    Returns:
+        A shell command string
+    """
+    raise NotImplementedError(f'Please implement read_files_command for type "{storage.__class__.__name__}"')
+
+
+@read_files_command.register(str)
+def __(alias: str, file_pattern: str, compression: Compression = Compression.NONE, parallelism: int = None) -> str:
+    return read_files_command(storages.storage(alias), file_pattern=file_pattern, compression=compression,
+                              parallelism=parallelism)
+
+
+@read_files_command.register(storages.LocalStorage)
+def __(storage: storages.LocalStorage, file_pattern: str, compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    from . import local_storage
+    # the files are selected by `local_storage.walk`, i.e. the same files as by `iterate_files`
+    return (local_storage.list_files_command(storage, file_pattern) + ' \\\n'
+            + f'  | {_uncompress_files(compression)}')
+
+
+@read_files_command.register(storages.MemoryStorage)
+def __(storage: storages.MemoryStorage, file_pattern: str, compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    if compression not in [Compression.NONE, Compression.GZIP]:
+        raise ValueError(f'Only compression NONE and GZIP is supported from storage type "{storage.__class__.__name__}"')
+    from . import memory_storage
+    # concatenated gzip files are a valid gzip stream
+    return (memory_storage.helper_command(storage, 'read_files', file_pattern)
+            + (f'\\\n  | {uncompressor(compression)} - ' if compression != Compression.NONE else ''))
+
+
+@read_files_command.register(storages.SftpStorage)
+def __(storage: storages.SftpStorage, file_pattern: str, compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    if compression not in [Compression.NONE, Compression.GZIP]:
+        raise ValueError(f'Only compression NONE and GZIP is supported from storage type "{storage.__class__.__name__}"')
+    directory, _, name_pattern = file_pattern.rpartition('/')
+    if _has_magic(directory):
+        raise ValueError(f'Only wildcards in the file name are supported from storage type "{storage.__class__.__name__}"')
+
+    directory_url = _sftp_url(storage, directory + '/' if directory else '')
+    # lists the directory, filters the names with a `case` pattern and downloads all files
+    # with one `curl` call, i.e. in one SFTP session
+    return (f'{_curl_sftp(storage)} -l {shlex.quote(directory_url)} \\\n'
+            + '  | while IFS= read -r name; do \\\n'
+            + '      case "$name" in \\\n'
+            + '        .|..) ;; \\\n'
+            + ('' if name_pattern.startswith('.') else '        .*) ;; \\\n')
+            # all bytes of the name are percent-encoded: the curl config contains neither quotes nor backslashes
+            + f'        {_case_pattern(name_pattern)}) printf \'url = "%s%s"\\n\' {shlex.quote(directory_url)} \\\n'
+            + '            "$(printf \'%s\' "$name" | od -A n -v -t x1 | sed \'s/ *\\([0-9a-f][0-9a-f]\\)/%\\1/g\' | tr -d \' \\n\')" ;; \\\n'
+            + '      esac; \\\n'
+            + '    done \\\n'
+            + '  | LC_ALL=C sort \\\n'
+            # curl fails without any URL
+            + f'  | (urls=$(cat); [ -z "$urls" ] || printf \'%s\\n\' "$urls" | {_curl_sftp(storage)} -K -)'
+            + (f' \\\n  | {uncompressor(compression)} - ' if compression != Compression.NONE else ''))
+
+
+@read_files_command.register(storages.GoogleCloudStorage)
+def __(storage: storages.GoogleCloudStorage, file_pattern: str, compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    gsutil = ('gsutil '
+              + (f'-o Credentials:gs_service_key_file={shlex.quote(storage.service_account_file)} ' if storage.service_account_file else ''))
+
+    if compression in [Compression.NONE, Compression.GZIP] and not (parallelism and parallelism > 1):
+        # `gsutil cat` expands the wildcards in listing order, i.e. sorted by name.
+        # Concatenated gzip files are a valid gzip stream.
+        return (f'{gsutil}cat {shlex.quote(storage.build_uri(file_pattern))}'
+                + (f' \\\n  | {uncompressor(compression)} - ' if compression != Compression.NONE else ''))
+
+    return _download_in_order(list_command=f'{gsutil}ls {shlex.quote(storage.build_uri(file_pattern))}',
+                              download_command=f'{gsutil}-q cp "$1" "$2"',
+                              parallelism=parallelism or 1, compression=compression)
+
+
+@read_files_command.register(storages.AzureStorage)
+def __(storage: storages.AzureStorage, file_pattern: str, compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    directory, _, name_pattern = file_pattern.rpartition('/')
+    if _has_magic(directory):
+        raise ValueError(f'Only wildcards in the file name are supported from storage type "{storage.__class__.__name__}"')
+
+    # azcopy downloads the files of the directory matching the pattern into a temporary
+    # directory, from which they are read in the order of their names
+    return ('(tmp=$(mktemp -d) && trap \'rm -rf "$tmp"\' EXIT \\\n'
+            + f'  && {azcopy_login_env(storage)}'
+            + (f'AZCOPY_CONCURRENCY_VALUE={int(parallelism)} ' if parallelism else '')
+            + 'azcopy cp '
+            + shlex.quote(storage.build_uri((directory + '/' if directory else '') + '*', storage_type='blob'))
+            + f' "$tmp" --include-pattern {shlex.quote(name_pattern)} --log-level ERROR > /dev/null \\\n'
+            + '  && find "$tmp" -type f -print0 \\\n'
+            + '  | LC_ALL=C sort -z \\\n'
+            + f'  | {_uncompress_files(compression)})')
+
+
+def _curl_sftp(storage: storages.SftpStorage) -> str:
+    """Returns the `curl` command with the options for accessing a SFTP storage"""
+    return ('curl -s'
+            + (' -k' if storage.insecure else '')
+            + (f' -u {storage.user}:' if storage.user else '')
+            + (f'{storage.password}' if storage.user and storage.password else '')
+            + (f' --key {storage.identity_file}' if storage.identity_file else '')
+            + (f' --pubkey {storage.public_identity_file}' if storage.public_identity_file else ''))
+
+
+def _sftp_url(storage: storages.SftpStorage, path: str) -> str:
+    return (f'sftp://{storage.host}'
+            + (f':{storage.port}' if storage.port else '')
+            + f'/{urllib.parse.quote(path)}')
+
+
+def _uncompress_files(compression: Compression) -> str:
+    """
+    Returns the command uncompressing the null-separated files from stdin to stdout one by one.
+    `xargs -0 -r` is supported by the GNU and BSD versions of `xargs`.
+    """
+    if compression in [Compression.NONE, Compression.GZIP]:
+        # `cat` and `gunzip` write the files given as arguments in order
+        return f'xargs -0 -r {uncompressor(compression)}'
+    return f'xargs -0 -r -n 1 {uncompressor(compression)}'
+
+
+def _download_in_order(list_command: str, download_command: str, parallelism: int, compression: Compression) -> str:
+    """
+    Returns a command which downloads files in parallel to a temporary directory and then
+    sends their content in the order of their names to stdout
+
+    Args:
+        list_command: a command printing the files to download, one per line
+        download_command: a command downloading file "$1" to local file "$2"
+        parallelism: the number of downloads running at the same time
+        compression: the compression to be used to uncompress the files
+    """
+    return ('(tmp=$(mktemp -d) && trap \'rm -rf "$tmp"\' EXIT \\\n'
+            + f'  && {list_command} \\\n'
+            + '  | LC_ALL=C sort \\\n'
+            # the local files are numbered in the order of the names
+            + '  | { n=0; while IFS= read -r file; do n=$((n+1)); printf \'%s\\0%s/%08d\\0\' "$file" "$tmp" "$n"; done; } \\\n'
+            + f'  | xargs -0 -r -n 2 -P {int(parallelism)} sh -c {shlex.quote(download_command)} _ \\\n'
+            + '  && find "$tmp" -type f -print0 \\\n'
+            + '  | LC_ALL=C sort -z \\\n'
+            + f'  | {_uncompress_files(compression)})')
+
+
+def _has_magic(pattern: str) -> bool:
+    return any(char in pattern for char in '*?[')
+
+
+def _case_pattern(pattern: str) -> str:
+    """Escapes a glob pattern for a `case` statement, keeping its wildcards"""
+    return ''.join(char if char.isalnum() or char in '*?[]!-_.' else '\\' + char for char in pattern)
+
+
+# -----------------------------------------------------------------------------
+
+
 @singledispatch
 def write_file_command(storage: object, file_name: str, compression: Compression = Compression.NONE) -> str:
     """
@@ -124,6 +305,15 @@ def __(storage: storages.LocalStorage, file_name: str, compression: Compression
         return 'cat - > ' + shlex.quote(str( full_path ))
 
 
+@write_file_command.register(storages.MemoryStorage)
+def __(storage: storages.MemoryStorage, file_name: str, compression: Compression = Compression.NONE) -> str:
+    if compression not in [Compression.NONE, Compression.GZIP]:
+        raise ValueError(f'Only compression NONE and GZIP is supported from storage type "{storage.__class__.__name__}"')
+    from . import memory_storage
+    return (('gzip \\\n  | ' if compression == Compression.GZIP else '')
+            + memory_storage.helper_command(storage, 'write', file_name))
+
+
 @write_file_command.register(storages.SftpStorage)
 def __(storage: storages.LocalStorage, file_name: str, compression: Compression = Compression.NONE):
     if compression not in [Compression.NONE]:
@@ -158,11 +348,7 @@ def __(storage: storages.AzureStorage, file_name: str, compression: Compression
     if compression not in [Compression.NONE, Compression.GZIP]:
         raise ValueError(f'Only compression NONE and GZIP is supported from storage type "{storage.__class__.__name__}"')
 
-    azlogin_env = ('AZCOPY_AUTO_LOGIN_TYPE=SPN '
-                   + f'AZCOPY_TENANT_ID="{storage.spa_tenant}" '
-                   + f'AZCOPY_SPA_APPLICATION_ID="{storage.spa_application}" '
-                   + f'AZCOPY_SPA_CLIENT_SECRET="{storage.spa_client_secret}" '
-                   ) if not storage.sas else ''
+    azlogin_env = azcopy_login_env(storage)
 
     return ((f'gzip \\\n  | ' if compression == Compression.GZIP else '')
             + f'{azlogin_env}azcopy cp '
@@ -173,6 +359,226 @@ def __(storage: storages.AzureStorage, file_name: str, compression: Compression
 # -----------------------------------------------------------------------------
 
 
+@singledispatch
+def upload_directory_command(storage: object, local_directory: str, target_directory: str = '',
+                             compression: Compression = Compression.NONE, parallelism: int = None) -> str:
+    """
+    Creates a shell command that uploads all files of a local directory, including its
+    subdirectories, to a storage in one invocation
+
+    Args:
+        storage: The storage where the files will be stored
+        local_directory: The local directory
+        target_directory: The directory within the storage, by default the root of the storage
+        compression: When GZIP, each file is compressed on its own and stored with suffix `.gz`
+        parallelism: The number of files uploaded (resp. compressed) at the same time, None
+                     for the default of the command line tool
+
+    Returns:
+        A shell command string
+    """
+    raise NotImplementedError(f'Please implement upload_directory_command for type "{storage.__class__.__name__}"')
+
+
+@upload_directory_command.register(str)
+def __(alias: str, local_directory: str, target_directory: str = '', compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    return upload_directory_command(storages.storage(alias), local_directory=local_directory,
+                                    target_directory=target_directory, compression=compression,
+                                    parallelism=parallelism)
+
+
+@upload_directory_command.register(storages.LocalStorage)
+@upload_directory_command.register(storages.MemoryStorage)
+@upload_directory_command.register(storages.GoogleCloudStorage)
+@upload_directory_command.register(storages.AzureStorage)
+@upload_directory_command.register(storages.SftpStorage)
+def __(storage: storages.Storage, local_directory: str, target_directory: str = '',
+       compression: Compression = Compression.NONE, parallelism: int = None) -> str:
+    directory = shlex.quote(str(pathlib.Path(local_directory).absolute()))
+    if compression == Compression.NONE:
+        return _upload_command(storage, directory, target_directory, parallelism)
+    return _compress_and_upload(storage, 'find . -type f -print0', target_directory, compression, parallelism,
+                                directory=directory)
+
+
+@singledispatch
+def write_files_command(storage: object, target_directory: str = '', compression: Compression = Compression.NONE,
+                        parallelism: int = None) -> str:
+    """
+    Creates a shell command that uploads the local files listed on stdin (one path per line)
+    to a directory of a storage in one invocation
+
+    Example:
+        find exports -name 'part-*.csv' | <write_files_command>
+
+    Args:
+        storage: The storage where the files will be stored
+        target_directory: The directory within the storage, the files are stored under their file name
+        compression: When GZIP, each file is compressed on its own and stored with suffix `.gz`
+        parallelism: The number of files uploaded (resp. compressed) at the same time, None
+                     for the default of the command line tool
+
+    Returns:
+        A shell command string
+    """
+    raise NotImplementedError(f'Please implement write_files_command for type "{storage.__class__.__name__}"')
+
+
+@write_files_command.register(str)
+def __(alias: str, target_directory: str = '', compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    return write_files_command(storages.storage(alias), target_directory=target_directory, compression=compression,
+                               parallelism=parallelism)
+
+
+@write_files_command.register(storages.LocalStorage)
+@write_files_command.register(storages.MemoryStorage)
+@write_files_command.register(storages.GoogleCloudStorage)
+@write_files_command.register(storages.AzureStorage)
+@write_files_command.register(storages.SftpStorage)
+def __(storage: storages.Storage, target_directory: str = '', compression: Compression = Compression.NONE,
+       parallelism: int = None) -> str:
+    # the files are linked into (resp. compressed to) a temporary directory, which is then uploaded
+    if compression == Compression.NONE:
+        return ('(tmp=$(mktemp -d) && trap \'rm -rf "$tmp"\' EXIT \\\n'
+                + '  && while IFS= read -r file; do ln -s "$(realpath "$file")" "$tmp/$(basename "$file")" || exit 1; done \\\n'
+                + '  && ' + _upload_command(storage, '"$tmp"', target_directory, parallelism) + ')')
+    return _compress_and_upload(storage, 'while IFS= read -r file; do printf \'%s\\0\' "$file"; done',
+                                target_directory, compression, parallelism, flat=True)
+
+
+def _compress_and_upload(storage: storages.Storage, files_command: str, target_directory: str,
+                         compression: Compression, parallelism: t.Optional[int], flat: bool = False,
+                         directory: str = None) -> str:
+    """
+    Returns a command compressing the files printed (null-separated) by `files_command` into
+    a temporary directory and uploading it
+
+    Args:
+        flat: if True, the files are stored under their file name, otherwise under their relative path
+        directory: the local directory (as shell word) in which `files_command` is run
+    """
+    if compression != Compression.GZIP:
+        raise ValueError('Only compression NONE and GZIP is supported for uploading files')
+    target = '"$0/$(basename "$1").gz"' if flat else '"$0/$1.gz"'
+    return ('(' + (f'cd {directory} && ' if directory else '') + 'tmp=$(mktemp -d) && trap \'rm -rf "$tmp"\' EXIT \\\n'
+            + f'  && ({files_command}) \\\n'
+            + f'  | xargs -0 -r -n 1 -P {int(parallelism or 1)} sh -c '
+            + shlex.quote(f'mkdir -p "$(dirname {target})" && gzip -c "$1" > {target}') + ' "$tmp" \\\n'
+            + '  && ' + _upload_command(storage, '"$tmp"', target_directory, parallelism) + ')')
+
+
+@singledispatch
+def _upload_command(storage: object, directory: str, target_directory: str, parallelism: t.Optional[int]) -> str:
+    """
+    Returns the command uploading the content of a local directory
+
+    Args:
+        directory: the local directory as shell word, e.g. `'"$tmp"'`
+    """
+    raise NotImplementedError(f'Please implement _upload_command for type "{storage.__class__.__name__}"')
+
+
+@_upload_command.register(storages.LocalStorage)
+def __(storage: storages.LocalStorage, directory: str, target_directory: str, parallelism: t.Optional[int]) -> str:
+    target = shlex.quote(str((storage.base_path / target_directory).absolute()))
+    return f'mkdir -p {target} && cp -RL {directory}/. {target}'
+
+
+@_upload_command.register(storages.MemoryStorage)
+def __(storage: storages.MemoryStorage, directory: str, target_directory: str, parallelism: t.Optional[int]) -> str:
+    from . import memory_storage
+    return f'{memory_storage.helper_command(storage, "upload", target_directory)} {directory}'
+
+
+@_upload_command.register(storages.GoogleCloudStorage)
+def __(storage: storages.GoogleCloudStorage, directory: str, target_directory: str, parallelism: t.Optional[int]) -> str:
+    # with several sources and a destination ending with '/', each source is copied to
+    # '<destination>/<source name>', regardless whether the destination exists
+    destination = storage.build_uri(target_directory.strip('/') + '/' if target_directory.strip('/') else '')
+    return (f'find {directory} -mindepth 1 -maxdepth 1 -print0 \\\n'
+            + '  | xargs -0 -r sh -c '
+            + shlex.quote('gsutil -m '
+                          + (f'-o GSUtil:parallel_process_count=1 -o GSUtil:parallel_thread_count={int(parallelism)} ' if parallelism else '')
+                          + (f'-o Credentials:gs_service_key_file={shlex.quote(storage.service_account_file)} ' if storage.service_account_file else '')
+                          + f'cp -r "$@" {shlex.quote(destination)}')
+            + ' _')
+
+
+@_upload_command.register(storages.AzureStorage)
+def __(storage: storages.AzureStorage, directory: str, target_directory: str, parallelism: t.Optional[int]) -> str:
+    return (f'{azcopy_login_env(storage)}'
+            + (f'AZCOPY_CONCURRENCY_VALUE={int(parallelism)} ' if parallelism else '')
+            + f'azcopy cp {directory}\'/*\' '
+            + shlex.quote(storage.build_uri(target_directory.strip('/'), storage_type='blob'))
+            + ' --recursive --follow-symlinks --log-level ERROR > /dev/null')
+
+
+@_upload_command.register(storages.SftpStorage)
+def __(storage: storages.SftpStorage, directory: str, target_directory: str, parallelism: t.Optional[int]) -> str:
+    target = target_directory.strip('/')
+    parents = [target.rsplit('/', i)[0] for i in reversed(range(target.count('/') + 1))] if target else []
+    batches = int(parallelism or 1)
+    # sftp batch commands take double-quoted arguments, in which `"` and `\` are escaped with `\`
+    escape = 'sed \'s/["\\\\]/\\\\&/g\''
+    prefix = _sed_replacement(_sftp_escape(target + '/' if target else ''))
+    mkdir_script = f's|.*|-mkdir "{prefix}&"|'
+    put_script = f's|.*|put "&" "{prefix}&"|'
+    # one session creates the directories, then the files are distributed round-robin over
+    # `parallelism` batches, which are uploaded in one session each
+    return (f'(cd {directory} && tmp=$(mktemp -d) && trap \'rm -rf "$tmp"\' EXIT \\\n'
+            + '  && find -L . -mindepth 1 -type d | sed \'s|^\\./||\' | LC_ALL=C sort > "$tmp/directories" \\\n'
+            + '  && find -L . -type f | sed \'s|^\\./||\' > "$tmp/files" \\\n'
+            + '  && { '
+            + ''.join(f'echo {shlex.quote(f"-mkdir {_sftp_argument(parent)}")}; ' for parent in parents)
+            + f'{escape} "$tmp/directories" | sed {shlex.quote(mkdir_script)}; echo quit; }} \\\n'
+            + f'  | {_sftp(storage, batch=True)} > /dev/null \\\n'
+            + f'  && awk -v batches={batches} -v tmp="$tmp" \'{{ print > (tmp "/batch-" NR % batches) }}\' "$tmp/files" \\\n'
+            # no batch files for an empty directory
+            + f'  && find "$tmp" -name \'batch-*\' | xargs -r -n 1 -P {batches} sh -c '
+            + shlex.quote(f'{{ {escape} "$0" | sed {shlex.quote(put_script)}; echo quit; }}'
+                          + f' | {_sftp(storage, batch=True)} > /dev/null')
+            + ')')
+
+
+def _sftp_escape(path: str) -> str:
+    """Escapes `"` and `\\` for a double-quoted argument of a sftp batch command"""
+    return path.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _sftp_argument(path: str) -> str:
+    return f'"{_sftp_escape(path)}"'
+
+
+def _sed_replacement(text: str) -> str:
+    """Escapes a text for the replacement of a `sed` command with `|` as delimiter"""
+    return ''.join('\\' + char if char in '\\&|' else char for char in text)
+
+
+def _sftp(storage: storages.SftpStorage, batch: bool = False) -> str:
+    """
+    Returns a `sftp` command connecting to a SFTP storage
+
+    Args:
+        batch: if True, the commands are read from stdin and the command fails on the first failing command
+               (unless prefixed with `-`)
+    """
+    return ((f'sshpass -p {shlex.quote(storage.password)} ' if storage.password else '')
+            + 'sftp'
+            # batch mode disables password authentication by default
+            + (' -o BatchMode=no -b -' if batch else '')
+            + (' -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null' if storage.insecure else '')
+            + (f' -P {storage.port}' if storage.port else '')
+            + (f' -i {shlex.quote(storage.identity_file)}' if storage.identity_file else '')
+            + ' '
+            + (f'{storage.user}@' if storage.user else '')
+            + storage.host)
+
+
+# -----------------------------------------------------------------------------
+
+
 @singledispatch
 def delete_file_command(storage: object, file_name: str, force: bool = True, recursive: bool = False) -> str:
     """
@@ -212,18 +618,18 @@ def __(storage: storages.LocalStorage, file_name: str, force: bool = True, recur
             + shlex.quote(str( (storage.base_path / file_name).absolute() )))
 
 
+@delete_file_command.register(storages.MemoryStorage)
+def __(storage: storages.MemoryStorage, file_name: str, force: bool = True, recursive: bool = False) -> str:
+    from . import memory_storage
+    return memory_storage.helper_command(storage, 'delete', file_name, force=force, recursive=recursive)
+
+
 @delete_file_command.register(storages.SftpStorage)
 def __(storage: storages.SftpStorage, file_name: str, force: bool = True, recursive: bool = False):
     if not force:
         raise ValueError(f'Only force=True is supported from storage type "{storage.__class__.__name__}"')
 
-    return ((f'sshpass -p {storage.password} ' if storage.password else '')
-            + 'sftp'
-            + (' -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null' if storage.insecure else '')
-            + (f' {storage.user}@' if storage.user else '')
-            + storage.host
-            + (f':{storage.port}' if storage.port else '')
-            + (f' -i {storage.identity_file}' if storage.identity_file else '')
+    return (_sftp(storage)
             + f' << EOF\nrm '
             + ('-r ' if recursive else '')
             + f'{shlex.quote(file_name)}\nquit\nEOF')
@@ -244,12 +650,34 @@ def __(storage: storages.AzureStorage, file_name: str, force: bool = True, recur
     if storage.sas and not force and not recursive:
         return (f'curl -sf -X DELETE {shlex.quote(storage.build_uri(path=file_name))}')
 
-    azlogin_env = ('AZCOPY_AUTO_LOGIN_TYPE=SPN '
-                   + f'AZCOPY_TENANT_ID="{storage.spa_tenant}" '
-                   + f'AZCOPY_SPA_APPLICATION_ID="{storage.spa_application}" '
-                   + f'AZCOPY_SPA_CLIENT_SECRET="{storage.spa_client_secret}" '
-                   ) if not storage.sas else ''
+    azlogin_env = azcopy_login_env(storage)
 
     return (f'{azlogin_env}azcopy rm '
             + shlex.quote(storage.build_uri(file_name, storage_type='blob'))
             + (' --recursive=true' if recursive else ''))
+
+
+# -----------------------------------------------------------------------------
+
+
+def azcopy_login_env(storage: storages.AzureStorage) -> str:
+    """
+    Returns the environment variables to prefix `azcopy` commands with for a login as service principal
+
+    When `config.token_cache_directory` is set, the access token is taken from the token
+    cache and passed via `AZCOPY_OAUTH_TOKEN_INFO`, so that `azcopy` does not log in again.
+    The token is read when the command runs and is not part of the command.
+    """
+    if storage.sas:
+        return ''
+
+    from . import config
+    if config.token_cache_directory() and storage.spa_client_secret:
+        from . import token_cache
+        return (f'AZCOPY_OAUTH_TOKEN_INFO="$({token_cache.azcopy_token_info_command(storage, config.token_cache_directory())})" '
+                + f'AZCOPY_SPA_CLIENT_SECRET="{storage.spa_client_secret}" ')
+
+    return ('AZCOPY_AUTO_LOGIN_TYPE=SPN '
+            + f'AZCOPY_TENANT_ID="{storage.spa_tenant}" '
+            + f'AZCOPY_SPA_APPLICATION_ID="{storage.spa_application}" '
+            + f'AZCOPY_SPA_CLIENT_SECRET="{storage.spa_client_secret}" ')
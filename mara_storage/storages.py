@@ -2,6 +2,8 @@
 
 import functools
 import pathlib
+import typing as t
+import weakref
 
 
 @functools.lru_cache(maxsize=None)
@@ -11,9 +13,19 @@ def storage(alias) -> 'Storage':
     storages = config.storages()
     if alias not in storages:
         raise KeyError(f'storage alias "{alias}" not configured')
+    _aliases[storages[alias]] = alias
     return storages[alias]
 
 
+# the aliases of the storages returned by `storage`
+_aliases = weakref.WeakKeyDictionary()
+
+
+def alias(storage: 'Storage') -> t.Optional[str]:
+    """Returns the alias of a storage configuration, or None when it was not taken from the config by alias"""
+    return _aliases.get(storage)
+
+
 class Storage:
     """Generic storage connection definition"""
 
@@ -32,6 +44,21 @@ class LocalStorage(Storage):
         self.base_path = base_path
 
 
+class MemoryStorage(Storage):
+    def __init__(self, name: str = 'default'):
+        """
+        Connection information for a storage held in the memory of the current process
+
+        Meant for tests and benchmarks: no disk or network is involved. Storages with the
+        same name share their content. The content is not shared with other processes,
+        also not with forked ones.
+
+        Args:
+            name: the name of the in-memory storage
+        """
+        self.name = name
+
+
 class SftpStorage(Storage):
     def __init__(self, host: str, port: int = None, user: str = None, password: str = None,
         insecure: bool = False, identity_file: str = None, public_identity_file: str = None):
@@ -0,0 +1,219 @@
+"""
+Incremental reading of growing files
+
+`read_new_data` reads only the bytes appended to a file since the last call, e.g. of an
+append-only log on a local or SFTP storage or an Azure append blob. The offset up to which
+a file was read is kept in a checkpoint store.
+
+A file is read from the start again when it was rotated or truncated since the last
+checkpoint: when it shrank, when its identity changed (inode of local files, creation time
+of Azure blobs), or when its first bytes changed. Google Cloud Storage objects have no
+identity which is kept by appends (each compose creates a new generation), so only their
+size and first bytes are compared.
+
+Example:
+    store = FileCheckpointStore('/var/lib/etl/checkpoints')
+    new_data = read_new_data('logs', 'nginx/access.log', store, complete_lines=True)
+    load(new_data.data)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import typing as t
+import urllib.parse
+from functools import singledispatch
+
+from mara_storage import storages
+
+
+# the number of bytes at the start of a file whose hash is kept to detect rotation
+FINGERPRINT_SIZE = 1024
+
+
+class Checkpoint(t.NamedTuple):
+    """The offset up to which a file was read"""
+    offset: int
+    identity: t.Optional[str] = None
+    fingerprint: t.Optional[str] = None  # the hash of the first `fingerprint_size` bytes
+    fingerprint_size: int = 0
+
+
+class NewData(t.NamedTuple):
+    """The result of `read_new_data`"""
+    data: bytes
+    checkpoint: Checkpoint  # the checkpoint after `data`
+    rotated: bool  # True when the file was rotated or truncated, `data` then starts at the start of the file
+
+
+class CheckpointStore:
+    """Base class for stores of checkpoints"""
+
+    def load(self, key: str) -> t.Optional[Checkpoint]:
+        """Returns the checkpoint saved under a key, None if there is none"""
+        raise NotImplementedError
+
+    def save(self, key: str, checkpoint: Checkpoint):
+        """Saves a checkpoint under a key"""
+        raise NotImplementedError
+
+
+class MemoryCheckpointStore(CheckpointStore):
+    """Keeps checkpoints in memory, e.g. for tests"""
+
+    def __init__(self):
+        self.checkpoints: t.Dict[str, Checkpoint] = {}
+
+    def load(self, key: str) -> t.Optional[Checkpoint]:
+        return self.checkpoints.get(key)
+
+    def save(self, key: str, checkpoint: Checkpoint):
+        self.checkpoints[key] = checkpoint
+
+
+class FileCheckpointStore(CheckpointStore):
+    def __init__(self, directory: str):
+        """
+        Keeps checkpoints in a local directory, one JSON file per key
+
+        A checkpoint is written to a temporary file first and then moved over the previous
+        one, so that a crash never leaves a partial checkpoint.
+
+        Args:
+            directory: the directory of the checkpoint files
+        """
+        self.directory = directory
+
+    def load(self, key: str) -> t.Optional[Checkpoint]:
+        try:
+            with open(self._path(key)) as f:
+                return Checkpoint(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, checkpoint: Checkpoint):
+        os.makedirs(self.directory, exist_ok=True)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix='.checkpoint-')
+        try:
+            with os.fdopen(file_descriptor, 'w') as f:
+                json.dump(checkpoint._asdict(), f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary_path, self._path(key))
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, urllib.parse.quote(key, safe='') + '.json')
+
+
+def checkpoint_key(storage: t.Union[str, storages.Storage], path: str) -> str:
+    """Returns the key under which the checkpoint of a file is saved"""
+    if isinstance(storage, str):
+        alias = storage
+    else:
+        alias = storages.alias(storage) or f'{storage.__class__.__name__}-{id(storage)}'
+    return f'{alias}:{path}'
+
+
+def read_new_data(storage: t.Union[str, storages.Storage], path: str, checkpoint_store: CheckpointStore,
+                  max_bytes: int = None, complete_lines: bool = False, save: bool = True) -> NewData:
+    """
+    Reads the bytes appended to a file since the last checkpoint with one ranged read
+
+    Data appended to a rotated file after the last checkpoint is not read, as the rotated
+    file has another path.
+
+    Args:
+        storage: the storage alias or configuration
+        path: the file path within the storage
+        checkpoint_store: the store of the checkpoints. Without a checkpoint, the whole file is read.
+        max_bytes: the maximum number of bytes read, the rest is read by later calls
+        complete_lines: if True, only data up to the last line feed is read, so that a line
+                        which is still being written is read completely by a later call.
+                        A line longer than `max_bytes` is read completely.
+        save: if True, the new checkpoint is saved before returning. Use False to save
+              `NewData.checkpoint` only after the data was processed.
+
+    Returns:
+        The new data and the checkpoint after it
+    """
+    from .client import StorageClient
+
+    client = StorageClient(storage)
+    key = checkpoint_key(storage, path)
+    checkpoint = checkpoint_store.load(key)
+
+    size = client.file_size(path)
+    identity = file_identity(storage, path)
+    rotated = False
+    offset = 0
+    if checkpoint:
+        offset = checkpoint.offset
+        if (size < offset
+                or (identity and checkpoint.identity and identity != checkpoint.identity)
+                or (checkpoint.fingerprint_size
+                    and _fingerprint(client.read_range(path, 0, checkpoint.fingerprint_size)) != checkpoint.fingerprint)):
+            offset, rotated = 0, True
+
+    end = size if max_bytes is None else min(size, offset + max_bytes)
+    data = client.read_range(path, offset, end - offset) if end > offset else b''
+    if complete_lines:
+        newline = data.rfind(b'\n')
+        while newline < 0 and end < size:
+            # a line longer than `max_bytes`: read on until it ends
+            more = client.read_range(path, end, min(max(len(data), 1), size - end))
+            if not more:
+                break
+            newline = more.find(b'\n')
+            if newline >= 0:
+                newline += len(data)
+            data += more
+            end += len(more)
+        data = data[:newline + 1]
+    new_offset = offset + len(data)
+
+    if checkpoint and not rotated and checkpoint.fingerprint_size >= min(FINGERPRINT_SIZE, new_offset):
+        fingerprint, fingerprint_size = checkpoint.fingerprint, checkpoint.fingerprint_size
+    else:
+        fingerprint_size = min(FINGERPRINT_SIZE, new_offset)
+        head = data[:fingerprint_size] if offset == 0 else client.read_range(path, 0, fingerprint_size)
+        fingerprint = _fingerprint(head) if fingerprint_size else None
+
+    new_checkpoint = Checkpoint(new_offset, identity, fingerprint, fingerprint_size)
+    if save and new_checkpoint != checkpoint:
+        checkpoint_store.save(key, new_checkpoint)
+    return NewData(data, new_checkpoint, rotated)
+
+
+def _fingerprint(head: bytes) -> str:
+    return hashlib.sha1(head).hexdigest()
+
+
+@singledispatch
+def file_identity(storage: object, path: str) -> t.Optional[str]:
+    """
+    Returns a string which changes when a file is replaced by another one with the same path,
+    None when the storage provides none
+    """
+    return None
+
+
+@file_identity.register(str)
+def __(alias: str, path: str) -> t.Optional[str]:
+    return file_identity(storages.storage(alias), path)
+
+
+@file_identity.register(storages.LocalStorage)
+def __(storage: storages.LocalStorage, path: str) -> t.Optional[str]:
+    stat = os.stat(storage.base_path.absolute() / path)
+    return f'{stat.st_dev}:{stat.st_ino}'
+
+
+@file_identity.register(storages.AzureStorage)
+def __(storage: storages.AzureStorage, path: str) -> t.Optional[str]:
+    # appending a block to an append blob keeps its creation time
+    from .client import StorageClient
+    return StorageClient(storage).creation_timestamp(path).isoformat()
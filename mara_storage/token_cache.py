@@ -0,0 +1,240 @@
+"""
+A cache for access tokens shared by all processes on a machine
+
+Mara runs each task in its own process. Without a shared cache, each process fetches a
+fresh access token for each storage. The cache keeps the tokens in files in
+`config.token_cache_directory`, one per credential, guarded by file locks so that only
+one process fetches a new token while the others wait for it. Tokens are refreshed
+`refresh_ahead` seconds before they expire.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import typing as t
+import urllib.parse
+import urllib.request
+
+from mara_storage import storages
+
+try:
+    import fcntl
+except ImportError:
+    # not POSIX: processes do not wait for each other, a token is then sometimes fetched twice
+    fcntl = None
+
+
+class TokenCache:
+    def __init__(self, directory: str, refresh_ahead: float = 300):
+        """
+        An access token cache in a directory
+
+        Args:
+            directory: the directory holding the tokens. Created with permissions 0700 when it does not exist.
+            refresh_ahead: the number of seconds before expiry after which a new token is fetched
+        """
+        self.directory = directory
+        self.refresh_ahead = refresh_ahead
+
+        # tokens already read in this process, key -> (token, expiry)
+        self._tokens: t.Dict[str, t.Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def token(self, key: str, fetch: t.Callable[[], t.Tuple[str, float]]) -> t.Tuple[str, float]:
+        """
+        Returns a valid token from the cache, or fetches, caches and returns a new one
+
+        Args:
+            key: the identity of the credential, e.g. the service account e-mail and the scopes
+            fetch: a function fetching a new token, returns the token and its expiry as Unix timestamp
+
+        Returns:
+            A tuple `(token, expiry)`
+        """
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached and self._valid(cached):
+                return cached
+
+            path = self._path(key)
+            cached = self._read(path)
+            if not cached or not self._valid(cached):
+                with self._file_lock(path + '.lock'):
+                    # another process might have fetched a token while we waited for the lock
+                    cached = self._read(path)
+                    if not cached or not self._valid(cached):
+                        cached = tuple(fetch())
+                        self._write(path, cached)
+
+            self._tokens[key] = cached
+            return cached
+
+    def _valid(self, cached: t.Tuple[str, float]) -> bool:
+        return cached[1] - self.refresh_ahead > time.time()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    @staticmethod
+    def _read(path: str) -> t.Optional[t.Tuple[str, float]]:
+        try:
+            with open(path) as f:
+                content = json.load(f)
+            return content['token'], float(content['expiry'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write(self, path: str, cached: t.Tuple[str, float]):
+        # write to a temporary file first, so that readers never see a partially written token
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, prefix='.token-')
+        try:
+            with os.fdopen(file_descriptor, 'w') as f:
+                json.dump({'token': cached[0], 'expiry': cached[1]}, f)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    @contextlib.contextmanager
+    def _file_lock(self, path: str):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        if not fcntl:
+            yield
+            return
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_token_caches: t.Dict[str, TokenCache] = {}
+
+
+def token(key: str, fetch: t.Callable[[], t.Tuple[str, float]]) -> t.Tuple[str, float]:
+    """
+    Returns a token from the cache in `config.token_cache_directory`. Calls `fetch` when
+    the cache is disabled.
+
+    Args:
+        key: the identity of the credential, e.g. the service account e-mail and the scopes
+        fetch: a function fetching a new token, returns the token and its expiry as Unix timestamp
+
+    Returns:
+        A tuple `(token, expiry)`
+    """
+    from . import config
+
+    directory = config.token_cache_directory()
+    if not directory:
+        return tuple(fetch())
+    if directory not in _token_caches:
+        _token_caches[directory] = TokenCache(directory)
+    return _token_caches[directory].token(key, fetch)
+
+
+# -----------------------------------------------------------------------------
+
+
+def cache_google_credentials(credentials):
+    """
+    Makes `google.oauth2.service_account.Credentials` take their access token from the cache
+
+    Args:
+        credentials: the credentials, with scopes applied
+
+    Returns:
+        The credentials
+    """
+    import datetime
+
+    key = 'google:' + json.dumps([credentials.service_account_email, sorted(credentials.scopes or [])])
+    refresh = credentials.refresh
+
+    def cached_refresh(request):
+        def fetch() -> t.Tuple[str, float]:
+            refresh(request)
+            # google-auth uses naive datetimes in UTC
+            return credentials.token, credentials.expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+        credentials.token, expiry = token(key, fetch)
+        credentials.expiry = datetime.datetime.utcfromtimestamp(expiry)
+
+    credentials.refresh = cached_refresh
+    return credentials
+
+
+AZURE_STORAGE_SCOPE = 'https://storage.azure.com/.default'
+
+
+def azure_service_principal_token(storage: storages.AzureStorage, cache: TokenCache = None) -> t.Tuple[str, float]:
+    """
+    Returns an access token of the service principal of an Azure storage
+
+    Args:
+        storage: the storage
+        cache: the cache to take the token from, by default the one in `config.token_cache_directory`
+
+    Returns:
+        A tuple `(token, expiry)`
+    """
+    def fetch() -> t.Tuple[str, float]:
+        request = urllib.request.Request(
+            f'https://login.microsoftonline.com/{urllib.parse.quote(storage.spa_tenant)}/oauth2/v2.0/token',
+            data=urllib.parse.urlencode({'grant_type': 'client_credentials',
+                                         'client_id': storage.spa_application,
+                                         'client_secret': storage.spa_client_secret,
+                                         'scope': AZURE_STORAGE_SCOPE}).encode())
+        start = time.time()
+        with urllib.request.urlopen(request, timeout=60) as response:
+            content = json.load(response)
+        return content['access_token'], start + float(content['expires_in'])
+
+    key = _azure_service_principal_key(storage)
+    return cache.token(key, fetch) if cache else token(key, fetch)
+
+
+def _azure_service_principal_key(storage: storages.AzureStorage) -> str:
+    return 'azure:' + json.dumps([storage.spa_tenant, storage.spa_application, AZURE_STORAGE_SCOPE])
+
+
+def azcopy_token_info_command(storage: storages.AzureStorage, directory: str) -> str:
+    """
+    Returns a shell command printing the `AZCOPY_OAUTH_TOKEN_INFO` of the service principal of an
+    Azure storage, with the access token from the cache in `directory`
+
+    The token is only fetched when the command runs. The client secret is passed via the
+    environment variable `AZCOPY_SPA_CLIENT_SECRET`, which is set by the command.
+    """
+    import shlex
+
+    return (f'AZCOPY_SPA_CLIENT_SECRET="{storage.spa_client_secret}" '
+            + f'{shlex.quote(sys.executable)} -m mara_storage.token_cache '
+            + ' '.join(shlex.quote(argument) for argument in [directory, storage.spa_tenant, storage.spa_application]))
+
+
+def _print_azcopy_token_info(directory: str, tenant: str, application: str) -> int:
+    storage = storages.AzureStorage(account_name=None, container_name=None, spa_tenant=tenant,
+                                    spa_application=application,
+                                    spa_client_secret=os.environ['AZCOPY_SPA_CLIENT_SECRET'])
+    access_token, expiry = azure_service_principal_token(storage, TokenCache(directory))
+    print(json.dumps({'access_token': access_token,
+                      'refresh_token': '',
+                      'expires_on': str(int(expiry)),
+                      'resource': 'https://storage.azure.com',
+                      'token_type': 'Bearer',
+                      '_tenant': tenant,
+                      '_application_id': application,
+                      # lets azcopy refresh the token itself via AZCOPY_SPA_CLIENT_SECRET in long running commands
+                      '_token_refresh_source': 'secret'}))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_print_azcopy_token_info(*sys.argv[1:]))
@@ -0,0 +1,568 @@
+"""
+Watching storages for changed files
+
+`watch` yields a `Change` whenever a file matching a pattern is created, modified or
+deleted, and `wait_for_file` waits until a matching file exists. They replace sensors
+polling `info.file_exists`. The changes come from a change source:
+
+- `InotifySource`: local storages on Linux. The kernel reports the changed files, nothing
+  is listed after the initial scan.
+- `PollingSource`: all other storages. The files are listed with one cheap listing
+  (`StorageClient.iterate_file_infos`) per poll and compared by etag (generation), size and
+  modification time to the previous listing. The interval grows while nothing changes.
+- `NotificationSource`: bucket notifications (Google Cloud Storage Pub/Sub notifications,
+  Azure Event Grid events) read from a queue, see `config.change_notifications`.
+
+Example:
+    for change in watch('data', 'incoming/*.csv'):
+        if change.kind != DELETED:
+            load(change.file_info.name)
+
+    if not wait_for_file('partner-sftp', 'export/2026-10-19/_SUCCESS', timeout=3600):
+        raise TimeoutError('export not delivered')
+"""
+
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import fnmatch
+import functools
+import glob
+import json
+import os
+import queue as queue_module
+import select
+import struct
+import sys
+import time
+import typing as t
+
+from mara_storage import config, storages
+from mara_storage.client import FileInfo
+
+CREATED = 'created'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+
+
+class Change(t.NamedTuple):
+    """A change of a file"""
+    kind: str  # `CREATED`, `MODIFIED` or `DELETED`
+    file_info: FileInfo  # for deleted files, the last known information
+
+
+class ChangeSource:
+    """Base class for sources of changes of the files matching a pattern. A source is used by one watch."""
+
+    def start(self) -> t.List[FileInfo]:
+        """Starts watching and returns the files matching the pattern now"""
+        raise NotImplementedError
+
+    def wait(self, timeout: t.Optional[float]) -> t.List[Change]:
+        """Waits at most `timeout` seconds (None: without limit) for changes, returns an empty list when there were none"""
+        raise NotImplementedError
+
+    def close(self):
+        """Stops watching"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def watch(storage: t.Union[str, storages.Storage], file_pattern: str, source: ChangeSource = None,
+          include_existing: bool = False, timeout: float = None) -> t.Iterator[Change]:
+    """
+    Yields the changes of the files matching a pattern
+
+    Args:
+        storage: the storage alias or configuration
+        file_pattern: the file pattern as passed to `StorageClient.iterate_file_infos`. On
+                      Google Cloud Storage and Azure, a prefix.
+        source: the source of the changes. Default: a `NotificationSource` when
+                `config.change_notifications` returns a queue for the storage, otherwise
+                the result of `change_source`.
+        include_existing: if True, a `CREATED` change is yielded first for each file which exists already
+        timeout: the number of seconds after which the iteration ends, None to watch forever
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    if source is None:
+        alias = storage if isinstance(storage, str) else storages.alias(storage)
+        notifications = config.change_notifications(alias)
+        source = (NotificationSource(storage, file_pattern, notifications) if notifications is not None
+                  else change_source(storage, file_pattern))
+
+    with source:
+        existing = source.start()
+        if include_existing:
+            for file_info in existing:
+                yield Change(CREATED, file_info)
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            yield from source.wait(remaining)
+
+
+def wait_for_file(storage: t.Union[str, storages.Storage], file_pattern: str, timeout: float = None,
+                  source: ChangeSource = None) -> t.Optional[FileInfo]:
+    """
+    Waits until a file matching a pattern exists
+
+    Args:
+        storage: the storage alias or configuration
+        file_pattern: the file pattern, see `watch`
+        timeout: the maximum number of seconds to wait, None to wait forever
+        source: the source of the changes, see `watch`
+
+    Returns:
+        The file, None when no file appeared within `timeout` seconds
+    """
+    for change in watch(storage, file_pattern, source=source, include_existing=True, timeout=timeout):
+        if change.kind != DELETED:
+            return change.file_info
+    return None
+
+
+@functools.singledispatch
+def change_source(storage: object, file_pattern: str) -> ChangeSource:
+    """Returns the default change source for a storage"""
+    return PollingSource(storage, file_pattern)
+
+
+@change_source.register(str)
+def __(alias: str, file_pattern: str) -> ChangeSource:
+    return change_source(storages.storage(alias), file_pattern)
+
+
+@change_source.register(storages.LocalStorage)
+def __(storage: storages.LocalStorage, file_pattern: str) -> ChangeSource:
+    if _inotify() is None:
+        return PollingSource(storage, file_pattern)
+    return InotifySource(storage, file_pattern)
+
+
+def _changed(file_info: FileInfo, previous: FileInfo) -> bool:
+    """Whether a file differs from a previously seen version, by etag or else by size and modification time"""
+    if file_info.etag and previous.etag:
+        return file_info.etag.strip('"') != previous.etag.strip('"')
+    return file_info.size != previous.size or file_info.last_modified != previous.last_modified
+
+
+# -----------------------------------------------------------------------------
+
+
+class PollingSource(ChangeSource):
+    def __init__(self, storage: t.Union[str, storages.Storage], file_pattern: str,
+                 min_interval: float = 1.0, max_interval: float = 60.0, backoff: float = 1.5):
+        """
+        Finds changes by comparing successive listings
+
+        The listings are kept in `listing.FileListing`, so that also large listings take
+        little memory and are compared in one merge pass. After a change, the files are
+        listed again after `min_interval` seconds. The interval grows by the factor `backoff`
+        with each listing without changes up to `max_interval` seconds, and is never shorter
+        than the last listing took.
+
+        Args:
+            storage: the storage alias or configuration
+            file_pattern: the pattern passed to `StorageClient.iterate_file_infos`
+            min_interval: the number of seconds between listings after a change
+            max_interval: the maximum number of seconds between listings
+            backoff: the factor by which the interval grows while nothing changes
+        """
+        from .client import StorageClient
+
+        self.file_pattern = file_pattern
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self._client = StorageClient(storage)
+        self._listing = None
+        self._next_poll = 0.0
+
+    def start(self) -> t.List[FileInfo]:
+        self._listing = self._list()
+        self._next_poll = time.monotonic() + self.interval
+        return list(self._listing)
+
+    def wait(self, timeout: t.Optional[float]) -> t.List[Change]:
+        delay = self._next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(delay if timeout is None else min(delay, timeout))
+            if time.monotonic() < self._next_poll:
+                return []
+        return self.poll()
+
+    def poll(self) -> t.List[Change]:
+        """Lists the files now and returns the changes since the last listing"""
+        start = time.monotonic()
+        listing = self._list()
+        duration = time.monotonic() - start
+
+        created = listing.difference(self._listing)
+        created_names = set(created.names())
+        changes = [Change(CREATED, file_info) for file_info in created]
+        changes += [Change(MODIFIED, file_info) for file_info in listing.difference(self._listing, compare_content=True)
+                    if file_info.name not in created_names]
+        changes += [Change(DELETED, file_info) for file_info in self._listing.difference(listing)]
+        self._listing = listing
+
+        self.interval = self.min_interval if changes else min(self.interval * self.backoff, self.max_interval)
+        self._next_poll = time.monotonic() + max(self.interval, duration)
+        return changes
+
+    def _list(self):
+        from .listing import FileListing
+        return FileListing(self._client.iterate_file_infos(self.file_pattern))
+
+
+# -----------------------------------------------------------------------------
+
+
+class NotificationSource(ChangeSource):
+    def __init__(self, storage: t.Union[str, storages.Storage], file_pattern: str, queue: 'queue_module.Queue',
+                 parse: t.Callable[[object], t.Optional[Change]] = None):
+        """
+        Takes changes from bucket notifications in a queue
+
+        The queue is filled by the consumer of the notifications, e.g. the callback of a
+        Google Cloud Pub/Sub subscriber or a function receiving Azure Event Grid events,
+        which puts the messages (or events) into the queue and acknowledges them.
+        Notifications are delivered at least once, so notifications which do not change
+        the known state of a file are dropped.
+
+        Args:
+            storage: the storage alias or configuration
+            file_pattern: the file pattern. Notifications for other files are ignored.
+            queue: any object with the `get` method of `queue.Queue`
+            parse: converts a message to a change, None to ignore the message. Default:
+                   `parse_notification` for the storage.
+        """
+        from .client import StorageClient
+
+        self.storage = storages.storage(storage) if isinstance(storage, str) else storage
+        self.file_pattern = file_pattern
+        self.queue = queue
+        self.parse = parse or functools.partial(parse_notification, self.storage)
+        self._client = StorageClient(storage)
+        self._files: t.Dict[str, FileInfo] = {}
+
+    def start(self) -> t.List[FileInfo]:
+        from .listing import glob_regex
+        from .sharding import _prefix_patterns
+
+        if _prefix_patterns(self.storage):
+            self._matches = lambda name: name.startswith(self.file_pattern)
+        else:
+            self._matches = lambda name, regex=glob_regex(self.file_pattern): bool(regex.fullmatch(name))
+        self._files = {file_info.name: file_info for file_info in self._client.iterate_file_infos(self.file_pattern)}
+        return list(self._files.values())
+
+    def wait(self, timeout: t.Optional[float]) -> t.List[Change]:
+        messages = []
+        try:
+            messages.append(self.queue.get(timeout=timeout))
+            while True:
+                messages.append(self.queue.get(block=False))
+        except queue_module.Empty:
+            pass
+
+        changes = []
+        for message in messages:
+            change = self.parse(message)
+            if change is None or not self._matches(change.file_info.name):
+                continue
+            name = change.file_info.name
+            known = self._files.get(name)
+            if change.kind == DELETED:
+                if known:
+                    changes.append(Change(DELETED, self._files.pop(name)))
+            elif not known or _changed(change.file_info, known):
+                self._files[name] = change.file_info
+                changes.append(Change(MODIFIED if known else CREATED, change.file_info))
+        return changes
+
+
+@functools.singledispatch
+def parse_notification(storage: object, message: object) -> t.Optional[Change]:
+    """
+    Converts a notification message about a storage to a change, None for messages which are
+    not about a change of a file of the storage. By default, messages are expected to be `Change` tuples.
+    """
+    return message
+
+
+@parse_notification.register(storages.GoogleCloudStorage)
+def __(storage: storages.GoogleCloudStorage, message: object) -> t.Optional[Change]:
+    """
+    Parses a Pub/Sub notification of Cloud Storage, a `google.cloud.pubsub_v1` message or a dict
+    with the keys `attributes` and `data` (the JSON object resource)
+    """
+    attributes, data = ((message['attributes'], message.get('data')) if isinstance(message, dict)
+                        else (message.attributes, message.data))
+    if attributes.get('bucketId') != storage.bucket_name:
+        return None
+    event_type = attributes.get('eventType')
+    resource = json.loads(data) if isinstance(data, (str, bytes)) and data else (data or {})
+    file_info = FileInfo(name=attributes['objectId'],
+                         size=int(resource['size']) if 'size' in resource else None,
+                         last_modified=_parse_timestamp(resource.get('updated')),
+                         etag=resource.get('etag'))
+    if event_type == 'OBJECT_FINALIZE':
+        return Change(MODIFIED if attributes.get('overwroteGeneration') else CREATED, file_info)
+    if event_type in ('OBJECT_DELETE', 'OBJECT_ARCHIVE') and not attributes.get('overwrittenByGeneration'):
+        # an overwritten object is reported by the notification of the new generation
+        return Change(DELETED, file_info)
+    return None
+
+
+@parse_notification.register(storages.AzureStorage)
+def __(storage: storages.AzureStorage, message: object) -> t.Optional[Change]:
+    """Parses an Event Grid event of Blob Storage, a dict or its JSON (Event Grid or CloudEvents schema)"""
+    event = json.loads(message) if isinstance(message, (str, bytes)) else message
+    event_type = event.get('eventType') or event.get('type')
+    prefix = f'/blobServices/default/containers/{storage.container_name}/blobs/'
+    source = event.get('topic') or event.get('source') or ''
+    if (not event.get('subject', '').startswith(prefix)
+            or (source and not source.endswith(f'/storageAccounts/{storage.account_name}'))):
+        return None
+    data = event.get('data') or {}
+    file_info = FileInfo(name=event['subject'][len(prefix):], size=data.get('contentLength'), etag=data.get('eTag'))
+    if event_type == 'Microsoft.Storage.BlobCreated':
+        return Change(CREATED, file_info)
+    if event_type == 'Microsoft.Storage.BlobDeleted':
+        return Change(DELETED, file_info)
+    return None
+
+
+def _parse_timestamp(value: t.Optional[str]) -> t.Optional[datetime.datetime]:
+    """Parses a UTC timestamp of Cloud Storage like `2026-10-19T08:15:00.123Z`"""
+    if not value:
+        return None
+    seconds, _, fraction = value.rstrip('Z').partition('.')
+    timestamp = datetime.datetime.strptime(seconds, '%Y-%m-%dT%H:%M:%S')
+    return timestamp.replace(microsecond=int((fraction + '000000')[:6]), tzinfo=datetime.timezone.utc)
+
+
+# -----------------------------------------------------------------------------
+
+
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_ISDIR = 0x40000000
+
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+@functools.lru_cache(maxsize=None)
+def _inotify() -> t.Optional[ctypes.CDLL]:
+    """Returns the C library when it provides inotify, else None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifySource(ChangeSource):
+    def __init__(self, storage: t.Union[str, storages.Storage], file_pattern: str):
+        """
+        Gets the changes of files on a local storage from the Linux kernel (inotify)
+
+        All directories which can contain matching files are watched, also the directories
+        on the literal part of the pattern, so that directories created later are watched
+        as well. Files are reported when they are closed after writing or moved into a
+        watched directory, not while they are still being written.
+
+        Args:
+            storage: the storage alias or configuration of a local storage
+            file_pattern: the glob pattern, with the semantics of `local_storage.walk`
+        """
+        self.storage = storages.storage(storage) if isinstance(storage, str) else storage
+        self.file_pattern = file_pattern
+        self._segments = tuple(segment for segment in file_pattern.split('/') if segment)
+        self._root = str(self.storage.base_path.absolute())
+        self._libc = _inotify()
+        self._fd = None
+        self._directories: t.Dict[int, t.Tuple[str, ...]] = {}  # watch descriptor -> relative directory
+        self._files: t.Dict[str, FileInfo] = {}
+
+    def start(self) -> t.List[FileInfo]:
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._files = {file_info.name: file_info for file_info in self._watch_tree(())}
+        return list(self._files.values())
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def wait(self, timeout: t.Optional[float]) -> t.List[Change]:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        changes = []
+        for wd, mask, name in self._read_events():
+            if mask & _IN_Q_OVERFLOW:
+                changes += self._rescan()
+                continue
+            if mask & _IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None or not name:
+                continue
+            parts = directory + (name,)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    if not _may_contain_matches(parts, self._segments):
+                        continue
+                    changes += [change for file_info in self._watch_tree(parts) for change in self._update(file_info)]
+                elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                    changes += self._remove_tree(parts, unwatch=bool(mask & _IN_MOVED_FROM))
+            elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                if _matches(parts, self._segments):
+                    file_info = self._file_info(parts)
+                    changes += self._update(file_info) if file_info else self._remove('/'.join(parts))
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                changes += self._remove('/'.join(parts))
+        return changes
+
+    def _read_events(self) -> t.Iterator[t.Tuple[int, int, str]]:
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(buffer[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                yield wd, mask, name
+
+    def _watch_tree(self, parts: t.Tuple[str, ...]) -> t.List[FileInfo]:
+        """Watches a directory and its subdirectories which can contain matches, returns the matching files in them"""
+        path = os.path.join(self._root, *parts)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # removed in the meantime
+                return []
+            raise OSError(error, os.strerror(error), path)
+        self._directories[wd] = parts
+
+        segment = self._segments[len(parts)] if len(parts) < len(self._segments) else '**'
+        if not glob.has_magic(segment) and '**' not in self._segments[:len(parts)]:
+            # literal segment: no need to scan the directory
+            names = [segment] if os.path.lexists(os.path.join(path, segment)) else []
+        else:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                return []
+
+        file_infos = []
+        for name in names:
+            child = parts + (name,)
+            if os.path.isdir(os.path.join(path, name)):
+                if _may_contain_matches(child, self._segments):
+                    file_infos += self._watch_tree(child)
+            elif _matches(child, self._segments):
+                file_info = self._file_info(child)
+                if file_info:
+                    file_infos.append(file_info)
+        return file_infos
+
+    def _file_info(self, parts: t.Tuple[str, ...]) -> t.Optional[FileInfo]:
+        try:
+            stat = os.stat(os.path.join(self._root, *parts))
+        except OSError:
+            return None
+        return FileInfo(name='/'.join(parts), size=stat.st_size,
+                        last_modified=datetime.datetime.fromtimestamp(stat.st_mtime).astimezone())
+
+    def _update(self, file_info: FileInfo) -> t.List[Change]:
+        known = self._files.get(file_info.name)
+        if known and not _changed(file_info, known):
+            return []
+        self._files[file_info.name] = file_info
+        return [Change(MODIFIED if known else CREATED, file_info)]
+
+    def _remove(self, name: str) -> t.List[Change]:
+        known = self._files.pop(name, None)
+        return [Change(DELETED, known)] if known else []
+
+    def _remove_tree(self, parts: t.Tuple[str, ...], unwatch: bool) -> t.List[Change]:
+        """Handles a removed directory: its files are deleted, watches of moved directories are removed"""
+        if unwatch:
+            for wd, directory in list(self._directories.items()):
+                if directory[:len(parts)] == parts:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    del self._directories[wd]
+        prefix = '/'.join(parts) + '/'
+        return [change for name in [name for name in self._files if name.startswith(prefix)]
+                for change in self._remove(name)]
+
+    def _rescan(self) -> t.List[Change]:
+        """Watches and scans everything again after events were lost"""
+        for wd in list(self._directories):
+            self._libc.inotify_rm_watch(self._fd, wd)
+        self._directories = {}
+        file_infos = self._watch_tree(())
+        names = {file_info.name for file_info in file_infos}
+        changes = [change for name in [name for name in self._files if name not in names]
+                   for change in self._remove(name)]
+        return changes + [change for file_info in file_infos for change in self._update(file_info)]
+
+
+def _matches(parts: t.Sequence[str], segments: t.Sequence[str]) -> bool:
+    """Whether a relative path matches the pattern segments, with the semantics of `local_storage.walk`"""
+    if not segments:
+        return not parts
+    segment, remaining = segments[0], segments[1:]
+    if segment == '**':
+        if remaining and _matches(parts, remaining):
+            return True
+        if not parts or parts[0].startswith('.'):
+            return False
+        return not remaining and len(parts) == 1 or _matches(parts[1:], segments)
+    if not parts or (parts[0].startswith('.') and not segment.startswith('.')):
+        return False
+    return fnmatch.fnmatch(parts[0], segment) and _matches(parts[1:], remaining)
+
+
+def _may_contain_matches(parts: t.Sequence[str], segments: t.Sequence[str]) -> bool:
+    """Whether files below a relative directory can match the pattern segments"""
+    for i, part in enumerate(parts):
+        if i < len(segments) and segments[i] == '**':
+            return not any(part.startswith('.') for part in parts[i:])
+        if i >= len(segments) - 1:
+            return False
+        segment = segments[i]
+        if (part.startswith('.') and not segment.startswith('.')) or not fnmatch.fnmatch(part, segment):
+            return False
+    return True
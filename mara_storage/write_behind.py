@@ -0,0 +1,224 @@
+"""
+Write-behind uploads through a local spool directory
+
+Producers write files to a local spool directory at disk speed while background workers
+upload them to the storage. When the spooled files take more than `max_spool_bytes`,
+producers wait until uploads have finished (backpressure). The spool files of failed
+uploads are kept and listed in the manifest `failed-uploads.tsv` in the spool directory.
+
+Example:
+    with WriteBehindWriter('data') as writer:
+        for day, rows in extract():
+            with writer.open(f'export/{day}.csv') as f:
+                f.write(rows)
+    # all files are uploaded here
+"""
+
+import concurrent.futures
+import contextlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import typing as t
+
+from mara_storage import execution, storages
+from mara_storage.client import StorageClient
+
+# the file in the spool directory listing the failed uploads, one `<spool file>\t<path>` line each
+MANIFEST_FILE_NAME = 'failed-uploads.tsv'
+
+
+class WriteBehindWriter:
+    def __init__(self, storage: t.Union[str, storages.Storage], spool_directory: str = None, max_workers: int = 4,
+                 max_spool_bytes: int = 1024 ** 3, max_pending_files: int = None):
+        """
+        Writes files to a storage asynchronously
+
+        Uploads are done with `StorageClient.upload_file`. Files with the same path are
+        uploaded in the order they were written.
+
+        Args:
+            storage: the storage alias or configuration
+            spool_directory: the local directory for the files waiting for upload. By default
+                             a temporary directory, which is removed by `close`.
+            max_workers: the number of files uploaded at the same time
+            max_spool_bytes: producers wait while the files waiting for upload take more bytes
+            max_pending_files: producers wait while more files wait for upload, by default 4 per worker
+        """
+        self.storage = storages.storage(storage) if isinstance(storage, str) else storage
+        self.max_spool_bytes = max_spool_bytes
+        self.max_pending_files = max_pending_files or 4 * max_workers
+
+        self._own_spool_directory = spool_directory is None
+        self.spool_directory = spool_directory or tempfile.mkdtemp(prefix='mara-storage-spool-')
+        os.makedirs(self.spool_directory, exist_ok=True)
+
+        self._client = StorageClient(self.storage)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='write-behind')
+        self._condition = threading.Condition()
+        self._pending_bytes = 0
+        self._pending_files = 0
+        # the last upload of each path, so that a later upload of the same path waits for it
+        self._last_uploads: t.Dict[str, concurrent.futures.Future] = {}
+        self._errors: t.List[t.Tuple[str, Exception]] = []
+        self._closed = False
+
+    @property
+    def pending_files(self) -> int:
+        """The number of files waiting for upload or being uploaded"""
+        return self._pending_files
+
+    @property
+    def pending_bytes(self) -> int:
+        """The size of the files waiting for upload or being uploaded"""
+        return self._pending_bytes
+
+    @contextlib.contextmanager
+    def open(self, path: str) -> t.Iterator[t.BinaryIO]:
+        """
+        Opens a spool file for writing. The file is queued for upload when the context exits
+        without exception.
+
+        Args:
+            path: the file path within the storage
+        """
+        self._wait_for_space()
+        spool_path = self._spool_path(path)
+        try:
+            with open(spool_path, 'wb') as f:
+                yield f
+        except BaseException:
+            os.unlink(spool_path)
+            raise
+        self._submit(spool_path, path)
+
+    def write_file(self, path: str, data: bytes):
+        """
+        Queues a file for upload
+
+        Args:
+            path: the file path within the storage
+            data: the file content
+        """
+        with self.open(path) as f:
+            f.write(data)
+
+    def add_file(self, local_path: str, path: str):
+        """
+        Queues an existing local file for upload. The writer takes ownership of the file and
+        deletes it after the upload.
+
+        Args:
+            local_path: the local file, ideally within `spool_directory`
+            path: the file path within the storage
+        """
+        try:
+            self._wait_for_space()
+        except BaseException:
+            if not self._closed:
+                # the writer owns the file: it is kept for a later upload
+                with self._condition:
+                    self._record_failure(local_path, path)
+            raise
+        self._submit(local_path, path)
+
+    def flush(self):
+        """
+        Waits until all files written so far are uploaded
+
+        Raises:
+            The exception of the first failed upload since the last flush. The other files are
+            still uploaded. The spool files of failed uploads are kept and listed in the manifest
+            `MANIFEST_FILE_NAME` in the spool directory.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending_files == 0)
+            errors, self._errors = self._errors, []
+        if errors:
+            for path, error in errors[1:]:
+                logging.getLogger(__name__).error(f'Upload of "{path}" failed: {error}')
+            raise errors[0][1]
+
+    def close(self):
+        """
+        Waits until all files are uploaded and stops the workers. When uploads failed, the
+        spool directory is kept with the manifest `MANIFEST_FILE_NAME`.
+        """
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            self._executor.shutdown(wait=True)
+            if self._own_spool_directory and not os.listdir(self.spool_directory):
+                shutil.rmtree(self.spool_directory, ignore_errors=True)
+
+    def __enter__(self) -> 'WriteBehindWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # the uploads are still finished, but must not hide the original exception
+            try:
+                self.close()
+            except Exception:
+                logging.getLogger(__name__).exception('Upload failed')
+
+    def _wait_for_space(self):
+        if self._closed:
+            raise ValueError('The writer is closed')
+        with self._condition:
+            self._condition.wait_for(lambda: self._errors or (self._pending_bytes < self.max_spool_bytes
+                                                              and self._pending_files < self.max_pending_files))
+            if self._errors:
+                # stop producers early, the error is raised (again) by `flush`
+                raise self._errors[0][1]
+
+    def _spool_path(self, path: str) -> str:
+        file_descriptor, spool_path = tempfile.mkstemp(dir=self.spool_directory,
+                                                       suffix='-' + os.path.basename(path))
+        os.close(file_descriptor)
+        return spool_path
+
+    def _submit(self, spool_path: str, path: str):
+        size = os.path.getsize(spool_path)
+        with self._condition:
+            self._pending_bytes += size
+            self._pending_files += 1
+            previous_upload = self._last_uploads.get(path)
+            # the previous upload was submitted before and is therefore running or done
+            future = self._executor.submit(execution.bind(self._upload), spool_path, path, size, previous_upload)
+            self._last_uploads[path] = future
+            future.add_done_callback(lambda future: self._forget(path, future))
+
+    def _upload(self, spool_path: str, path: str, size: int, previous_upload: t.Optional[concurrent.futures.Future]):
+        try:
+            if previous_upload:
+                concurrent.futures.wait([previous_upload])
+            self._client.upload_file(spool_path, path)
+            os.unlink(spool_path)
+        except Exception as e:
+            with self._condition:
+                self._errors.append((path, e))
+                self._record_failure(spool_path, path)
+        finally:
+            with self._condition:
+                self._pending_bytes -= size
+                self._pending_files -= 1
+                self._condition.notify_all()
+
+    def _record_failure(self, spool_path: str, path: str):
+        """Adds a file which was not uploaded to the manifest, called with `_condition` held"""
+        with open(os.path.join(self.spool_directory, MANIFEST_FILE_NAME), 'a') as f:
+            f.write(f'{os.path.abspath(spool_path)}\t{path}\n')
+
+    def _forget(self, path: str, future: concurrent.futures.Future):
+        with self._condition:
+            if self._last_uploads.get(path) is future:
+                del self._last_uploads[path]
@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+from mara_storage import storages
+
+pytest.importorskip('azure.storage.blob')
+
+
+@pytest.fixture
+def client():
+    import azure.storage.blob
+    from benchmarks import emulators
+    from mara_storage.azure import AzureStorageClient
+
+    with emulators.FakeAzureBlobServer() as server:
+        storage = storages.AzureStorage(account_name=server.ACCOUNT_NAME, account_key=server.ACCOUNT_KEY,
+                                        container_name='append-test')
+        client = AzureStorageClient(storage)
+        client._AzureStorageClient__blob_service_client = \
+            azure.storage.blob.BlobServiceClient.from_connection_string(server.connection_string)
+        client._container_client.create_container()
+        yield client
+
+
+def blob_names(client) -> list:
+    return [blob.name for blob in client._container_client.list_blobs()]
+
+
+def test_append_to_block_blob(client):
+    client._container_client.upload_blob('events.log', b'a\n')
+    assert client.append('events.log', b'b\n') == 4
+    assert client.append('events.log', io.BytesIO(b'c\n')) == 6
+    assert client.read_file('events.log') == b'a\nb\nc\n'
+    assert client._container_client.get_blob_client('events.log').get_blob_properties().blob_type == 'AppendBlob'
+    assert blob_names(client) == ['events.log']
+
+
+def test_failed_rewrite_keeps_blob(client, monkeypatch):
+    import azure.storage.blob
+
+    client._container_client.upload_blob('events.log', b'a\n')
+
+    def append_block(*args, **kwargs):
+        raise ConnectionError('connection lost')
+
+    monkeypatch.setattr(azure.storage.blob.BlobClient, 'append_block', append_block)
+    with pytest.raises(ConnectionError):
+        client.append('events.log', b'b\n')
+    assert client.read_file('events.log') == b'a\n'
+    assert blob_names(client) == ['events.log']
+
+
+def test_compaction(client, monkeypatch):
+    from mara_storage import azure
+
+    monkeypatch.setattr(azure, 'APPEND_BLOCK_SIZE', 8)
+    monkeypatch.setattr(azure, 'MAX_APPEND_BLOCKS', 4)
+    for data in [b'a\n', b'b\n', b'c\n']:
+        client.append('events.log', data)
+
+    # the stream needs more blocks than are left, the blob is compacted on the way
+    assert client.append('events.log', io.BytesIO(b'd\ne\nf\ng\nh\ni\n')) == 18
+    assert client.read_file('events.log') == b'a\nb\nc\nd\ne\nf\ng\nh\ni\n'
+    properties = client._container_client.get_blob_client('events.log').get_blob_properties()
+    assert properties.blob_type == 'AppendBlob' and properties.append_blob_committed_block_count == 3
+    assert blob_names(client) == ['events.log']
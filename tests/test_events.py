@@ -0,0 +1,74 @@
+import pathlib
+import pytest
+
+from mara_storage import config, events, info, manage, storages
+from mara_storage.client import StorageClient
+
+
+class CollectingEventHandler(events.EventHandler):
+    def __init__(self):
+        self.events = []
+
+    def handle_event(self, event: events.Event):
+        self.events.append(event)
+
+
+@pytest.fixture
+def storage():
+    return storages.LocalStorage(pathlib.Path('tests/test-storage'))
+
+
+@pytest.fixture
+def event_handler(monkeypatch, storage: object):
+    handler = CollectingEventHandler()
+    monkeypatch.setattr(config, 'event_handlers', lambda: [handler])
+    monkeypatch.setattr(config, 'storages', lambda: {'test': storage})
+    storages.storage.cache_clear()
+    yield handler
+    storages.storage.cache_clear()
+
+
+def test_client_operation_events(storage: object, event_handler: CollectingEventHandler):
+    manage.ensure_storage('test')
+    try:
+        (storage.base_path / 'a.txt').write_text('content')
+
+        storage_client = StorageClient('test')
+        assert list(storage_client.iterate_files('*.txt')) == ['a.txt']
+        assert storage_client.read_file('a.txt') == b'content'
+        assert info.file_exists('test', 'a.txt')
+    finally:
+        manage.drop_storage('test', force=True)
+
+    finished = [event for event in event_handler.events if isinstance(event, events.OperationFinished)]
+    assert [event.operation for event in finished] == ['ensure_storage', 'iterate_files', 'read_file',
+                                                       'file_exists', 'drop_storage']
+    assert len(event_handler.events) == 2 * len(finished)
+    assert all(event.alias == 'test' and event.backend == 'LocalStorage' and event.succeeded for event in finished)
+    assert finished[1].path == '*.txt'
+    assert finished[2].path == 'a.txt'
+    assert finished[2].bytes == len('content')
+    assert all(event.duration >= 0 for event in finished)
+
+
+def test_failed_operation_event(storage: object, event_handler: CollectingEventHandler):
+    storage_client = StorageClient(storage)
+    with pytest.raises(FileNotFoundError):
+        storage_client.read_file('does-not-exist.txt')
+
+    finished = event_handler.events[-1]
+    assert isinstance(finished, events.OperationFinished)
+    assert finished.alias is None
+    assert not finished.succeeded
+    assert finished.error
+
+
+def test_logging_event_handler(caplog):
+    handler = events.LoggingEventHandler()
+    with caplog.at_level('INFO', logger='mara_storage.events'):
+        events.notify(events.OperationFinished(alias='test', backend='LocalStorage', operation='read_file', path='a.txt',
+                                               start_time=None, duration=0.5, bytes=10, retries=0, succeeded=True),
+                      handlers=[handler])
+
+    assert '"operation": "read_file"' in caplog.text
+    assert caplog.records[0].storage_bytes == 10
@@ -0,0 +1,187 @@
+import http.server
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from mara_storage import config, events, execution, storages
+from mara_storage.client import StorageClient
+
+
+class ThrottlingServer:
+    """A local HTTP server answering with 429 when more than `capacity` requests run at the same time"""
+
+    def __init__(self, capacity: int, retry_after: str = None):
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.running = 0
+        self.max_running = 0
+        self.throttled = 0
+        self.succeeded = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                with server.lock:
+                    server.running += 1
+                    overloaded = server.running > server.capacity
+                    if overloaded:
+                        server.throttled += 1
+                    else:
+                        server.max_running = max(server.max_running, server.running)
+                try:
+                    if overloaded:
+                        self.send_response(429)
+                        if server.retry_after is not None:
+                            self.send_header('Retry-After', server.retry_after)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                    else:
+                        time.sleep(0.01)  # keep the request running for a moment
+                        self.send_response(200)
+                        self.send_header('Content-Length', '2')
+                        self.end_headers()
+                        self.wfile.write(b'OK')
+                        with server.lock:
+                            server.succeeded += 1
+                finally:
+                    with server.lock:
+                        server.running -= 1
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/'
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def storage():
+    return storages.MemoryStorage('execution-test')
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, 'retry_policy',
+                        lambda: execution.RetryPolicy(max_attempts=50, initial_delay=0.001, max_delay=0.01))
+
+
+def fetch(url: str) -> bytes:
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def test_retry_policy():
+    policy = execution.RetryPolicy(initial_delay=1, max_delay=10, multiplier=2)
+    for attempt in range(10):
+        assert 0 <= policy.delay(attempt) <= min(10, 2 ** attempt)
+    assert policy.delay(0, retry_after=5) >= 5
+    assert policy.delay(0, retry_after=60) == 10
+
+
+def test_is_throttled():
+    assert execution.is_throttled(execution.ThrottledError('busy'))
+    assert not execution.is_throttled(FileNotFoundError())
+
+    error = urllib.error.HTTPError('http://example.com', 503, 'Service Unavailable', {'Retry-After': '3'}, None)
+    assert execution.is_throttled(error)
+    assert execution.retry_after(error) == 3
+    assert not execution.is_throttled(urllib.error.HTTPError('http://example.com', 404, 'Not Found', {}, None))
+
+    assert isinstance(execution.command_error('Stderr:\n', 'AccessDeniedException: 429 Too Many Requests'),
+                      execution.ThrottledError)
+    assert not isinstance(execution.command_error('Stderr:\n', 'No URLs matched'), execution.ThrottledError)
+
+
+def test_adaptive_limiter():
+    limiter = execution.AdaptiveLimiter(initial_limit=4, max_limit=8)
+
+    tokens = [limiter.acquire() for _ in range(4)]
+    assert limiter.in_flight == 4
+
+    # concurrent throttled operations decrease the limit only once
+    for token in tokens:
+        limiter.release(token, throttled=True)
+    assert limiter.limit == 2
+
+    for _ in range(100):
+        limiter.release(limiter.acquire(), throttled=False)
+    assert limiter.limit == 8
+
+    limiter.release(limiter.acquire(), throttled=None)
+    assert limiter.limit == 8
+
+
+def test_execute_retries(storage):
+    with ThrottlingServer(capacity=0, retry_after='0') as server:
+        attempts = []
+
+        def function():
+            attempts.append(1)
+            if len(attempts) == 3:
+                server.capacity = 1
+            return fetch(server.url)
+
+        with events.track(storage, 'fetch') as operation, events._enter(operation):
+            assert execution.execute(storage, function) == b'OK'
+        assert len(attempts) == 3
+        assert operation.retries == 2
+
+        server.capacity = 0
+        with pytest.raises(urllib.error.HTTPError):
+            execution.execute(storage, fetch, server.url)
+
+
+def test_map_concurrently_adapts_to_capacity(storage, monkeypatch):
+    monkeypatch.setattr(execution, '_storage_limiters', execution._storage_limiters.__class__())
+    monkeypatch.setattr(config, 'concurrency_limiter',
+                        lambda alias: execution.AdaptiveLimiter(initial_limit=16, max_limit=32))
+
+    with ThrottlingServer(capacity=4) as server:
+        results = list(execution.map_concurrently(storage, fetch, [server.url] * 200))
+
+    assert results == [b'OK'] * 200
+    assert server.throttled > 0
+    assert server.max_running <= 4
+    assert execution.limiter(storage).limit < 16
+
+
+def test_client_operations_are_retried(storage):
+    attempts = []
+
+    class ThrottledClient(StorageClient):
+        def read_file(self, path: str) -> bytes:
+            attempts.append(path)
+            if len(attempts) < 3:
+                raise execution.ThrottledError('busy', retry_after=0)
+            return b'content'
+
+    assert ThrottledClient(storage).read_file('file.txt') == b'content'
+    assert attempts == ['file.txt'] * 3
+
+
+def test_append_is_limited_but_not_retried(storage):
+    attempts = []
+
+    class ThrottledClient(StorageClient):
+        def append(self, path: str, stream) -> int:
+            attempts.append(execution._active())
+            raise execution.ThrottledError('busy', retry_after=0)
+
+    with pytest.raises(execution.ThrottledError):
+        ThrottledClient(storage).append('file.txt', b'data')
+    # the append ran within the concurrency limit, a repeated append could write the data twice
+    assert attempts == [True]
@@ -58,3 +58,24 @@ def test_last_modification_date(storage: object):
     print(f'datetime.datetime.now().astimezone()={datetime.datetime.now().astimezone()}')
 
     assert (datetime.datetime.now().astimezone() - last_modification_date).total_seconds() <= 10
+
+
+def test_iterate_files(storage: object):
+    assert isinstance(storage, storages.GoogleCloudStorage)
+
+    # prepare
+    command = f'echo "" | {shell.write_file_command(storage, file_name=TEST_TOUCH_FILE_NAME)}'
+    (exitcode, _) = subprocess.getstatusoutput(command)
+    assert exitcode == 0
+
+    #test
+    storage_client = GoogleCloudStorageShellClient(storage)
+
+    files = list(storage_client.iterate_files('*.txt'))
+    assert files == [TEST_TOUCH_FILE_NAME]
+
+    file_infos = list(storage_client.iterate_file_infos('*.txt'))
+    assert len(file_infos) == 1
+    assert file_infos[0].name == TEST_TOUCH_FILE_NAME
+    assert file_infos[0].size == 1
+    assert file_infos[0].last_modified.tzinfo
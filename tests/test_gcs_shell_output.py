@@ -0,0 +1,60 @@
+import datetime
+import os
+import pathlib
+
+import pytest
+
+from mara_storage import storages
+from mara_storage.client import FileInfo
+from mara_storage.google_cloud_storage import GoogleCloudStorageShellClient, _parse_ls_long_line
+
+
+@pytest.fixture
+def gsutil(tmp_path, monkeypatch):
+    """A fake `gsutil` printing the content of `output` and recording its arguments"""
+    directory = pathlib.Path(tmp_path)
+    (directory / 'gsutil').write_text('#!/bin/sh\n'
+                                      f'echo "$@" > {directory}/arguments\n'
+                                      f'cat {directory}/output\n')
+    (directory / 'gsutil').chmod(0o755)
+    monkeypatch.setenv('PATH', f'{directory}{os.pathsep}{os.environ["PATH"]}')
+    return directory
+
+
+def test_parse_ls_long_line():
+    assert _parse_ls_long_line('    2276224  2017-03-14T16:55:28Z  gs://my-bucket/my file.csv') \
+        == FileInfo(name='gs://my-bucket/my file.csv', size=2276224,
+                    last_modified=datetime.datetime(2017, 3, 14, 16, 55, 28, tzinfo=datetime.timezone.utc))
+    assert _parse_ls_long_line('         0  2017-03-14T16:55:28Z  gs://my-bucket/empty.csv').size == 0
+    # 'directories' are listed without size and timestamp
+    assert _parse_ls_long_line('                                 gs://my-bucket/sub/') == FileInfo(name='gs://my-bucket/sub/')
+    assert _parse_ls_long_line('TOTAL: 2 objects, 2276224 bytes (2.17 MiB)') is None
+    assert _parse_ls_long_line('') is None
+
+
+def test_iterate_files(gsutil):
+    (gsutil / 'output').write_text('gs://data/incoming/a.csv\n'
+                                   'gs://data/incoming/b.csv\n')
+    client = GoogleCloudStorageShellClient(storages.GoogleCloudStorage(bucket_name='data'))
+    assert list(client.iterate_files('incoming/*.csv')) == ['incoming/a.csv', 'incoming/b.csv']
+    assert (gsutil / 'arguments').read_text() == 'ls gs://data/incoming/*.csv\n'
+
+
+def test_iterate_file_infos(gsutil):
+    (gsutil / 'output').write_text('        12  2026-10-19T08:15:00Z  gs://data/incoming/a.csv\n'
+                                   '         0  2026-10-19T08:16:30Z  gs://data/incoming/b.csv\n'
+                                   'TOTAL: 2 objects, 12 bytes (12 B)\n')
+    client = GoogleCloudStorageShellClient(storages.GoogleCloudStorage(bucket_name='data'))
+    assert [(file_info.name, file_info.size, file_info.last_modified.isoformat())
+            for file_info in client.iterate_file_infos('incoming/*.csv')] \
+        == [('incoming/a.csv', 12, '2026-10-19T08:15:00+00:00'), ('incoming/b.csv', 0, '2026-10-19T08:16:30+00:00')]
+    assert (gsutil / 'arguments').read_text() == 'ls -l gs://data/incoming/*.csv\n'
+
+
+def test_iterate_directory(gsutil):
+    (gsutil / 'output').write_text('                                 gs://data/incoming/2026/\n'
+                                   '        12  2026-10-19T08:15:00Z  gs://data/incoming/a.csv\n'
+                                   'TOTAL: 1 objects, 12 bytes (12 B)\n')
+    client = GoogleCloudStorageShellClient(storages.GoogleCloudStorage(bucket_name='data'))
+    assert [file_info.name for file_info in client.iterate_directory('incoming')] == ['incoming/2026/', 'incoming/a.csv']
+    assert list(client.iterate_directory('incoming'))[0] == FileInfo('incoming/2026/')
@@ -0,0 +1,134 @@
+import threading
+import time
+
+import pytest
+
+from mara_storage import config, execution, hedging, scheduling, storages
+from mara_storage.client import StorageClient
+
+
+def test_latency_histogram():
+    histogram = hedging.LatencyHistogram()
+    assert histogram.percentile(50) is None
+
+    for _ in range(90):
+        histogram.record(0.01)
+    for _ in range(10):
+        histogram.record(1.0)
+
+    assert histogram.count == 100
+    assert 0.01 <= histogram.percentile(50) < 0.013
+    assert 0.01 <= histogram.percentile(90) < 0.013
+    assert 1.0 <= histogram.percentile(99) < 1.3
+    assert sum(count for _, count in histogram.buckets()) == 100
+
+
+def test_latency_histogram_decay():
+    histogram = hedging.LatencyHistogram(max_samples=100)
+    for _ in range(99):
+        histogram.record(1.0)
+    for _ in range(200):
+        histogram.record(0.01)
+    assert histogram.percentile(90) < 0.013
+
+
+class SlowRequest:
+    """A request which is slow on every `slow_every`-th call"""
+
+    def __init__(self, slow_every: int, slow_latency: float = 2.0):
+        self.slow_every = slow_every
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self.lock:
+            self.calls += 1
+            slow = self.calls % self.slow_every == 0
+        time.sleep(self.slow_latency if slow else 0.001)
+        return 'result'
+
+
+def test_hedger_cuts_tail_latency():
+    hedger = hedging.Hedger(percentile=80, min_samples=5, max_extra_load=0.2)
+    request = SlowRequest(slow_every=10)
+
+    start = time.monotonic()
+    for _ in range(100):
+        assert hedger.call('read_file', request) == 'result'
+    # without hedging, the 10 slow requests would take 20 seconds
+    assert time.monotonic() - start < 2
+    assert hedger.hedged_calls >= 7
+    assert hedger.hedge_wins == hedger.hedged_calls
+    assert 'read_file' in hedger.histograms()
+
+
+def test_hedger_limits_extra_load():
+    hedger = hedging.Hedger(percentile=50, min_samples=5, max_extra_load=0.1)
+    request = SlowRequest(slow_every=2, slow_latency=0.005)
+
+    for _ in range(100):
+        hedger.call('read_file', request)
+    assert hedger.hedged_calls <= 10
+    assert request.calls == 100 + hedger.hedged_calls
+
+
+def test_hedger_raises_when_both_requests_fail():
+    hedger = hedging.Hedger(min_samples=1, max_extra_load=1)
+    hedger.call('read_file', lambda: None)
+
+    def failing():
+        time.sleep(0.05)
+        raise FileNotFoundError('not found')
+
+    with pytest.raises(FileNotFoundError):
+        hedger.call('read_file', failing)
+    assert hedger.hedged_calls == 1
+
+
+def test_hedged_client_method(monkeypatch):
+    storage = storages.MemoryStorage('hedging-test')
+    hedger = hedging.Hedger(min_samples=5)
+    monkeypatch.setattr(config, 'hedger', lambda alias: hedger)
+
+    class Client(StorageClient):
+        @hedging.hedged
+        def read_file(self, path: str) -> bytes:
+            return path.encode()
+
+    client = Client(storage)
+    for _ in range(10):
+        assert client.read_file('file.txt') == b'file.txt'
+    assert hedger.calls == 10
+    assert hedger.histogram('read_file').count == 10
+
+
+def test_hedger_runs_in_calling_thread_when_workers_are_busy():
+    hedger = hedging.Hedger(min_samples=1, min_delay=0.001, max_extra_load=1, max_workers=1)
+    hedger.call('read_file', lambda: None)
+
+    release = threading.Event()
+    blocked = threading.Thread(target=hedger.call, args=('read_file', release.wait))
+    blocked.start()
+    while hedger._running < 1:
+        time.sleep(0.001)
+
+    # a busy worker neither delays the request nor makes it look slow
+    assert hedger.call('read_file', lambda: (time.sleep(0.05), threading.current_thread())[1]) \
+        is threading.current_thread()
+    release.set()
+    blocked.join()
+    assert hedger.hedged_calls == 0
+
+
+def test_hedger_passes_the_context_to_workers():
+    hedger = hedging.Hedger(min_samples=1)
+    hedger.call('read_file', lambda: None)
+
+    def context():
+        return threading.current_thread(), execution._active(), scheduling.current_priority()
+
+    with scheduling.priority(scheduling.LOW), execution._activated():
+        thread, active, priority = hedger.call('read_file', context)
+    assert thread is not threading.current_thread()
+    assert active and priority == scheduling.LOW
@@ -0,0 +1,145 @@
+import datetime
+import pathlib
+import pytest
+
+from mara_storage.client import FileInfo
+from mara_storage.listing import (FileListing, expand_path_template, glob_regex, iterate_file_infos_in_range,
+                                  iterate_files_in_range)
+from mara_storage import storages, manage
+from mara_storage.local_storage import walk
+
+
+@pytest.fixture
+def storage():
+    return storages.LocalStorage(pathlib.Path('tests/test-storage'))
+
+
+@pytest.fixture(autouse=True)
+def test_before_and_after(storage: object):
+    manage.ensure_storage(storage)
+    yield
+    manage.drop_storage(storage, force=True)
+
+
+def test_sorted_lookup():
+    listing = FileListing(['b/2.csv', 'a/1.csv', 'b/1.csv', 'c.csv', 'b'])
+
+    assert len(listing) == 5
+    assert list(listing.names()) == ['a/1.csv', 'b', 'b/1.csv', 'b/2.csv', 'c.csv']
+    assert 'b/1.csv' in listing
+    assert 'b/3.csv' not in listing
+    assert listing.get('c.csv') == FileInfo(name='c.csv')
+    assert listing.get('d.csv') is None
+
+    assert list(listing.with_prefix('b/').names()) == ['b/1.csv', 'b/2.csv']
+    assert list(listing.with_prefix('').names()) == list(listing.names())
+    assert len(listing.with_prefix('x')) == 0
+
+
+def test_file_info_columns():
+    last_modified = datetime.datetime(2023, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    listing = FileListing([FileInfo(name='a.csv', size=10, last_modified=last_modified, etag='abc'),
+                           FileInfo(name='b.csv')])
+
+    assert listing[0] == FileInfo(name='a.csv', size=10, last_modified=last_modified, etag='abc')
+    assert listing[-1] == FileInfo(name='b.csv')
+    assert listing.total_size() == 10
+
+
+def test_difference():
+    last_modified = datetime.datetime(2023, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    old = FileListing([FileInfo(name='a.csv', size=1, etag='1'),
+                       FileInfo(name='b.csv', size=2, last_modified=last_modified)])
+    new = FileListing([FileInfo(name='a.csv', size=1, etag='2'),
+                       FileInfo(name='b.csv', size=2, last_modified=last_modified),
+                       FileInfo(name='c.csv', size=3)])
+
+    assert list(new.difference(old).names()) == ['c.csv']
+    assert list(new.difference(old, compare_content=True).names()) == ['a.csv', 'c.csv']
+    assert list(old.difference(new).names()) == []
+
+
+def test_from_storage(storage: object):
+    for file_name in ['x/1.csv', 'x/2.csv', 'y/3.csv']:
+        file_path = storage.base_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text('content')
+
+    listing = FileListing.from_storage(storage, '*/*.csv')
+    assert list(listing.names()) == ['x/1.csv', 'x/2.csv', 'y/3.csv']
+    assert listing.total_size() == 3 * len('content')
+
+
+def test_glob_regex_matches_walk(storage: object):
+    names = ['a/x1.csv', 'a/xa/b.csv', 'a/b/x2.csv', 'a/.h/x3.csv', 'a/.x4.csv', 'a/b/c/x5.csv', 'a/.csv', 'a/bx/x6.csv']
+    for name in names:
+        (storage.base_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (storage.base_path / name).write_text(name)
+
+    for file_pattern in ['a/**/x*.csv', 'a/*.csv', 'a/*/x*.csv', 'a/**', '**/*.csv', 'a/.h/*.csv', 'a/x?.csv',
+                         'a/.*', 'a/[xb]*/x*.csv', 'a/[!x]*/*', 'a/*x*/*', 'a/?/*', 'a/**/.h/*']:
+        regex = glob_regex(file_pattern)
+        expected = sorted(entry.name for entry in walk(str(storage.base_path), file_pattern) if not entry.is_dir())
+        assert sorted(name for name in names if regex.fullmatch(name)) == expected, file_pattern
+
+
+def test_expand_path_template():
+    assert expand_path_template('logs/{yyyy}/{mm}/{dd}/*.log', datetime.date(2026, 10, 30), datetime.date(2026, 11, 2)) \
+        == ['logs/2026/10/30/*.log', 'logs/2026/10/31/*.log', 'logs/2026/11/01/*.log']
+    assert expand_path_template('{yyyy}-{mm}/', datetime.datetime(2025, 12, 31, 23), datetime.date(2026, 2, 1)) \
+        == ['2025-12/', '2026-01/']
+    assert expand_path_template('{yyyy}/{dd}{hh}', datetime.datetime(2026, 10, 17, 22, 30), datetime.datetime(2026, 10, 18, 0, 1)) \
+        == ['2026/1722', '2026/1723', '2026/1800']
+    assert expand_path_template('logs/*.log', datetime.date(2026, 1, 1), datetime.date(2027, 1, 1)) == ['logs/*.log']
+    assert expand_path_template('{yyyy}/', datetime.date(2026, 1, 1), datetime.date(2026, 1, 1)) == []
+    with pytest.raises(ValueError):
+        expand_path_template('{date}/*.log', datetime.date(2026, 1, 1), datetime.date(2026, 1, 2))
+    # a date next to a timezone-aware datetime is taken in its timezone
+    utc = datetime.timezone.utc
+    assert expand_path_template('{dd}', datetime.datetime(2026, 10, 17, 12, tzinfo=utc), datetime.date(2026, 10, 19)) \
+        == ['17', '18']
+    assert expand_path_template('{dd}', datetime.date(2026, 10, 17), datetime.datetime(2026, 10, 18, 1, tzinfo=utc)) \
+        == ['17', '18']
+
+
+def test_iterate_files_in_range(storage: object):
+    for day in range(1, 32):
+        for hour in [0, 12]:
+            file_path = storage.base_path / f'logs/2026/10/{day:02}/nginx.{hour:02}.log'
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_text('content')
+
+    assert list(iterate_files_in_range(storage, 'logs/{yyyy}/{mm}/{dd}/nginx.*.log',
+                                       datetime.date(2026, 10, 30), datetime.date(2026, 11, 5))) \
+        == ['logs/2026/10/30/nginx.00.log', 'logs/2026/10/30/nginx.12.log',
+            'logs/2026/10/31/nginx.00.log', 'logs/2026/10/31/nginx.12.log']
+    file_infos = list(iterate_file_infos_in_range(storage, 'logs/{yyyy}/{mm}/*/nginx.12.log',
+                                                  datetime.date(2026, 9, 1), datetime.date(2026, 11, 1)))
+    assert len(file_infos) == 31 and {file_info.size for file_info in file_infos} == {len('content')}
+
+
+def test_iterate_files_in_range_on_prefix_listing_storage(monkeypatch):
+    pytest.importorskip('azure.storage.blob')
+    import azure.storage.blob
+    import mara_storage.listing
+    from benchmarks import emulators
+    from mara_storage.azure import AzureStorageClient
+
+    with emulators.FakeAzureBlobServer() as server:
+        storage = storages.AzureStorage(account_name=server.ACCOUNT_NAME, account_key=server.ACCOUNT_KEY,
+                                        container_name='listing-test')
+        client = AzureStorageClient(storage)
+        client._AzureStorageClient__blob_service_client = \
+            azure.storage.blob.BlobServiceClient.from_connection_string(server.connection_string)
+        monkeypatch.setattr(mara_storage.listing, 'StorageClient', lambda storage: client)
+        for day in [16, 17, 18]:
+            for name in ['nginx.00.log', 'nginx.00.log.gz', 'other.log', 'sub/nginx.12.log']:
+                server.put(storage.container_name, f'logs/2026/10/{day}/{name}', b'content')
+
+        # the blob listing takes a prefix, the wildcards are matched afterwards
+        assert list(iterate_files_in_range(storage, 'logs/{yyyy}/{mm}/{dd}/nginx.*.log',
+                                           datetime.date(2026, 10, 17), datetime.date(2026, 10, 19))) \
+            == ['logs/2026/10/17/nginx.00.log', 'logs/2026/10/18/nginx.00.log']
+        assert [file_info.name for file_info in iterate_file_infos_in_range(
+            storage, 'logs/{yyyy}/{mm}/{dd}/*/nginx.12.log', datetime.date(2026, 10, 18), datetime.date(2026, 10, 19))] \
+            == ['logs/2026/10/18/sub/nginx.12.log']
@@ -1,4 +1,7 @@
 import datetime
+import gzip
+import io
+import os
 import pathlib
 import pytest
 import subprocess
@@ -102,6 +105,123 @@ def test_write_file_command(storage: object):
         assert file_path.is_file()
 
 
+def test_read_files_command(storage: object):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    for file_name in ['b.txt', 'a.txt', 'sub/c.txt', '.hidden/d.txt']:
+        file_path = storage.base_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(f'{TEST_CONTENT} {file_name}\n')
+    for file_name in ['b.txt', 'a.txt']:
+        file_path = storage.base_path / file_name
+        for compression in [Compression.GZIP, Compression.ZIP, Compression.TAR_GZIP]:
+            (exitcode, _) = subprocess.getstatusoutput(
+                f'cd {storage.base_path} && {compressor(compression)} {file_name} > {file_name}.{compression_file_extension(compression)}')
+            assert exitcode == 0
+
+    # test
+    expected = f'{TEST_CONTENT} a.txt\n{TEST_CONTENT} b.txt\n'
+    for compression in [Compression.NONE, Compression.GZIP, Compression.ZIP, Compression.TAR_GZIP]:
+        print(f'Test compression: {compression}')
+        file_extension = compression_file_extension(compression)
+        command = shell.read_files_command(storage, file_pattern='*.txt' + (f'.{file_extension}' if file_extension else ''),
+                                           compression=compression)
+        (exitcode, stdout) = subprocess.getstatusoutput(command)
+        assert exitcode == 0
+        assert stdout + '\n' == expected
+
+    (exitcode, stdout) = subprocess.getstatusoutput(shell.read_files_command(storage, file_pattern='**/*.txt'))
+    assert exitcode == 0
+    assert stdout + '\n' == expected + f'{TEST_CONTENT} sub/c.txt\n'
+
+    (exitcode, stdout) = subprocess.getstatusoutput(shell.read_files_command(storage, file_pattern='does-not-exist/*.txt'))
+    assert exitcode == 0
+    assert stdout == ''
+
+
+def test_read_files_command_matches_iterate_files(storage: object):
+    for file_name in ['a/x1.csv', 'a/xa/b.csv', 'a/b/x2.csv', 'a/.h/x3.csv', 'a/.x4.csv', 'a/b/c/x5.csv',
+                      'a/.csv', 'a/bx/x6.csv']:
+        file_path = storage.base_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(f'{file_name}\n')
+
+    client = StorageClient(storage)
+    for file_pattern in ['a/**/x*.csv', 'a/*.csv', 'a/*/x*.csv', 'a/**', '**/*.csv', 'a/.h/*.csv', 'a/x?.csv',
+                         'a/[xb]*/x*.csv', 'a/[!x]*/*', 'a/*x*/*', 'a/?/*']:
+        (exitcode, stdout) = subprocess.getstatusoutput(shell.read_files_command(storage, file_pattern=file_pattern))
+        assert exitcode == 0
+        expected = sorted(file_name for file_name in client.iterate_files(file_pattern)
+                          if (storage.base_path / file_name).is_file())
+        assert sorted(stdout.splitlines()) == expected, file_pattern
+
+
+def test_upload_directory_command(storage: object, tmp_path):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    for file_name in ['a.txt', 'sub/b.txt', 'sub/deeper/c.txt']:
+        file_path = tmp_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(f'{TEST_CONTENT} {file_name}')
+
+    # test
+    (exitcode, _) = subprocess.getstatusoutput(shell.upload_directory_command(storage, str(tmp_path), 'upload',
+                                                                              parallelism=4))
+    assert exitcode == 0
+    for file_name in ['a.txt', 'sub/b.txt', 'sub/deeper/c.txt']:
+        assert (storage.base_path / 'upload' / file_name).read_text() == f'{TEST_CONTENT} {file_name}'
+
+    (exitcode, _) = subprocess.getstatusoutput(shell.upload_directory_command(storage, str(tmp_path), 'gzip',
+                                                                              compression=Compression.GZIP))
+    assert exitcode == 0
+    assert gzip.decompress((storage.base_path / 'gzip/sub/deeper/c.txt.gz').read_bytes()) == f'{TEST_CONTENT} sub/deeper/c.txt'.encode()
+
+
+def test_write_files_command(storage: object, tmp_path):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    for file_name in ['a.txt', 'sub/b.txt']:
+        file_path = tmp_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(f'{TEST_CONTENT} {file_name}')
+
+    # test
+    for compression in [Compression.NONE, Compression.GZIP]:
+        command = shell.write_files_command(storage, target_directory=compression.value, compression=compression)
+        (exitcode, _) = subprocess.getstatusoutput(f'cd {tmp_path} && find . -name "*.txt" | {command}')
+        assert exitcode == 0
+
+    assert (storage.base_path / 'none/b.txt').read_text() == f'{TEST_CONTENT} sub/b.txt'
+    assert not (storage.base_path / 'none/b.txt').is_symlink()
+    assert gzip.decompress((storage.base_path / 'gzip/a.txt.gz').read_bytes()) == f'{TEST_CONTENT} a.txt'.encode()
+
+
+def test_upload_file(storage: object, tmp_path):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    local_path = tmp_path / TEST_WRITE_FILE_NAME
+    local_path.write_text(TEST_CONTENT)
+
+    # test
+    StorageClient(storage).upload_file(str(local_path), f'sub/{TEST_WRITE_FILE_NAME}')
+    assert (storage.base_path / 'sub' / TEST_WRITE_FILE_NAME).read_text() == TEST_CONTENT
+    assert os.listdir(storage.base_path / 'sub') == [TEST_WRITE_FILE_NAME]
+    assert StorageClient(storage).file_size(f'sub/{TEST_WRITE_FILE_NAME}') == len(TEST_CONTENT)
+
+
+def test_append(storage: object):
+    assert isinstance(storage, storages.LocalStorage)
+
+    storage_client = StorageClient(storage)
+    assert storage_client.append(f'sub/{TEST_WRITE_FILE_NAME}', TEST_CONTENT.encode()) == len(TEST_CONTENT)
+    assert storage_client.append(f'sub/{TEST_WRITE_FILE_NAME}', io.BytesIO(b'\nappended')) == len(TEST_CONTENT) + 9
+    assert (storage.base_path / 'sub' / TEST_WRITE_FILE_NAME).read_text() == TEST_CONTENT + '\nappended'
+
+
 def test_delete_file_command(storage: object):
     assert isinstance(storage, storages.LocalStorage)
 
@@ -148,3 +268,70 @@ def test_last_modification_date(storage: object):
     assert isinstance(last_modification_date, datetime.datetime)
     assert last_modification_date.tzinfo
     assert (datetime.datetime.now().astimezone() - last_modification_date).total_seconds() <= 1
+
+
+def test_iterate_files(storage: object):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    for file_name in ['a.csv', 'sub/b.csv', 'sub/deeper/c.csv', 'sub/deeper/d.txt', '.hidden/e.csv']:
+        file_path = storage.base_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(TEST_CONTENT)
+
+    # test
+    storage_client = StorageClient(storage)
+
+    assert sorted(storage_client.iterate_files('*.csv')) == ['a.csv']
+    assert sorted(storage_client.iterate_files('sub/*/*.csv')) == ['sub/deeper/c.csv']
+    assert sorted(storage_client.iterate_files('**/*.csv')) == ['a.csv', 'sub/b.csv', 'sub/deeper/c.csv']
+    assert sorted(storage_client.iterate_files('**/*.csv', max_workers=4)) == ['a.csv', 'sub/b.csv', 'sub/deeper/c.csv']
+    assert list(storage_client.iterate_files('does-not-exist/*.csv')) == []
+
+    file_infos = list(storage_client.iterate_file_infos('sub/deeper/*.txt'))
+    assert len(file_infos) == 1
+    assert file_infos[0].name == 'sub/deeper/d.txt'
+    assert file_infos[0].size == len(TEST_CONTENT)
+    assert file_infos[0].last_modified == storage_client.last_modification_timestamp('sub/deeper/d.txt')
+
+
+def test_iterate_contents(storage: object):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    import gzip
+    file_names = [f'part-{i:04d}.txt.gz' for i in range(20)]
+    for file_name in file_names:
+        (storage.base_path / file_name).write_bytes(gzip.compress(f'{TEST_CONTENT} {file_name}'.encode()))
+
+    # test
+    storage_client = StorageClient(storage)
+
+    contents = dict(storage_client.iterate_contents('*.txt.gz', prefetch=4, compression=Compression.GZIP))
+    assert contents == {file_name: f'{TEST_CONTENT} {file_name}'.encode() for file_name in file_names}
+
+    contents = dict(storage_client.iterate_contents('*.txt.gz', prefetch=4, max_bytes=1))
+    assert sorted(contents) == file_names
+    assert contents[file_names[0]] == (storage.base_path / file_names[0]).read_bytes()
+
+
+def test_read_buffer(storage: object):
+    assert isinstance(storage, storages.LocalStorage)
+
+    # prepare
+    (storage.base_path / TEST_READ_FILE_NAME).write_text(TEST_CONTENT)
+    (storage.base_path / TEST_TOUCH_FILE_NAME).touch()
+
+    # test
+    storage_client = StorageClient(storage)
+
+    buffer = storage_client.read_buffer(TEST_READ_FILE_NAME)
+    assert buffer.readonly
+    assert bytes(buffer[:4]) == TEST_CONTENT[:4].encode()
+    assert buffer.tobytes() == TEST_CONTENT.encode()
+    buffer.release()
+
+    assert len(storage_client.read_buffer(TEST_TOUCH_FILE_NAME)) == 0
+
+    with storage_client.open_mmap(TEST_READ_FILE_NAME) as mapped_file:
+        assert mapped_file.readline() == TEST_CONTENT.encode()
@@ -0,0 +1,217 @@
+import datetime
+import os
+import pytest
+import subprocess
+import threading
+
+from mara_storage.compression import Compression
+from mara_storage.client import StorageClient
+from mara_storage import storages, info, shell, manage
+
+
+TEST_FILE_NAME = 'test.txt'
+TEST_FILE_NOT_EXISTS_FILE_NAME = 'file-does-not-exist.txt'
+TEST_CONTENT = 'THIS IS A TEST CONTENT'
+
+
+@pytest.fixture
+def storage():
+    return storages.MemoryStorage('test')
+
+
+@pytest.fixture(autouse=True)
+def test_before_and_after(storage: object):
+    manage.ensure_storage(storage)
+    yield
+    manage.drop_storage(storage, force=True)
+
+
+def test_file_exists(storage: object):
+    StorageClient(storage).write_file(TEST_FILE_NAME, TEST_CONTENT.encode())
+
+    assert info.file_exists(storage, file_name=TEST_FILE_NAME)
+    assert not info.file_exists(storage, file_name=TEST_FILE_NOT_EXISTS_FILE_NAME)
+
+
+def test_drop_storage(storage: object):
+    StorageClient(storage).write_file(TEST_FILE_NAME, TEST_CONTENT.encode())
+
+    with pytest.raises(OSError):
+        manage.drop_storage(storage)
+    manage.drop_storage(storage, force=True)
+    assert not info.file_exists(storage, file_name=TEST_FILE_NAME)
+
+
+def test_read_file_command(storage: object):
+    import gzip
+    storage_client = StorageClient(storage)
+    storage_client.write_file(TEST_FILE_NAME, TEST_CONTENT.encode())
+    storage_client.write_file(f'{TEST_FILE_NAME}.gz', gzip.compress(TEST_CONTENT.encode()))
+
+    (exitcode, stdout) = subprocess.getstatusoutput(shell.read_file_command(storage, file_name=TEST_FILE_NAME))
+    assert exitcode == 0
+    assert stdout == TEST_CONTENT
+
+    (exitcode, stdout) = subprocess.getstatusoutput(shell.read_file_command(storage, file_name=f'{TEST_FILE_NAME}.gz',
+                                                                            compression=Compression.GZIP))
+    assert exitcode == 0
+    assert stdout == TEST_CONTENT
+
+    (exitcode, _) = subprocess.getstatusoutput(shell.read_file_command(storage, file_name=TEST_FILE_NOT_EXISTS_FILE_NAME))
+    assert exitcode != 0
+
+
+def test_read_files_command(storage: object):
+    import gzip
+    storage_client = StorageClient(storage)
+    for file_name in ['b.txt', 'a.txt', 'sub/c.txt']:
+        storage_client.write_file(file_name, f'{file_name}\n'.encode())
+        storage_client.write_file(f'{file_name}.gz', gzip.compress(f'{file_name}\n'.encode()))
+
+    (exitcode, stdout) = subprocess.getstatusoutput(shell.read_files_command(storage, file_pattern='*.txt'))
+    assert exitcode == 0
+    assert stdout == 'a.txt\nb.txt'
+
+    (exitcode, stdout) = subprocess.getstatusoutput(shell.read_files_command(storage, file_pattern='**/*.txt.gz',
+                                                                             compression=Compression.GZIP))
+    assert exitcode == 0
+    assert stdout == 'a.txt\nb.txt\nsub/c.txt'
+
+
+def test_write_file_command(storage: object):
+    import gzip
+    storage_client = StorageClient(storage)
+
+    command = shell.write_file_command(storage, file_name=TEST_FILE_NAME)
+    (exitcode, _) = subprocess.getstatusoutput(f'echo -n "{TEST_CONTENT}" | {command}')
+    assert exitcode == 0
+    assert storage_client.read_file(TEST_FILE_NAME) == TEST_CONTENT.encode()
+
+    command = shell.write_file_command(storage, file_name=f'{TEST_FILE_NAME}.gz', compression=Compression.GZIP)
+    (exitcode, _) = subprocess.getstatusoutput(f'echo -n "{TEST_CONTENT}" | {command}')
+    assert exitcode == 0
+    assert gzip.decompress(storage_client.read_file(f'{TEST_FILE_NAME}.gz')) == TEST_CONTENT.encode()
+
+
+def test_upload_directory_command(storage: object, tmp_path):
+    import gzip
+    storage_client = StorageClient(storage)
+    for file_name in ['a.txt', 'sub/b.txt']:
+        (tmp_path / file_name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / file_name).write_text(file_name)
+
+    (exitcode, _) = subprocess.getstatusoutput(shell.upload_directory_command(storage, str(tmp_path), 'upload'))
+    assert exitcode == 0
+    assert list(storage_client.iterate_files('upload/**/*.txt')) == ['upload/a.txt', 'upload/sub/b.txt']
+
+    command = shell.write_files_command(storage, compression=Compression.GZIP)
+    (exitcode, _) = subprocess.getstatusoutput(f'find {tmp_path} -name "*.txt" | {command}')
+    assert exitcode == 0
+    assert gzip.decompress(storage_client.read_file('b.txt.gz')) == b'sub/b.txt'
+
+
+def test_delete_file_command(storage: object):
+    storage_client = StorageClient(storage)
+    storage_client.write_file(TEST_FILE_NAME, TEST_CONTENT.encode())
+
+    (exitcode, _) = subprocess.getstatusoutput(shell.delete_file_command(storage, file_name=TEST_FILE_NAME))
+    assert exitcode == 0
+    assert not info.file_exists(storage, file_name=TEST_FILE_NAME)
+
+    # test if force option works as expected
+    (exitcode, _) = subprocess.getstatusoutput(shell.delete_file_command(storage, file_name=TEST_FILE_NAME, force=True))
+    assert exitcode == 0
+    (exitcode, _) = subprocess.getstatusoutput(shell.delete_file_command(storage, file_name=TEST_FILE_NAME, force=False))
+    assert exitcode != 0
+
+
+def test_last_modification_date(storage: object):
+    storage_client = StorageClient(storage)
+    from mara_storage.memory_storage import MemoryStorageClient
+    assert isinstance(storage_client, MemoryStorageClient)
+
+    storage_client.write_file(TEST_FILE_NAME, b'')
+    last_modification_date = storage_client.last_modification_timestamp(TEST_FILE_NAME)
+    assert isinstance(last_modification_date, datetime.datetime)
+    assert last_modification_date.tzinfo
+    assert (datetime.datetime.now().astimezone() - last_modification_date).total_seconds() <= 1
+
+
+def test_iterate_files(storage: object):
+    storage_client = StorageClient(storage)
+    for file_name in ['a.csv', 'sub/b.csv', 'sub/deeper/c.csv', 'sub/deeper/d.txt']:
+        storage_client.write_file(file_name, TEST_CONTENT.encode())
+
+    assert list(storage_client.iterate_files('*.csv')) == ['a.csv']
+    assert list(storage_client.iterate_files('sub/*/*.csv')) == ['sub/deeper/c.csv']
+    assert list(storage_client.iterate_files('**/*.csv')) == ['a.csv', 'sub/b.csv', 'sub/deeper/c.csv']
+    assert list(storage_client.iterate_files('sub/[!b]*/?.txt')) == ['sub/deeper/d.txt']
+    assert list(storage_client.iterate_files('does-not-exist/*.csv')) == []
+
+    file_infos = list(storage_client.iterate_file_infos('sub/deeper/*.txt'))
+    assert len(file_infos) == 1
+    assert file_infos[0].size == len(TEST_CONTENT)
+
+
+def test_concurrent_writes(storage: object):
+    storage_client = StorageClient(storage)
+
+    def write(thread: int):
+        for i in range(1000):
+            storage_client.write_file(f'{thread}/{i}', b'x')
+
+    threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(list(storage_client.iterate_files('*/*'))) == 8000
+
+
+def test_append(storage: object):
+    storage_client = StorageClient(storage)
+
+    def append(thread: int):
+        for i in range(100):
+            storage_client.append('events.log', f'{thread}:{i}\n'.encode())
+
+    threads = [threading.Thread(target=append, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    lines = storage_client.read_file('events.log').decode().splitlines()
+    assert sorted(lines) == sorted(f'{thread}:{i}' for thread in range(8) for i in range(100))
+
+    # the default implementation rewrites the file
+    assert StorageClient.append(storage_client, 'events.log', b'last\n') == len('\n'.join(lines)) + 6
+    assert storage_client.read_file('events.log').decode().splitlines() == lines + ['last']
+    assert isinstance(storage_client.read_file('events.log'), bytes)
+    assert storage_client.read_range('events.log', len('\n'.join(lines)) + 1, 4) == b'last'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork is not available')
+def test_forked_process_has_own_server(storage: object):
+    from mara_storage import memory_storage
+
+    storage_client = StorageClient(storage)
+    storage_client.write_file(TEST_FILE_NAME, b'parent')
+    parent_address = memory_storage.server_address()
+
+    pid = os.fork()
+    if pid == 0:
+        exitcode = 1
+        try:
+            # the shell commands of the child write to the storages of the child
+            if (memory_storage.server_address() != parent_address
+                    and subprocess.call(f'printf child | {shell.write_file_command(storage, file_name=TEST_FILE_NAME)}',
+                                        shell=True) == 0
+                    and storage_client.read_file(TEST_FILE_NAME) == b'child'):
+                exitcode = 0
+        finally:
+            os._exit(exitcode)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    assert storage_client.read_file(TEST_FILE_NAME) == b'parent'
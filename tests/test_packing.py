@@ -0,0 +1,105 @@
+import pathlib
+
+import pytest
+
+from mara_storage import config, info, manage, packing, storages
+from mara_storage.client import StorageClient
+
+
+@pytest.fixture(params=['memory', 'local'])
+def storage(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'packed_namespaces', lambda alias: ['events'])
+    if request.param == 'memory':
+        storage = storages.MemoryStorage('packing-test')
+    else:
+        storage = storages.LocalStorage(pathlib.Path(tmp_path) / 'storage')
+    manage.ensure_storage(storage)
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+def test_pack_index():
+    entries = {'b/c.json': (10, 5), 'a\tb.json': (0, 10)}
+    assert list(packing.decode_index(packing.encode_index(entries))) == [('a\tb.json', 0, 10), ('b/c.json', 10, 5)]
+
+
+def test_packed_namespace(storage):
+    with packing.PackWriter(storage, 'events', max_pack_bytes=1000) as writer:
+        for i in range(300):
+            writer.write_file(f'2026-10-{i % 3 + 1:02}/{i:04}.json', f'{{"id": {i}}}'.encode())
+
+    client = StorageClient(storage)
+    with packing.unpacked():
+        packs = list(client.iterate_files('events/*.pack'))
+        assert len(packs) > 1
+        assert len(list(client.iterate_files('events/*.index'))) == len(packs)
+
+    assert client.read_file('events/2026-10-02/0004.json') == b'{"id": 4}'
+    assert client.read_range('events/2026-10-02/0004.json', 1, 4) == b'"id"'
+    assert client.read_range('events/2026-10-02/0004.json', 7, 100) == b'4}'
+    assert client.file_size('events/2026-10-02/0004.json') == 9
+
+    files = list(client.iterate_files('events/2026-10-01/*.json'))
+    assert len(files) == 100
+    assert files[:2] == ['events/2026-10-01/0000.json', 'events/2026-10-01/0003.json']
+    assert len(list(client.iterate_files('events/**/*.json'))) == 300
+    assert {file_info.size for file_info in client.iterate_file_infos('events/2026-10-01/000*.json')} == {9}
+
+    assert info.file_exists(storage, 'events/2026-10-01/0000.json')
+    assert not info.file_exists(storage, 'events/2026-10-01/0001.json')
+    with pytest.raises(FileNotFoundError):
+        client.read_file('events/2026-10-01/0001.json')
+
+
+def test_later_pack_wins(storage):
+    for content in [b'first', b'second']:
+        with packing.PackWriter(storage, 'events') as writer:
+            writer.write_file('file.txt', content)
+            writer.write_file(f'{content.decode()}.txt', content)
+
+    client = StorageClient(storage)
+    assert client.read_file('events/file.txt') == b'second'
+    assert list(client.iterate_files('events/*.txt')) == ['events/file.txt', 'events/first.txt', 'events/second.txt']
+
+
+def test_missing_files_are_not_relisted(storage, monkeypatch):
+    listings = []
+    index_file_pattern = packing._index_file_pattern
+
+    def counting_index_file_pattern(storage, directory: str) -> str:
+        listings.append(directory)
+        return index_file_pattern(storage, directory)
+
+    monkeypatch.setattr(packing, '_index_file_pattern', counting_index_file_pattern)
+
+    with packing.PackWriter(storage, 'events') as writer:
+        writer.write_file('a.txt', b'a')
+
+    client = StorageClient(storage)
+    for _ in range(3):
+        assert not info.file_exists(storage, 'events/missing.txt')
+    assert len(listings) == 1
+
+    # a pack written by this process is visible right away
+    with packing.PackWriter(storage, 'events') as writer:
+        writer.write_file('b.txt', b'b')
+    assert client.read_file('events/b.txt') == b'b'
+    assert len(listings) == 2
+
+    # packs of other processes are loaded after the refresh interval
+    packing.namespace(storage, 'events/b.txt').refresh_interval = 0
+    assert not info.file_exists(storage, 'events/missing.txt')
+    assert len(listings) == 3
+
+
+def test_exception_discards_current_pack(storage, tmp_path):
+    spool_directory = tmp_path / 'spool'
+    spool_directory.mkdir()
+    with pytest.raises(ZeroDivisionError):
+        with packing.PackWriter(storage, 'events', max_pack_bytes=10, spool_directory=str(spool_directory)) as writer:
+            writer.write_file('finished.txt', b'0123456789')
+            writer.write_file('incomplete.txt', b'content')
+            1 / 0
+
+    assert list(StorageClient(storage).iterate_files('events/*.txt')) == ['events/finished.txt']
+    assert list(spool_directory.iterdir()) == []
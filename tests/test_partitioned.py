@@ -0,0 +1,74 @@
+import gzip
+
+import pytest
+
+from mara_storage import manage, storages
+from mara_storage.client import StorageClient
+from mara_storage.compression import Compression
+from mara_storage.partitioned import PartitionedWriter, partition_path
+
+
+@pytest.fixture
+def storage():
+    storage = storages.MemoryStorage('partitioned-test')
+    manage.ensure_storage(storage)
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+def test_partition_path():
+    assert partition_path('dt=2026-10-17/') == 'dt=2026-10-17'
+    assert partition_path({'year': 2026, 'month': 10}) == 'year=2026/month=10'
+    assert partition_path([('country', 'a/b'), ('city', 'x=y')]) == 'country=a%2Fb/city=x%3Dy'
+
+
+def test_partitioned_writer(storage):
+    rows = [(f'2026-10-{day:02}', str(i)) for i in range(1000) for day in range(1, 31)]
+
+    # fewer open files than partitions: files are closed and reopened
+    with PartitionedWriter(storage, partition_key=lambda row: {'dt': row[0]}, directory='events',
+                           serialize=lambda row: (','.join(row) + '\n').encode(), max_open_files=7) as writer:
+        writer.write_records(rows)
+
+    client = StorageClient(storage)
+    assert len(list(client.iterate_files(f'events/dt=*/part-0001-{writer.run_id}.csv.gz'))) == 30
+    lines = gzip.decompress(client.read_file(f'events/dt=2026-10-17/part-0001-{writer.run_id}.csv.gz')).decode().splitlines()
+    assert lines == [f'2026-10-17,{i}' for i in range(1000)]
+
+
+def test_partitioned_writer_rolls_files(storage):
+    with PartitionedWriter(storage, partition_key=lambda record: record[:1], compression=Compression.NONE,
+                           file_name_template='part-{part:04}.csv', max_file_bytes=100) as writer:
+        for i in range(100):
+            writer.write(f'a{i:04}\n')
+        writer.write('b\n')
+
+    client = StorageClient(storage)
+    assert list(client.iterate_files('a/*')) == [f'a/part-{part:04}.csv' for part in range(1, 7)]
+    assert b''.join(client.read_file(f'a/part-{part:04}.csv') for part in range(1, 7)) \
+        == ''.join(f'a{i:04}\n' for i in range(100)).encode()
+    assert client.read_file('b/part-0001.csv') == b'b\n'
+
+
+def test_runs_add_files(storage):
+    for run_id in ['run-1', 'run-2']:
+        with PartitionedWriter(storage, partition_key=lambda record: 'a', compression=Compression.NONE,
+                               run_id=run_id) as writer:
+            writer.write(f'{run_id}\n')
+
+    client = StorageClient(storage)
+    assert list(client.iterate_files('a/*')) == ['a/part-0001-run-1.csv', 'a/part-0001-run-2.csv']
+    assert client.read_file('a/part-0001-run-1.csv') == b'run-1\n'
+
+
+def test_exception_discards_unfinished_parts(storage, tmp_path):
+    with pytest.raises(ZeroDivisionError):
+        with PartitionedWriter(storage, partition_key=lambda record: record[:1], compression=Compression.NONE,
+                               max_file_bytes=10, spool_directory=str(tmp_path), run_id='run') as writer:
+            writer.write('a0123456789\n')  # finished
+            writer.write('b\n')
+            1 / 0
+
+    client = StorageClient(storage)
+    assert list(client.iterate_files('*/*')) == ['a/part-0001-run.csv']
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,67 @@
+import gzip
+import json
+
+import pytest
+
+from mara_storage import manage, records, storages
+from mara_storage.client import StorageClient
+from mara_storage.compression import Compression
+
+
+@pytest.fixture
+def storage():
+    storage = storages.MemoryStorage('records-test')
+    manage.ensure_storage(storage)
+    client = StorageClient(storage)
+    for i in range(10):
+        client.write_file(f'lines/{i}.txt.gz', gzip.compress(''.join(f'{i}-{j}\n' for j in range(25)).encode()))
+        client.write_file(f'csv/{i}.csv', f'a,b\n{i},"x,y"\n'.encode())
+        client.write_file(f'jsonl/{i}.jsonl', f'{{"file": {i}}}\n\n{{"file": {i}}}\n'.encode())
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_read_lines(storage, workers: int):
+    batches = list(records.read_records(storage, 'lines/*.txt.gz', Compression.GZIP, workers=workers, batch_size=100))
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    assert [line for batch in batches for line in batch] == [f'{i}-{j}' for i in range(10) for j in range(25)]
+
+
+def test_read_csv_and_jsonl(storage):
+    batches = list(records.read_records(storage, 'csv/*.csv', format='csv', skip_header=True, workers=2))
+    assert batches == [[[str(i), 'x,y'] for i in range(10)]]
+
+    batches = list(records.read_records(storage, 'jsonl/*.jsonl', format='jsonl', batch_size=7, workers=0))
+    assert [record for batch in batches for record in batch] == [{'file': i} for i in range(10) for _ in range(2)]
+
+
+def test_batch_formats(storage):
+    numpy = pytest.importorskip('numpy')
+    batch = next(records.read_records(storage, 'csv/*.csv', format='csv', batch_format='numpy', workers=0))
+    assert isinstance(batch, numpy.ndarray) and batch.shape == (20, 2)
+
+    pyarrow = pytest.importorskip('pyarrow')
+    table = next(records.read_records(storage, 'jsonl/*.jsonl', format='jsonl', batch_format='arrow', workers=0))
+    assert isinstance(table, pyarrow.Table) and table.num_rows == 20
+
+
+def test_unsupported_format(storage):
+    with pytest.raises(ValueError):
+        next(records.read_records(storage, 'lines/*', format='parquet'))
+
+
+@pytest.mark.parametrize('target_size', [1, 100, 1000, 10 ** 6])
+def test_plan_splits(storage, target_size: int):
+    lines = [f'{i},' + 'x' * (i % 50) for i in range(1000)]
+    content = ('header\n' + '\n'.join(lines) + '\n').encode()
+    StorageClient(storage).write_file('large.csv', content)
+
+    splits = records.plan_splits(storage, 'large.csv', target_size=target_size, skip_header=True, probe_size=16)
+    assert splits[0].start == len('header\n') and splits[-1].end == len(content)
+    assert all(split.start == previous.end for previous, split in zip(splits, splits[1:]))
+    assert all(content[split.start - 1:split.start] == b'\n' for split in splits)
+
+    parsed = [line for split in splits for line in records.parse(b''.join(records.read_split(storage, split, chunk_size=7)),
+                                                                  Compression.NONE, 'lines')]
+    assert parsed == lines
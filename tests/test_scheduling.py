@@ -0,0 +1,154 @@
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from mara_storage import config, execution, scheduling, storages
+
+
+def max_concurrency(budget: scheduling.IoBudget, operations: int, priority: int = None) -> int:
+    running, max_running, lock = [0], [0], threading.Lock()
+
+    def operation():
+        token = budget.acquire(priority)
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        budget.release(token)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=operations) as executor:
+        list(executor.map(lambda _: operation(), range(operations)))
+    return max_running[0]
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_concurrency(tmp_path, shared: bool):
+    budget = scheduling.IoBudget(max_concurrency=3, lock_directory=str(tmp_path) if shared else None, poll_interval=0.005)
+    assert max_concurrency(budget, 12) == 3
+    assert max_concurrency(budget, 12, scheduling.LOW) == 1
+
+
+def test_concurrency_between_processes(tmp_path):
+    # budgets with the same lock directory and name share their slots, also within a process
+    first, second = [scheduling.IoBudget(max_concurrency=2, lock_directory=str(tmp_path), name='partner',
+                                         poll_interval=0.005) for _ in range(2)]
+    tokens = [first.acquire(), first.acquire()]
+
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (second.release(second.acquire()), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.1)
+    first.release(tokens.pop())
+    assert acquired.wait(1)
+    thread.join()
+    first.release(tokens.pop())
+
+
+def _consume(lock_directory: str, results):
+    budget = scheduling.IoBudget(max_bytes_per_second=1000, lock_directory=lock_directory, name='partner')
+    budget.acquire()
+    results.put(time.time())
+
+
+def test_bandwidth_between_processes(tmp_path):
+    budget = scheduling.IoBudget(max_bytes_per_second=1000, lock_directory=str(tmp_path), name='partner')
+    budget.acquire()
+    budget.consume(1300)
+
+    # a forked worker waits until the debt is paid back
+    context = multiprocessing.get_context('fork') if os.name == 'posix' else multiprocessing.get_context()
+    results = context.Queue()
+    start = time.time()
+    process = context.Process(target=_consume, args=(str(tmp_path), results))
+    process.start()
+    process.join(5)
+    assert 0.25 < results.get(timeout=1) - start < 1
+
+
+def test_priorities():
+    budget = scheduling.IoBudget(max_concurrency=1)
+    token = budget.acquire()
+    order = []
+
+    def operation(priority: int):
+        with scheduling.priority(priority):
+            operation_token = budget.acquire()
+        order.append(priority)
+        budget.release(operation_token)
+
+    threads = [threading.Thread(target=operation, args=(priority,)) for priority in [scheduling.LOW, scheduling.HIGH]]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    budget.release(token)
+    for thread in threads:
+        thread.join()
+    assert order == [scheduling.HIGH, scheduling.LOW]
+
+
+def test_executed_operations_are_scheduled(monkeypatch, tmp_path):
+    budgets, consumed = [], []
+
+    def io_budget(alias):
+        budgets.append(scheduling.IoBudget(max_concurrency=2, max_bytes_per_second=10 ** 9))
+        budgets[-1].consume = consumed.append
+        return budgets[-1]
+
+    monkeypatch.setattr(config, 'io_budget', io_budget)
+    storage = storages.MemoryStorage('scheduling-test')
+
+    @execution.executed
+    def read(storage: storages.Storage, data: bytes) -> bytes:
+        assert budgets[0].in_flight == 1
+        return data + data
+
+    assert read(storage, b'x' * 1000) == b'x' * 2000
+    local_path = tmp_path / 'file.txt'
+    local_path.write_bytes(b'x' * 500)
+    execution.executed(lambda storage, local_path, path: None, execution._local_file_size)(storage, str(local_path), 'file.txt')
+
+    assert len(budgets) == 1 and budgets[0].in_flight == 0
+    assert consumed == [3000, 500]
+
+
+@pytest.mark.parametrize('limit', ['budget', 'limiter'])
+def test_nested_fan_out_with_one_slot(monkeypatch, limit: str):
+    # work fanned out by an executed operation runs within its slot instead of waiting for it
+    if limit == 'budget':
+        monkeypatch.setattr(config, 'io_budget', lambda alias: scheduling.IoBudget(max_concurrency=1))
+    else:
+        monkeypatch.setattr(config, 'concurrency_limiter',
+                            lambda alias: execution.AdaptiveLimiter(initial_limit=1, max_limit=1))
+    storage = storages.MemoryStorage('scheduling-nested-test')
+
+    @execution.executed
+    def read_indexes(storage: storages.Storage) -> list:
+        return list(execution.map_concurrently(storage, lambda item: item * 2, range(5)))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(read_indexes, storage).result(timeout=5) == [0, 2, 4, 6, 8]
+    if limit == 'budget':
+        assert scheduling.budget(storage).in_flight == 0
+
+
+def test_nested_executed_calls(monkeypatch):
+    monkeypatch.setattr(config, 'io_budget', lambda alias: scheduling.IoBudget(max_concurrency=1))
+    storage = storages.MemoryStorage('scheduling-nesting-test')
+
+    @execution.executed
+    def inner(storage: storages.Storage):
+        return scheduling.budget(storage).in_flight
+
+    @execution.executed
+    def outer(storage: storages.Storage):
+        # after a nested call returned, the thread is still within the outer operation
+        return inner(storage), inner(storage)
+
+    assert outer(storage) == (1, 1)
+    assert inner(storage) == 1
@@ -0,0 +1,87 @@
+import gzip
+import shutil
+import subprocess
+
+import pytest
+
+from mara_storage import manage, seekable, storages
+from mara_storage.client import StorageClient
+
+
+CONTENT = b''.join(f'{i},{"x" * (i % 37)}\n'.encode() for i in range(20000))
+
+
+@pytest.fixture
+def storage():
+    storage = storages.MemoryStorage('seekable-test')
+    manage.ensure_storage(storage)
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+@pytest.fixture(params=['file.csv.gz', 'file.csv.zst'])
+def path(request):
+    if request.param.endswith('.zst'):
+        pytest.importorskip('zstandard')
+    return request.param
+
+
+def test_write_and_read(storage, path):
+    with seekable.open_writer(storage, path, block_size=10000) as f:
+        f.write(CONTENT[:12345])
+        f.write(CONTENT[12345:])
+
+    blocks = seekable.read_blocks(storage, path)
+    assert len(blocks) == len(CONTENT) // 10000 + 1
+    assert sum(block.uncompressed_size for block in blocks) == len(CONTENT)
+
+    for start, length in [(0, 10), (9995, 10), (123456, 30000), (len(CONTENT) - 5, 100), (len(CONTENT), 1)]:
+        assert seekable.read_uncompressed(storage, path, start, length) == CONTENT[start:start + length]
+
+    for target_size in [1, 5000, 10 ** 9]:
+        splits = seekable.plan_block_splits(storage, path, target_size=target_size)
+        assert all(split.compressed_start == previous.compressed_end for previous, split in zip(splits, splits[1:]))
+        chunks = [b''.join(seekable.read_block_split(storage, split, chunk_size=3000)) for split in splits]
+        assert [len(chunk) for chunk in chunks] == [split.uncompressed_end - split.uncompressed_start for split in splits]
+        assert b''.join(chunks) == CONTENT
+
+
+def test_bgzf_is_gzip(storage, tmp_path):
+    with seekable.open_writer(storage, 'file.csv.gz') as f:
+        f.write(CONTENT)
+    compressed = StorageClient(storage).read_file('file.csv.gz')
+    assert compressed.endswith(seekable.BGZF_EOF)
+    assert gzip.decompress(compressed) == CONTENT
+
+    if shutil.which('gunzip'):
+        assert subprocess.run(['gunzip', '-c'], input=compressed, stdout=subprocess.PIPE, check=True).stdout == CONTENT
+
+
+def test_bgzf_without_index(storage):
+    with seekable.open_writer(storage, 'file.csv.gz', block_size=1000) as f:
+        f.write(CONTENT)
+    blocks = seekable.read_blocks(storage, 'file.csv.gz')
+
+    # a copy without `.gzi` index: the block headers are scanned
+    client = StorageClient(storage)
+    client.write_file('copy.csv.gz', client.read_file('file.csv.gz'))
+    assert seekable.read_blocks(storage, 'copy.csv.gz') == blocks
+    assert seekable._scan_bgzf_blocks(client, 'copy.csv.gz', client.file_size('copy.csv.gz'), chunk_size=777) == blocks
+
+
+def test_zstd_is_zstd(storage):
+    zstandard = pytest.importorskip('zstandard')
+    with seekable.open_writer(storage, 'file.csv.zst', block_size=50000) as f:
+        f.write(CONTENT)
+    compressed = StorageClient(storage).read_file('file.csv.zst')
+    reader = zstandard.ZstdDecompressor().stream_reader(compressed, read_across_frames=True)
+    assert reader.read() == CONTENT
+
+    if shutil.which('zstd'):
+        assert subprocess.run(['zstd', '-dc'], input=compressed, stdout=subprocess.PIPE, check=True).stdout == CONTENT
+
+
+def test_unsupported_format(storage):
+    with pytest.raises(ValueError):
+        with seekable.open_writer(storage, 'file.csv.gz', format='gzip'):
+            pass
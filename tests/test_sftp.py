@@ -1,10 +1,7 @@
-import datetime
-import pathlib
 import pytest
 import subprocess
 
 from mara_storage.compression import Compression, compressor, file_extension as compression_file_extension
-from mara_storage.client import StorageClient
 from mara_storage import storages, info, shell, manage
 
 
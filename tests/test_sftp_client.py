@@ -0,0 +1,157 @@
+import datetime
+import pathlib
+
+import pytest
+
+from mara_storage import storages
+from mara_storage.client import FileInfo, StorageClient
+
+pytest.importorskip('pysftp')
+pytest.importorskip('paramiko')
+
+
+@pytest.fixture
+def root(tmp_path) -> pathlib.Path:
+    root = pathlib.Path(tmp_path) / 'sftp-root'
+    for name in ['a/x1.csv', 'a/x2.csv', 'a/.x3.csv', 'a/b/x4.csv', 'a/.h/x5.csv', 'c.txt']:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(name.encode())
+    return root
+
+
+@pytest.fixture
+def client(root):
+    from benchmarks import emulators
+
+    with emulators.SftpServer(str(root)) as server:
+        storage = storages.SftpStorage(host='127.0.0.1', port=server.port, user='test', password='test',
+                                       insecure=True)
+        client = StorageClient(storage)
+        yield client
+        client.close()
+
+
+def test_storage_client_type(client):
+    from mara_storage.sftp import SftpStorageClient
+    assert isinstance(client, SftpStorageClient)
+
+
+def test_iterate_files(client):
+    assert list(client.iterate_files('a/*.csv')) == ['a/x1.csv', 'a/x2.csv']
+    assert list(client.iterate_files('a/.*.csv')) == ['a/.x3.csv']
+    assert list(client.iterate_files('*/*/x*.csv')) == ['a/b/x4.csv']
+    assert list(client.iterate_files('c.txt')) == ['c.txt']
+    assert list(client.iterate_files('missing/*.csv')) == []
+    assert list(client.iterate_files('missing.txt')) == []
+
+    file_infos = list(client.iterate_file_infos('a/x1.csv'))
+    assert [(file_info.name, file_info.size) for file_info in file_infos] == [('a/x1.csv', 8)]
+    assert file_infos[0].last_modified.tzinfo
+
+
+def test_iterate_directory(client):
+    assert [file_info.name for file_info in client.iterate_directory('a')] \
+        == ['a/.h/', 'a/.x3.csv', 'a/b/', 'a/x1.csv', 'a/x2.csv']
+    assert list(client.iterate_directory('missing')) == []
+    assert list(client.iterate_directory(''))[0] == FileInfo(name='a/')
+
+
+def test_read(client, root):
+    assert client.read_file('a/x1.csv') == b'a/x1.csv'
+    assert client.read_range('a/x1.csv', 2, 2) == b'x1'
+    assert client.read_range('a/x1.csv', 6, 100) == b'sv'
+    assert client.file_size('a/b/x4.csv') == 10
+    # SFTP transfers the modification time in seconds
+    assert client.last_modification_timestamp('c.txt') \
+        == datetime.datetime.fromtimestamp(int((root / 'c.txt').stat().st_mtime)).astimezone()
+    with pytest.raises(FileNotFoundError):
+        client.read_file('missing.txt')
+
+
+def test_upload_file_and_append(client, root, tmp_path):
+    local_path = pathlib.Path(tmp_path) / 'upload.log'
+    local_path.write_bytes(b'a\n')
+    client.upload_file(str(local_path), 'new/dir/events.log')
+    assert (root / 'new' / 'dir' / 'events.log').read_bytes() == b'a\n'
+
+    assert client.append('new/dir/events.log', b'b\n') == 4
+    assert client.append('other/events.log', b'c\n') == 2
+    assert (root / 'new' / 'dir' / 'events.log').read_bytes() == b'a\nb\n'
+    assert (root / 'other' / 'events.log').read_bytes() == b'c\n'
+
+
+def test_read_files_command(client, root):
+    import shutil
+    import subprocess
+
+    from mara_storage import shell
+
+    if not shutil.which('curl'):
+        pytest.skip('curl is not installed')
+    for name in ['a b/x "1".csv', 'a b/x#2\\.csv', 'a b/.x3.csv']:
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(name.encode() + b'\n')
+
+    command = shell.read_files_command(client._storage, file_pattern='a b/x*.csv')
+    (exitcode, stdout) = subprocess.getstatusoutput(command)
+    assert exitcode == 0
+    assert stdout == 'a b/x "1".csv\na b/x#2\\.csv'
+
+
+def test_upload_directory_command(root, tmp_path):
+    import shutil
+    import subprocess
+
+    import paramiko
+
+    from benchmarks import emulators
+    from mara_storage import shell
+
+    if not shutil.which('sftp'):
+        pytest.skip('sftp is not installed')
+    # the stand-in accepts any key, sftp reads passwords only from a terminal
+    identity_file = pathlib.Path(tmp_path) / 'id_rsa'
+    paramiko.RSAKey.generate(2048).write_private_key_file(str(identity_file))
+    local_directory = pathlib.Path(tmp_path) / 'upload'
+    for name in ['a b.txt', 'sub/x"y*.txt', 'sub/z\\.txt']:
+        (local_directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (local_directory / name).write_bytes(name.encode())
+    (pathlib.Path(tmp_path) / 'empty').mkdir()
+
+    with emulators.SftpServer(str(root)) as server:
+        storage = storages.SftpStorage(host='127.0.0.1', port=server.port, user='test',
+                                       identity_file=str(identity_file), insecure=True)
+        command = shell.upload_directory_command(storage, str(local_directory), 'up/l"o&a|d', parallelism=2)
+        (exitcode, _) = subprocess.getstatusoutput(command)
+        assert exitcode == 0
+        for name in ['a b.txt', 'sub/x"y*.txt', 'sub/z\\.txt']:
+            assert (root / 'up' / 'l"o&a|d' / name).read_bytes() == name.encode()
+
+        command = shell.upload_directory_command(storage, str(pathlib.Path(tmp_path) / 'empty'), 'empty')
+        (exitcode, output) = subprocess.getstatusoutput(command)
+        assert exitcode == 0
+        assert 'No such file' not in output
+        assert (root / 'empty').is_dir()
+
+
+def test_delete_file_command(root, tmp_path):
+    import shutil
+    import subprocess
+
+    import paramiko
+
+    from benchmarks import emulators
+    from mara_storage import shell
+
+    if not shutil.which('sftp'):
+        pytest.skip('sftp is not installed')
+    identity_file = pathlib.Path(tmp_path) / 'id_rsa'
+    paramiko.RSAKey.generate(2048).write_private_key_file(str(identity_file))
+
+    with emulators.SftpServer(str(root)) as server:
+        # a port other than 22 and an identity file are passed as options before the destination
+        storage = storages.SftpStorage(host='127.0.0.1', port=server.port, user='test',
+                                       identity_file=str(identity_file), insecure=True)
+        (exitcode, _) = subprocess.getstatusoutput(shell.delete_file_command(storage, 'c.txt'))
+        assert exitcode == 0
+        assert not (root / 'c.txt').exists()
@@ -0,0 +1,81 @@
+import pathlib
+
+import pytest
+
+from mara_storage import manage, sharding, storages
+from mara_storage.client import FileInfo, StorageClient
+
+
+@pytest.fixture(params=['memory', 'local'])
+def storage(request, tmp_path):
+    if request.param == 'memory':
+        storage = storages.MemoryStorage('sharding-test')
+    else:
+        storage = storages.LocalStorage(pathlib.Path(tmp_path) / 'storage')
+    manage.ensure_storage(storage)
+    for day in range(1, 11):
+        for i in range(day):
+            write_file(storage, f'events/2026-10-{day:02}/{i}.csv', b'x' * (i + 1))
+    write_file(storage, 'events/README', b'')
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+def write_file(storage: storages.Storage, path: str, data: bytes):
+    if isinstance(storage, storages.LocalStorage):
+        file_path = storage.base_path / path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(data)
+    else:
+        StorageClient(storage).write_file(path, data)
+
+
+def test_iterate_directory(storage):
+    client = StorageClient(storage)
+    entries = list(client.iterate_directory('events'))
+    assert [entry.name for entry in entries] == [f'events/2026-10-{day:02}/' for day in range(1, 11)] + ['events/README']
+    assert entries[-1].size == 0
+    assert [(entry.name, entry.size) for entry in client.iterate_directory('events/2026-10-02/')] \
+        == [('events/2026-10-02/0.csv', 1), ('events/2026-10-02/1.csv', 2)]
+    assert [entry.name for entry in client.iterate_directory('')] == ['events/']
+    assert list(client.iterate_directory('missing')) == []
+
+
+@pytest.mark.parametrize('shard_by', sharding.SHARD_BY)
+def test_shards_cover_listing(storage, shard_by: str):
+    client = StorageClient(storage)
+    files = list(client.iterate_files('events/*/*.csv'))
+    assert len(files) == 55
+
+    shards = [list(client.iterate_files('events/*/*.csv', shard_index=i, shard_count=4, shard_by=shard_by))
+              for i in range(4)]
+    assert sorted(file for shard in shards for file in shard) == sorted(files)
+    assert all(shard for shard in shards)
+
+    file_infos = [list(client.iterate_file_infos('events/*/*.csv', shard_index=i, shard_count=4, shard_by=shard_by))
+                  for i in range(4)]
+    assert [[file_info.name for file_info in shard] for shard in file_infos] == shards
+
+    if shard_by == 'directory':
+        directories = [{file.rsplit('/', 1)[0] for file in shard} for shard in shards]
+        assert sum(len(shard) for shard in directories) == 10
+    elif shard_by == 'size':
+        totals = [sum(file_info.size for file_info in shard) for shard in file_infos]
+        assert max(totals) - min(totals) <= 10
+
+
+def test_balance_by_size():
+    file_infos = [FileInfo(f'{i}.csv', size) for i, size in enumerate([10, 1, 7, 3, 3, 2, None])]
+    assert sharding.balance_by_size(file_infos, 2) == {'0.csv': 0, '2.csv': 1, '3.csv': 1, '4.csv': 0,
+                                                       '5.csv': 1, '1.csv': 1, '6.csv': 0}
+    assert sharding.shard_of('events/2026-10-17', 8) == sharding.shard_of('events/2026-10-17', 8)
+
+
+def test_invalid_shard(storage):
+    with pytest.raises(ValueError):
+        list(StorageClient(storage).iterate_files('events/*/*.csv', shard_index=4, shard_count=4))
+    with pytest.raises(ValueError):
+        list(StorageClient(storage).iterate_files('events/*/*.csv', shard_index=0, shard_count=4, shard_by='hash'))
+    for kwargs in [{'shard_index': 0}, {'shard_count': 4}]:
+        with pytest.raises(ValueError, match='shard_index and shard_count must be given together'):
+            list(StorageClient(storage).iterate_file_infos('events/*/*.csv', **kwargs))
@@ -0,0 +1,105 @@
+import os
+import pathlib
+
+import pytest
+
+from mara_storage import manage, storages, tailing
+from mara_storage.client import StorageClient
+
+
+@pytest.fixture(params=['memory', 'local'])
+def storage(request, tmp_path):
+    if request.param == 'memory':
+        storage = storages.MemoryStorage('tailing-test')
+    else:
+        storage = storages.LocalStorage(pathlib.Path(tmp_path) / 'storage')
+    manage.ensure_storage(storage)
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+def write_file(storage: storages.Storage, path: str, data: bytes):
+    """Writes a file in place, keeping the inode of local files"""
+    if isinstance(storage, storages.LocalStorage):
+        (storage.base_path / path).write_bytes(data)
+    else:
+        StorageClient(storage).write_file(path, data)
+
+
+def test_read_new_data(storage, tmp_path):
+    store = tailing.FileCheckpointStore(str(tmp_path / 'checkpoints'))
+    key = tailing.checkpoint_key(storage, 'access.log')
+
+    write_file(storage, 'access.log', b'a\nb\nc')
+    assert tailing.read_new_data(storage, 'access.log', store, complete_lines=True).data == b'a\nb\n'
+    assert tailing.read_new_data(storage, 'access.log', store).data == b'c'
+    assert tailing.read_new_data(storage, 'access.log', store).data == b''
+
+    write_file(storage, 'access.log', b'a\nb\nc\nd' + b'x' * 2000)
+    new_data = tailing.read_new_data(storage, 'access.log', store, max_bytes=10)
+    assert new_data == (b'\nd' + b'x' * 8, store.load(key), False)
+    assert new_data.checkpoint.offset == 15
+
+    # truncated
+    write_file(storage, 'access.log', b'e\n')
+    assert tailing.read_new_data(storage, 'access.log', store) == (b'e\n', store.load(key), True)
+
+    # rotated: another file with the same path and different first bytes
+    write_file(storage, 'access.log', b'f\ng\nh\n')
+    new_data = tailing.read_new_data(storage, 'access.log', store, save=False)
+    assert new_data.data == b'f\ng\nh\n' and new_data.rotated
+    assert tailing.read_new_data(storage, 'access.log', store).data == b'f\ng\nh\n'
+
+
+def test_rotation_by_inode(tmp_path):
+    storage = storages.LocalStorage(pathlib.Path(tmp_path))
+    store = tailing.MemoryCheckpointStore()
+    key = tailing.checkpoint_key(storage, 'access.log')
+    (tmp_path / 'access.log').write_bytes(b'a\n')
+    assert tailing.read_new_data(storage, 'access.log', store).data == b'a\n'
+
+    # the same content, but another file
+    os.rename(tmp_path / 'access.log', tmp_path / 'access.log.1')
+    (tmp_path / 'access.log').write_bytes(b'a\nb\n')
+    assert tailing.read_new_data(storage, 'access.log', store) == (b'a\nb\n', store.checkpoints[key], True)
+
+    with open(tmp_path / 'access.log', 'ab') as f:
+        f.write(b'c\n')
+    assert tailing.read_new_data(storage, 'access.log', store) == (b'c\n', store.checkpoints[key], False)
+
+
+def test_appends_on_google_cloud_storage(monkeypatch):
+    pytest.importorskip('google.cloud.storage')
+    import google.auth.credentials
+    import google.cloud.storage
+    import mara_storage.client
+    from benchmarks import emulators
+    from mara_storage.google_cloud_storage import GoogleCloudStorageModuleClient
+
+    storage = storages.GoogleCloudStorage(bucket_name='tailing-test')
+    # objects have no identity kept by appends, each compose creates a new generation
+    assert tailing.file_identity(storage, 'access.log') is None
+
+    with emulators.FakeGcsServer() as server:
+        client = GoogleCloudStorageModuleClient(storage)
+        client._GoogleCloudStorageModuleClient__client = google.cloud.storage.Client(
+            project='tailing-test', credentials=google.auth.credentials.AnonymousCredentials(),
+            client_options={'api_endpoint': server.url})
+        monkeypatch.setattr(mara_storage.client, 'StorageClient', lambda storage: client)
+        store = tailing.MemoryCheckpointStore()
+
+        client.append('access.log', b'a\n')
+        assert tailing.read_new_data(storage, 'access.log', store)[::2] == (b'a\n', False)
+        client.append('access.log', b'b\n')
+        assert tailing.read_new_data(storage, 'access.log', store)[::2] == (b'b\n', False)
+
+
+def test_line_longer_than_max_bytes(storage):
+    store = tailing.MemoryCheckpointStore()
+    write_file(storage, 'access.log', b'x' * 50 + b'\nshort\npartial')
+
+    assert tailing.read_new_data(storage, 'access.log', store, max_bytes=10, complete_lines=True).data == b'x' * 50 + b'\n'
+    assert tailing.read_new_data(storage, 'access.log', store, max_bytes=10, complete_lines=True).data == b'short\n'
+    # the last line is still being written
+    assert tailing.read_new_data(storage, 'access.log', store, max_bytes=10, complete_lines=True).data == b''
+    assert tailing.read_new_data(storage, 'access.log', store).data == b'partial'
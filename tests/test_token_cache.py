@@ -0,0 +1,98 @@
+import datetime
+import json
+import multiprocessing
+import os
+import subprocess
+import time
+
+import pytest
+
+from mara_storage import config, shell, storages, token_cache
+
+
+def fetch_counted(directory: str):
+    """Returns a fetch function which counts its calls in a file"""
+    def fetch():
+        with open(os.path.join(directory, 'fetches'), 'a') as f:
+            f.write('x')
+        time.sleep(0.2)
+        return 'token', time.time() + 3600
+    return fetch
+
+
+def fetch_in_process(directory: str):
+    assert token_cache.TokenCache(directory).token('key', fetch_counted(directory)) == ('token', pytest.approx(time.time() + 3600, abs=10))
+
+
+def test_token_shared_between_processes(tmp_path):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=fetch_in_process, args=(str(tmp_path),)) for _ in range(8)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    assert (tmp_path / 'fetches').read_text() == 'x'
+    assert os.stat(token_cache.TokenCache(str(tmp_path))._path('key')).st_mode & 0o777 == 0o600
+
+
+def test_token_refreshed_ahead_of_expiry(tmp_path):
+    cache = token_cache.TokenCache(str(tmp_path), refresh_ahead=60)
+    tokens = iter([('first', time.time() + 30), ('second', time.time() + 3600)])
+
+    assert cache.token('key', lambda: next(tokens))[0] == 'first'
+    # the first token expires within `refresh_ahead`
+    assert cache.token('key', lambda: next(tokens))[0] == 'second'
+    assert cache.token('key', lambda: next(tokens))[0] == 'second'
+    assert token_cache.TokenCache(str(tmp_path)).token('key', lambda: next(tokens))[0] == 'second'
+    assert cache.token('other key', lambda: ('other', time.time() + 3600))[0] == 'other'
+
+
+class FakeGoogleCredentials:
+    def __init__(self):
+        self.service_account_email = 'test@example.iam.gserviceaccount.com'
+        self.scopes = ['https://www.googleapis.com/auth/devstorage.full_control']
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+
+def test_cache_google_credentials(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'token_cache_directory', lambda: str(tmp_path))
+
+    first = token_cache.cache_google_credentials(FakeGoogleCredentials())
+    first.refresh(None)
+    second = token_cache.cache_google_credentials(FakeGoogleCredentials())
+    second.refresh(None)
+
+    assert first.token == second.token == 'token-1'
+    assert second.refreshes == 0
+    assert abs((second.expiry - first.expiry).total_seconds()) < 1
+
+
+def test_azcopy_login_env(tmp_path, monkeypatch):
+    storage = storages.AzureStorage(account_name='account', container_name='container', spa_tenant='tenant',
+                                    spa_application='application', spa_client_secret='secret')
+    assert 'AZCOPY_AUTO_LOGIN_TYPE=SPN' in shell.azcopy_login_env(storage)
+
+    def fetch():
+        raise AssertionError('the token is fetched when the command is created')
+
+    monkeypatch.setattr(config, 'token_cache_directory', lambda: str(tmp_path))
+    monkeypatch.setattr(token_cache, 'azure_service_principal_token', fetch)
+    login_env = shell.azcopy_login_env(storage)
+    assert 'AZCOPY_AUTO_LOGIN_TYPE' not in login_env
+
+    # the token is read from the cache when the command runs
+    token_cache.TokenCache(str(tmp_path)).token(token_cache._azure_service_principal_key(storage),
+                                               lambda: ('access-token', time.time() + 3600))
+    (exitcode, stdout) = subprocess.getstatusoutput(login_env + 'printenv AZCOPY_OAUTH_TOKEN_INFO')
+    assert exitcode == 0, stdout
+    assert json.loads(stdout)['access_token'] == 'access-token'
+    assert 'access-token' not in login_env
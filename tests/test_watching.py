@@ -0,0 +1,158 @@
+import json
+import os
+import pathlib
+import queue
+import shutil
+import threading
+import time
+
+import pytest
+
+from mara_storage import config, manage, storages, watching
+from mara_storage.client import FileInfo, StorageClient
+
+
+@pytest.fixture
+def memory_storage():
+    storage = storages.MemoryStorage('watching-test')
+    manage.ensure_storage(storage)
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+def changes(source: watching.ChangeSource, timeout: float = 1) -> set:
+    """Waits for the next changes of a source, as (kind, name) tuples"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = source.wait(deadline - time.monotonic())
+        if result:
+            return {(change.kind, change.file_info.name) for change in result}
+    return set()
+
+
+def test_polling(memory_storage):
+    client = StorageClient(memory_storage)
+    client.write_file('incoming/a.csv', b'a')
+    client.write_file('incoming/a.txt', b'a')
+
+    with watching.PollingSource(memory_storage, 'incoming/*.csv', min_interval=0.01, max_interval=0.04,
+                                backoff=2) as source:
+        assert [file_info.name for file_info in source.start()] == ['incoming/a.csv']
+
+        client.write_file('incoming/b.csv', b'b')
+        client.write_file('incoming/a.csv', b'changed')
+        assert changes(source) == {('created', 'incoming/b.csv'), ('modified', 'incoming/a.csv')}
+        assert source.interval == 0.01
+
+        # the interval grows while nothing changes
+        assert source.poll() == [] and source.poll() == [] and source.poll() == []
+        assert source.interval == 0.04
+
+        client.delete_file('incoming/b.csv')
+        assert changes(source) == {('deleted', 'incoming/b.csv')}
+        assert source.interval == 0.01
+        assert source.wait(0) == []
+
+
+@pytest.mark.skipif(watching._inotify() is None, reason='inotify is not available')
+def test_inotify(tmp_path):
+    storage = storages.LocalStorage(pathlib.Path(tmp_path))
+    (tmp_path / 'incoming' / '2026-10-18').mkdir(parents=True)
+    (tmp_path / 'incoming' / '2026-10-18' / 'a.csv').write_bytes(b'a')
+    (tmp_path / 'incoming' / '2026-10-18' / '.a.csv').write_bytes(b'a')
+
+    with watching.InotifySource(storage, 'incoming/*/*.csv') as source:
+        assert [file_info.name for file_info in source.start()] == ['incoming/2026-10-18/a.csv']
+
+        # a new directory is watched, also when files were written into it before the watch
+        directory = tmp_path / 'incoming' / '2026-10-19'
+        directory.mkdir()
+        (directory / 'b.csv').write_bytes(b'b')
+        (directory / 'b.txt').write_bytes(b'b')
+        assert changes(source) == {('created', 'incoming/2026-10-19/b.csv')}
+
+        (directory / 'b.csv').write_bytes(b'changed')
+        assert changes(source) == {('modified', 'incoming/2026-10-19/b.csv')}
+
+        (directory / 'c.tmp').write_bytes(b'c')
+        os.rename(directory / 'c.tmp', directory / 'c.csv')
+        assert changes(source) == {('created', 'incoming/2026-10-19/c.csv')}
+
+        shutil.rmtree(directory)
+        assert changes(source) == {('deleted', 'incoming/2026-10-19/b.csv'), ('deleted', 'incoming/2026-10-19/c.csv')}
+        assert source.wait(0.05) == []
+
+
+@pytest.mark.skipif(watching._inotify() is None, reason='inotify is not available')
+def test_wait_for_file(tmp_path):
+    storage = storages.LocalStorage(pathlib.Path(tmp_path))
+    assert watching.wait_for_file(storage, 'export/**/_SUCCESS', timeout=0.05) is None
+
+    def deliver():
+        time.sleep(0.1)
+        (tmp_path / 'export' / '2026' / '10').mkdir(parents=True)
+        (tmp_path / 'export' / '2026' / '10' / '_SUCCESS').write_bytes(b'')
+
+    thread = threading.Thread(target=deliver)
+    thread.start()
+    file_info = watching.wait_for_file(storage, 'export/**/_SUCCESS', timeout=5)
+    thread.join()
+    assert file_info.name == 'export/2026/10/_SUCCESS' and file_info.size == 0
+    assert watching.wait_for_file(storage, 'export/**/_SUCCESS', timeout=0).name == 'export/2026/10/_SUCCESS'
+
+
+def test_matches():
+    assert watching._matches(('a', 'b.csv'), ('a', '*.csv'))
+    assert not watching._matches(('a', '.b.csv'), ('a', '*.csv'))
+    assert watching._matches(('a', 'b', 'c', 'd.csv'), ('a', '**', '*.csv'))
+    assert watching._matches(('a', 'd.csv'), ('a', '**', '*.csv'))
+    assert not watching._matches(('a', '.b', 'd.csv'), ('a', '**', '*.csv'))
+    assert watching._matches(('a', 'b', 'c'), ('a', '**'))
+    assert watching._may_contain_matches(('a', 'b'), ('a', '*', '*.csv'))
+    assert not watching._may_contain_matches(('a', 'b', 'c'), ('a', '*', '*.csv'))
+    assert not watching._may_contain_matches(('b',), ('a', '*', '*.csv'))
+    assert watching._may_contain_matches(('a', 'b', 'c'), ('a', '**', '*.csv'))
+
+
+def test_notifications(memory_storage, monkeypatch):
+    StorageClient(memory_storage).write_file('incoming/a.csv', b'a')
+    notifications = queue.Queue()
+    monkeypatch.setattr(config, 'change_notifications', lambda alias: notifications)
+
+    a = FileInfo('incoming/a.csv', 1, etag='1')
+    b = FileInfo('incoming/b.csv', 1, etag='2')
+    for change in [watching.Change('created', b), watching.Change('created', b),  # delivered twice
+                   watching.Change('created', FileInfo('outgoing/c.csv', 1, etag='3')),
+                   watching.Change('created', a._replace(etag='4')),
+                   watching.Change('deleted', FileInfo('incoming/d.csv'))]:
+        notifications.put(change)
+
+    assert [(change.kind, change.file_info) for change in watching.watch(memory_storage, 'incoming/*.csv', timeout=0.1)] \
+        == [('created', b), ('modified', a._replace(etag='4'))]
+
+
+def test_parse_notification():
+    gcs = storages.GoogleCloudStorage(bucket_name='data')
+    message = {'attributes': {'eventType': 'OBJECT_FINALIZE', 'bucketId': 'data', 'objectId': 'incoming/a.csv'},
+               'data': json.dumps({'name': 'incoming/a.csv', 'size': '12', 'etag': 'CKih16GjycYCEAE=',
+                                   'updated': '2026-10-19T08:15:00.123Z'}).encode()}
+    change = watching.parse_notification(gcs, message)
+    assert change.kind == 'created' and change.file_info.size == 12 and change.file_info.etag == 'CKih16GjycYCEAE='
+    assert change.file_info.last_modified.isoformat() == '2026-10-19T08:15:00.123000+00:00'
+
+    message['attributes'].update(eventType='OBJECT_DELETE', overwrittenByGeneration='2')
+    assert watching.parse_notification(gcs, message) is None
+    del message['attributes']['overwrittenByGeneration']
+    assert watching.parse_notification(gcs, message).kind == 'deleted'
+    message['attributes']['bucketId'] = 'other'
+    assert watching.parse_notification(gcs, message) is None
+
+    azure = storages.AzureStorage(account_name='account', container_name='data', sas='sas')
+    event = {'topic': '/subscriptions/s/resourceGroups/g/providers/Microsoft.Storage/storageAccounts/account',
+             'subject': '/blobServices/default/containers/data/blobs/incoming/a.csv',
+             'eventType': 'Microsoft.Storage.BlobCreated',
+             'data': {'contentLength': 12, 'eTag': '0x8D4BCC2E4835CD0'}}
+    assert watching.parse_notification(azure, json.dumps(event)) \
+        == ('created', FileInfo('incoming/a.csv', 12, etag='0x8D4BCC2E4835CD0'))
+    event['subject'] = '/blobServices/default/containers/other/blobs/incoming/a.csv'
+    assert watching.parse_notification(azure, event) is None
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+
+import pytest
+
+from mara_storage import manage, storages
+from mara_storage.client import StorageClient
+from mara_storage.memory_storage import MemoryStorageClient
+from mara_storage.write_behind import MANIFEST_FILE_NAME, WriteBehindWriter
+
+
+@pytest.fixture
+def storage():
+    storage = storages.MemoryStorage('write-behind-test')
+    manage.ensure_storage(storage)
+    yield storage
+    manage.drop_storage(storage, force=True)
+
+
+def test_write_behind(storage):
+    with WriteBehindWriter(storage, max_workers=4) as writer:
+        for i in range(100):
+            with writer.open(f'part-{i:03}.txt') as f:
+                f.write(f'content {i}'.encode())
+        writer.write_file('other/file.txt', b'other')
+        spool_directory = writer.spool_directory
+
+    client = StorageClient(storage)
+    assert len(list(client.iterate_files('part-*.txt'))) == 100
+    assert client.read_file('part-042.txt') == b'content 42'
+    assert client.read_file('other/file.txt') == b'other'
+    assert not os.path.exists(spool_directory)
+
+
+def test_write_behind_backpressure(storage, monkeypatch):
+    uploading = threading.Semaphore(0)
+    upload_file = MemoryStorageClient.upload_file
+
+    def blocked_upload_file(self, local_path: str, path: str):
+        uploading.acquire()
+        upload_file(self, local_path, path)
+
+    monkeypatch.setattr(MemoryStorageClient, 'upload_file', blocked_upload_file)
+
+    writer = WriteBehindWriter(storage, max_workers=2, max_spool_bytes=15)
+    for i in range(3):
+        writer.write_file(f'{i}.txt', b'12345')
+    # 15 bytes are spooled, the next write has to wait for an upload
+    produced = threading.Event()
+    producer = threading.Thread(target=lambda: (writer.write_file('3.txt', b'12345'), produced.set()))
+    producer.start()
+    assert not produced.wait(0.2)
+    assert writer.pending_bytes == 15
+
+    for _ in range(4):
+        uploading.release()
+    producer.join()
+    writer.flush()
+    assert writer.pending_files == 0
+    assert len(list(StorageClient(storage).iterate_files('*.txt'))) == 4
+    writer.close()
+
+
+def test_write_behind_keeps_order_of_same_path(storage, monkeypatch):
+    upload_file = MemoryStorageClient.upload_file
+
+    def slow_first_upload_file(self, local_path: str, path: str):
+        with open(local_path, 'rb') as f:
+            if f.read() == b'first':
+                time.sleep(0.2)
+        upload_file(self, local_path, path)
+
+    monkeypatch.setattr(MemoryStorageClient, 'upload_file', slow_first_upload_file)
+
+    with WriteBehindWriter(storage, max_workers=4) as writer:
+        writer.write_file('file.txt', b'first')
+        writer.write_file('file.txt', b'second')
+    assert StorageClient(storage).read_file('file.txt') == b'second'
+
+
+def test_write_behind_raises_upload_errors(storage, monkeypatch):
+    def failing_upload_file(self, local_path: str, path: str):
+        raise OSError(f'can not upload {path}')
+
+    monkeypatch.setattr(MemoryStorageClient, 'upload_file', failing_upload_file)
+
+    writer = WriteBehindWriter(storage)
+    writer.write_file('file.txt', b'content')
+    with pytest.raises(OSError, match='file.txt'):
+        writer.flush()
+    # the spool file is kept and listed in the manifest
+    assert len(os.listdir(writer.spool_directory)) == 2
+    with open(os.path.join(writer.spool_directory, MANIFEST_FILE_NAME)) as f:
+        spool_path, path = f.read().rstrip('\n').split('\t')
+    assert path == 'file.txt'
+    with open(spool_path, 'rb') as f:
+        assert f.read() == b'content'
+    writer.close()
+
+
+def test_write_behind_uploads_other_files_after_errors(storage, monkeypatch):
+    written = threading.Event()
+    upload_file = MemoryStorageClient.upload_file
+
+    def failing_upload_file(self, local_path: str, path: str):
+        written.wait()
+        if path == 'failing.txt':
+            raise OSError(f'can not upload {path}')
+        upload_file(self, local_path, path)
+
+    monkeypatch.setattr(MemoryStorageClient, 'upload_file', failing_upload_file)
+
+    writer = WriteBehindWriter(storage, max_workers=1)
+    writer.write_file('failing.txt', b'failing')
+    for i in range(3):
+        writer.write_file(f'{i}.txt', b'content')
+    written.set()
+    with pytest.raises(OSError, match='failing.txt'):
+        writer.close()
+    assert len(list(StorageClient(storage).iterate_files('*.txt'))) == 3
+    with open(os.path.join(writer.spool_directory, MANIFEST_FILE_NAME)) as f:
+        assert [line.split('\t')[1] for line in f.read().splitlines()] == ['failing.txt']
+
+
+def test_write_behind_keeps_added_files_after_errors(storage, monkeypatch, tmp_path):
+    def failing_upload_file(self, local_path: str, path: str):
+        raise OSError(f'can not upload {path}')
+
+    monkeypatch.setattr(MemoryStorageClient, 'upload_file', failing_upload_file)
+
+    writer = WriteBehindWriter(storage)
+    writer.write_file('failing.txt', b'failing')
+    while writer.pending_files:
+        time.sleep(0.01)
+
+    # the writer owns an added file, which is listed in the manifest when it is rejected
+    local_path = tmp_path / 'added.txt'
+    local_path.write_bytes(b'added')
+    with pytest.raises(OSError, match='failing.txt'):
+        writer.add_file(str(local_path), 'added.txt')
+    with pytest.raises(OSError, match='failing.txt'):
+        writer.close()
+
+    with open(os.path.join(writer.spool_directory, MANIFEST_FILE_NAME)) as f:
+        manifest = [line.split('\t') for line in f.read().splitlines()]
+    assert [path for _, path in manifest] == ['failing.txt', 'added.txt']
+    assert manifest[1][0] == str(local_path)
+    assert local_path.read_bytes() == b'added'
+
+
+def test_upload_file_command(storage, tmp_path):
+    local_path = tmp_path / 'file.txt'
+    local_path.write_bytes(b'content')
+
+    # the default implementation uses `shell.write_file_command`
+    client = StorageClient(storage)
+    StorageClient.upload_file(client, str(local_path), 'sub/file.txt')
+    assert client.read_file('sub/file.txt') == b'content'